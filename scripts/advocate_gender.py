@@ -7,16 +7,12 @@ Rule-based process:
     introduce them as "Ms." or "Mr.". We extract this as the gender of the advocate
     - If he doesn't introduce them this way, we look up the advocates first name in a gender dictionary
 """
-import json, os
-from convokit import Corpus, download
+import json, os, argparse
 from collections import defaultdict, Counter
-import pandas as pd
 
 from utils import *
 
-import nltk
-from nltk import word_tokenize
-nltk.download("punkt")
+CASEID2GENDERS_PATH = "data/caseid2genders.json"
 
 
 def extract_last_gender_title_mention(tokenized_text):
@@ -37,6 +33,7 @@ def create_load_lookupname2gender():
     """
     fname = "data/name2gender.json"
     if not os.path.exists(fname):
+        import pandas as pd
         gender_df = pd.read_csv(
             "../raw_data/wgnd_ctry.csv"
         )  # gendered name dict, https://dataverse.harvard.edu/dataset.xhtml?persistentId=doi:10.7910/DVN/YPRQH8#
@@ -78,9 +75,20 @@ def get_speaker_gender_dictionary(name, name2gender):
         return None
 
 
-def parse_gender(corpus, name2gender, verbose=False, start_year=1980):
+def load_caseid2genders(fname=CASEID2GENDERS_PATH):
     """
-    Rule-based process: zx
+    Loads the persistent case -> {advocate name: gender} cache written by parse_gender
+    (a defaultdict, so cases without advocate introductions give an empty dict)
+    """
+    if not os.path.exists(fname):
+        return defaultdict(dict)
+    with open(fname, "r") as r:
+        return defaultdict(dict, json.load(r))
+
+
+def parse_gender(corpus, name2gender, verbose=False, start_year=1980, fout=CASEID2GENDERS_PATH, refresh=False):
+    """
+    Rule-based process:
         - Get the names of the advocates
         - Prior to the advocate's first utterance, the Chief Justice will
         introduce them as "Ms." or "Mr.". We extract this as the gender of the advocate
@@ -90,12 +98,18 @@ def parse_gender(corpus, name2gender, verbose=False, start_year=1980):
         2019_18-877
         24929__0_000
         We'll hear argument next in Case 18-877, Allen versus Cooper. Mr. Shaffer.
+
+    Only the introductions are tokenized, i.e. the utterance before an advocate's first utterance
+    of a section, and only for the cases that are not in the cache fout yet. The genders of the new cases
+    are merged into fout (one file for all terms), so later runs and terms reuse them.
+    refresh == True recomputes the cases of this corpus instead of reusing the cache.
+
+    Output: the merged cache, case id -> {advocate name: gender}
     """
+    caseid2genders = load_caseid2genders(fout)
     prev_section = None
-    prev_gender_mention = None
-    prev_text = None
-
-    caseid2genders = defaultdict(dict)
+    prev_utt = None
+    new_genders = defaultdict(dict)
 
     for i, utt in enumerate(corpus.iter_utterances()):
         # check to make sure case is in the year we want
@@ -103,55 +117,71 @@ def parse_gender(corpus, name2gender, verbose=False, start_year=1980):
         year = int(case_id.split("_")[0])
         if year < start_year:
             continue
-
-        if verbose:
-            print(case_id)
+        if case_id not in new_genders and (refresh or case_id not in caseid2genders):
+            new_genders[case_id] = {}
 
         # e.g. utt_id=24834__0_00 is section=0
         # and utt_id = 24834__1_018 is section=1
         section = utt.id.split("__")[-1].split("_")[0]
 
-        text = utt.text.strip()
-        tokenized_text = [t for t in word_tokenize(text)]
-        gender_ment = extract_last_gender_title_mention(tokenized_text)
-
         # we get the chief justice at the very first utterance
         # OR when a new advocate comes in
-        if utt.id.split("__")[-1] == "0_001" or section != prev_section:
+        if case_id in new_genders and (utt.id.split("__")[-1] == "0_001" or section != prev_section):
             if utt.speaker.meta["type"] != "A":
                 if verbose:
                     print(utt.id, utt.speaker.meta["type"], utt.speaker.meta["name"])
             else:
                 adv_name = utt.speaker.meta["name"]
                 adv_name = adv_name.replace(",", "")  # need to do this for the Jr.s in the csv and to be consistent
-                gender = prev_gender_mention
+                # the introduction is the last "Mr." or "Ms." in the previous utterance
+                gender = None if prev_utt is None else extract_last_gender_title_mention(tokenize(prev_utt.text.strip()))
 
                 # Second step: if we don't have a "Mr." or "Mrs." look up the first name in a dictionary
                 # Thank you, counsel. General Wall?
                 if gender == None:
                     gender = get_speaker_gender_dictionary(adv_name, name2gender)
 
-                if caseid2genders[case_id].get(adv_name) == None:
-                    caseid2genders[case_id][adv_name] = gender
+                if new_genders[case_id].get(adv_name) == None:
+                    new_genders[case_id][adv_name] = gender
 
                 if gender == None:
                     if verbose:
-                        print(adv_name, prev_gender_mention, prev_text)
+                        print(adv_name, None if prev_utt is None else prev_utt.text)
 
         # reset for next utt
         prev_section = section
-        prev_gender_mention = gender_ment
-        prev_text = utt.text
-
-    fout = "data/caseid2genders.json"
-    with open(fout, "w") as w:
-        json.dump(caseid2genders, w)
-    print("wrote to {0} cases ->".format(len(caseid2genders)), fout)
+        prev_utt = utt
+
+    if len(new_genders) > 0:
+        caseid2genders.update(new_genders)
+        if os.path.dirname(fout) and not os.path.exists(os.path.dirname(fout)): os.makedirs(os.path.dirname(fout))
+        # write to a temporary file first, so an interrupted run never leaves a broken cache
+        with open(f"{fout}.{os.getpid()}.tmp", "w") as w:
+            json.dump(caseid2genders, w)
+        os.replace(f"{fout}.{os.getpid()}.tmp", fout)
+    print("{0} new cases, {1} cases in ->".format(len(new_genders), len(caseid2genders)), fout)
     return caseid2genders
 
 
 if __name__ == "__main__":
-    start_year = 1980
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--offline", action="store_true", help="only use local ConvoKit corpora and NLTK punkt")
+    parser.add_argument("--refresh", action="store_true", help="recompute the genders of all cases instead of reusing data/caseid2genders.json")
+    parser.add_argument("--terms", type=int, nargs=2, metavar=("START", "END"), default=None,
+                        help="parse the term corpora START <= year < END one by one, as create_analyze_chunks.py does (default: the full corpus)")
+    args = parser.parse_args()
+
+    config = load_config()
+    # the first term of the analysis (e.g. 1955 with config-full-history.yaml)
+    start_year = args.terms[0] if args.terms is not None else config['start_year']
+    ensure_punkt(offline=args.offline)
     name2gender = create_load_lookupname2gender()
-    corpus = Corpus(filename=download("supreme-corpus"))
-    parse_gender(corpus, name2gender, verbose=True, start_year=start_year)
\ No newline at end of file
+    if args.terms is not None:
+        from corpus_cache import iter_term_corpora
+        set_tokenizer(config.get("tokenizer", "nltk"), offline=args.offline)
+        for year, corpus in iter_term_corpora(range(args.terms[0], args.terms[1]), config, offline=args.offline):
+            parse_gender(corpus, name2gender, verbose=False, start_year=start_year, refresh=args.refresh)
+    else:
+        set_tokenizer("nltk", offline=args.offline)
+        corpus = load_corpus("supreme-corpus", offline=args.offline)
+        parse_gender(corpus, name2gender, verbose=True, start_year=start_year, refresh=args.refresh)
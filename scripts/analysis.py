@@ -0,0 +1,274 @@
+"""
+This file runs the main and supplementary analyses of our paper headlessly
+(the computations in analysis.ipynb and supplemental_analysis.ipynb) after running filter.py
+
+    python analysis.py [--force] [--part all|main|supplemental]
+
+The main (run_analysis) and supplementary analyses (run_supplemental_analysis) are independent and can run
+as two processes (see pipeline.py). They write to config['results_path']
+    - table2a.tex: Table 2A (per-justice E[Y], theta_gender and theta_ideology) as LaTeX rows
+    - table3.csv: Table 3, effects aggregated by justice gender with 95% CIs and the gender/ideology ratios
+    - tableA1.csv: Table A1, conditional means of Y given the case topic (C) and advocate gender (T)
+    - table4.csv: Table 4, mediation analyses (NDE and NIE) from 2007 onwards
+    - df_figure5.csv: the input to interruptionsPlot.r
+    - results.json: Tables 2A and 3 and the fingerprint of the inputs
+    - supplemental_results.json: Tables A1 and 4 and the fingerprint of the inputs
+
+The per-justice estimates and the mediation bootstraps are cached in config['estimates_path'],
+and if none of the inputs changed since the last run the results are loaded from the json files.
+"""
+import sys, os
+import argparse
+import json
+import pprint
+import pandas as pd
+import numpy as np
+
+from utils import *
+from mediation_estimands import add_disfluency_tertiles, get_estimands_multi
+from filter import join_chunk_features, filter_justices
+
+# Mediators in Table 4 (in order: speech disfluencies, ideological alignment, advocate experience)
+MEDIATORS = ['adv_disfl_rate_tertiles', 'ideology_matches', 'adv_experience_bin']
+MEDIATION_START_YEAR = 2007 # the sample restriction of Table 4 in supplemental_analysis.ipynb (df['case_year'] >= 2007)
+
+def reorganize(df, col, order):
+    df = df.reindex(df[col].map(dict(zip(list(order), range(len(list(order)))))).sort_values().index)
+    return df
+
+def justice_effects_ordered(df_ey_j, df_theta_gender_j, df_theta_ideology_j):
+    """
+    One row per justice, ordered by theta gender from largest to smallest (Figure 4 and Table 2A)
+    """
+    order_justices_to_plot = df_theta_gender_j.sort_values(by='theta', ascending=False)['justice_name']
+    df_gender_ordered = reorganize(df_theta_gender_j, 'justice_name', order_justices_to_plot).reset_index(drop=True)
+    df_ideology_ordered = reorganize(df_theta_ideology_j, 'justice_name', order_justices_to_plot).reset_index(drop=True)
+    df_y_ordered = reorganize(df_ey_j, 'justice_name', order_justices_to_plot).reset_index(drop=True)
+
+    # Double-check the names are in the same order and same number of chunks
+    np.testing.assert_array_equal(df_gender_ordered['justice_name'].to_numpy(),
+                                  df_ideology_ordered['justice_name'].to_numpy(),
+                                  df_y_ordered['justice_name'].to_numpy())
+    np.testing.assert_array_equal(df_gender_ordered['total_num_chunks'].to_numpy(),
+                                  df_ideology_ordered['total_num_chunks'].to_numpy())
+
+    df_new = df_y_ordered[['justice_name', 'E[Y]']].copy()
+    df_new['Y std'] = df_y_ordered['std'].to_numpy()
+    df_new['Gender Effect'] = df_gender_ordered['theta'].to_numpy()
+    df_new['Gender Effect (Std)'] = df_gender_ordered['theta_std'].to_numpy()
+    df_new['Ideological Alignment Effect'] = df_ideology_ordered['theta'].to_numpy()
+    df_new['Ideological Alignment Effect (Std)'] = df_ideology_ordered['theta_std'].to_numpy()
+    df_new['N (Chunks)'] = df_ideology_ordered['total_num_chunks'].to_numpy()
+    df_new['justice_ideology'] = df_gender_ordered['justice_ideology'].to_numpy()
+    return df_new
+
+def table2a_latex_rows(df_new):
+    """
+    Table 2A in the appendix, one LaTeX row per justice
+    """
+    rows = []
+    for i, row in df_new.iterrows():
+        # We want each row to look like:
+        # \textit{Kagan} & 8.98 (0.29)  &  -1.04 (0.92) & 0.17 (0.62) & 1,456\\
+        row_str = ""
+        row_str += f"{row['justice_name']}"
+        row_str += f"& {np.round(row['E[Y]'], 2)} ({np.round(row['Y std'], 2)})"
+        row_str += f"& {np.round(row['Gender Effect'], 2)} ({np.round(row['Gender Effect (Std)'], 2)})"
+        row_str += f"& {np.round(row['Ideological Alignment Effect'], 2)} ({np.round(row['Ideological Alignment Effect (Std)'], 2)})"
+        row_str += f"& {row['N (Chunks)']} \\\\"
+        rows.append(row_str)
+    return rows
+
+def figure5_df(df_new, config=None):
+    """
+    The dataframe read by interruptionsPlot.r
+
+    justice2ideologyscores.json only has the justices of our paper; with config['mq_scores_path'] set, the other
+    justices get the mean of their per-term Martin-Quinn scores, otherwise they are left out of the figure (and printed)
+    """
+    with open('../raw_data/justice2ideologyscores.json', 'r') as f:
+        justice_ideology_scores = json.load(f)
+    if config is not None and config.get('mq_scores_path'):
+        mq_means = load_mq_scores(config['mq_scores_path']).groupby(level=0).mean()
+        for last_name, score in mq_means.items():
+            justice_ideology_scores.setdefault(last_name, float(score))
+    df_figure5 = df_new[['justice_name', 'Gender Effect', 'Gender Effect (Std)']].copy()
+    df_figure5['justice_last_name'] = df_figure5.apply(lambda x: justice_last_name(x['justice_name']), axis=1)
+    missing = ~df_figure5['justice_last_name'].isin(list(justice_ideology_scores))
+    if missing.any():
+        print('Figure 5: no ideology score for (left out)', df_figure5.loc[missing, 'justice_name'].tolist())
+        df_figure5 = df_figure5[~missing].copy()
+    df_figure5['justice_ideology_scores'] = df_figure5.apply(lambda x: justice_ideology_scores[x['justice_last_name']], axis=1)
+    df_figure5['Gender Effect (1.96*Std)'] = df_figure5.apply(lambda x: 1.96*x['Gender Effect (Std)'], axis=1)
+    df_figure5 = df_figure5[['justice_name', 'Gender Effect', 'Gender Effect (Std)', 'justice_ideology_scores', 'justice_last_name', 'Gender Effect (1.96*Std)']]
+    return df_figure5
+
+def table3(df_theta_gender_j, df_theta_ideology_j):
+    """
+    Table 3: mean of the per-justice effects over all, male and female justices,
+    with CIs from the per-justice bootstraps (aggregate_ci)
+    """
+    out = []
+    for group, gender in [('All', None), ('M', 'M'), ('F', 'F')]:
+        row = {'justices': group}
+        for name, df_j in [('theta_gender', df_theta_gender_j), ('theta_ideology', df_theta_ideology_j)]:
+            subset = df_j if gender is None else df_j[df_j['justice_gender']==gender]
+            row[name] = subset["theta"].mean()
+            row[name+'_ci'] = aggregate_ci(subset, "theta_std")
+        row['ratio'] = ratio(row['theta_gender'], row['theta_ideology'])
+        out.append(row)
+    return pd.DataFrame(out)
+
+def tableA1(config):
+    """
+    Table A1: Conditional means of interruption, Y given whether the case topic is
+    about gender issues or not (C) and the advocate gender (T). Includes the cases with "female issues".
+    """
+    df_raw = load_chunks_df(config)
+    df_fem = filter_justices(join_chunk_features(df_raw, verbose=False, config=config), dict(config, include_fem_issue=True), verbose=False)
+    out = []
+    for adv_gender in ['M', 'F']:
+        for female_issue, issue in [(0, 'Other issue'), (1, 'Gender issue')]:
+            df_cell = df_fem[(df_fem['advocate_gender']==adv_gender) & (df_fem['female_issue']==female_issue)]
+            out.append({'C': issue, 'T': adv_gender, 'E[Y|C,T]': df_cell['adv_interruption_rate'].mean(), 'num_chunks': len(df_cell)})
+    return pd.DataFrame(out)
+
+def mediation_estimates(df, config):
+    """
+    Table 4 mediation analyses (from 2007 onwards), cached in config['estimates_path']
+    on the contents of the final dataframe and num_bootstrap_samples
+    """
+    fname = os.path.join(config['estimates_path'], 'mediation.csv')
+    fingerprint_fname = os.path.join(config['estimates_path'], 'mediation.txt')
+    fingerprint = content_fingerprint([config['final_df_path']], extra={'num_bootstrap_samples': config['num_bootstrap_samples'],
+                                                                         'mediators': MEDIATORS,
+                                                                         'start_year': MEDIATION_START_YEAR})
+    if os.path.exists(fname) and os.path.exists(fingerprint_fname):
+        with open(fingerprint_fname, 'r') as r:
+            if r.read().strip() == fingerprint:
+                print("Loaded cached mediation estimates from ", fname)
+                return pd.read_csv(fname)
+
+    df_subset = add_disfluency_tertiles(df[df['case_year'] >= MEDIATION_START_YEAR])
+    df_mediation = get_estimands_multi(df_subset, MEDIATORS, ['advocate_gender'], 'adv_interruption_rate',\
+                                       config['num_bootstrap_samples'], load_justice_gender())
+    if not os.path.exists(config['estimates_path']): os.makedirs(config['estimates_path'], exist_ok=True)
+    df_mediation.to_csv(fname, index=False)
+    with open(fingerprint_fname, 'w') as w:
+        w.write(fingerprint)
+    return df_mediation
+
+def table4(df_mediation):
+    """
+    Table 4: average NDE and NIE over all, male and female justices with 95% CIs (1.96*std)
+    """
+    df_avg = df_mediation[df_mediation['group'] != 'justice'].copy()
+    df_avg['ci'] = 1.96*df_avg['std']
+    return df_avg[['group', 'estimand', 'mediator', 'estimate', 'ci', 'num_chunks']].reset_index(drop=True)
+
+def analysis_fingerprint(config):
+    """
+    Fingerprint of everything the results depend on: the chunks, the final dataframe,
+    the pipeline decisions in config and the analysis code
+    """
+    fnames = sorted(list_chunk_files(config)) + [config['final_df_path'], 'analysis.py', 'utils.py', 'filter.py', 'mediation_estimands.py']
+    return content_fingerprint(fnames, extra=config)
+
+def cached_results(config, results_fname, force, compute):
+    """
+    Output: the results of compute() with the fingerprint of the inputs (analysis_fingerprint), saved to
+    results_fname; loaded from results_fname instead if the fingerprint is unchanged
+    """
+    fingerprint = analysis_fingerprint(config)
+    if not force and os.path.exists(results_fname):
+        with open(results_fname, 'r') as r:
+            results = json.load(r)
+        if results['fingerprint'] == fingerprint:
+            print("Inputs unchanged, loaded results from ", results_fname)
+            return results
+
+    results = dict(fingerprint=fingerprint, **compute())
+    with open(results_fname, 'w') as w:
+        json.dump(results, w, indent=1, default=float)
+    return results
+
+def run_analysis(config, force=False):
+    """
+    The main analysis (analysis.ipynb)
+
+    Output: dictionary with Tables 2A and 3 (also saved to config['results_path']+'results.json')
+    """
+    path = config['results_path']
+    if not os.path.exists(path): os.makedirs(path, exist_ok=True)
+
+    def compute():
+        df = load_final_df(config)
+        df_ey_j, df_theta_gender_j, df_theta_ideology_j = load_or_compute_estimates(config, df=df)
+        df_new = justice_effects_ordered(df_ey_j, df_theta_gender_j, df_theta_ideology_j)
+        df_figure5 = figure5_df(df_new, config)
+        df_table3 = table3(df_theta_gender_j, df_theta_ideology_j)
+        table2a_rows = table2a_latex_rows(df_new)
+
+        with open(os.path.join(path, 'table2a.tex'), 'w') as w:
+            w.write('\n'.join(table2a_rows)+'\n')
+        df_table3.to_csv(os.path.join(path, 'table3.csv'), index=False)
+        df_figure5.to_csv(os.path.join(path, 'df_figure5.csv'))
+        print("Saved results to ->", path)
+        return {'table2a': df_new.to_dict(orient='records'),
+                'table3': df_table3.to_dict(orient='records')}
+    return cached_results(config, os.path.join(path, 'results.json'), force, compute)
+
+def run_supplemental_analysis(config, force=False):
+    """
+    The supplementary analyses (supplemental_analysis.ipynb); independent of run_analysis, so the two can run concurrently
+
+    Output: dictionary with Tables A1 and 4 (also saved to config['results_path']+'supplemental_results.json')
+    """
+    path = config['results_path']
+    if not os.path.exists(path): os.makedirs(path, exist_ok=True)
+
+    def compute():
+        df = load_final_df(config)
+        df_tableA1 = tableA1(config)
+        df_table4 = table4(mediation_estimates(df, config))
+
+        df_tableA1.to_csv(os.path.join(path, 'tableA1.csv'), index=False)
+        df_table4.to_csv(os.path.join(path, 'table4.csv'), index=False)
+        print("Saved supplementary results to ->", path)
+        return {'tableA1': df_tableA1.to_dict(orient='records'),
+                'table4': df_table4.to_dict(orient='records')}
+    return cached_results(config, os.path.join(path, 'supplemental_results.json'), force, compute)
+
+def print_results(results):
+    if 'table2a' in results:
+        print("----Table 2A----")
+        for row in table2a_latex_rows(pd.DataFrame(results['table2a'])):
+            print(row)
+    if 'table3' in results:
+        print("----Table 3----")
+        for row in results['table3']:
+            print(f"Justices:{row['justices']}, theta_gender ", np.round(row['theta_gender'], 2), "+-", np.round(row['theta_gender_ci'], 2))
+            print(f"Justices:{row['justices']}, theta_ideology ", np.round(row['theta_ideology'], 2), "+-", np.round(row['theta_ideology_ci'], 2))
+            print(f"Justices:{row['justices']}, ratio ", np.round(row['ratio'], 2))
+    if 'tableA1' in results:
+        print("----Table A1----")
+        for row in results['tableA1']:
+            print(f"E[Y|C = {row['C']}, T = {row['T']}]", np.round(row['E[Y|C,T]'], 2))
+    if 'table4' in results:
+        print("----Table 4----")
+        for row in results['table4']:
+            print(f"Justices:{row['group']}, {row['estimand'].upper()}, Mediator:{row['mediator']}", np.round(row['estimate'], 2), "+-", np.round(row['ci'], 2))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--force', action='store_true', help='re-run the analysis even if the inputs are unchanged')
+    parser.add_argument('--part', choices=['all', 'main', 'supplemental'], default='all',
+                        help='only the main (Tables 2A and 3) or the supplementary analyses (Tables A1 and 4)')
+    args = parser.parse_args()
+
+    config = load_config()
+    pprint.pprint(config)
+    if args.part in ['all', 'main']:
+        print_results(run_analysis(config, force=args.force))
+    if args.part in ['all', 'supplemental']:
+        print_results(run_supplemental_analysis(config, force=args.force))
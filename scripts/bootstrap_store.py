@@ -0,0 +1,179 @@
+"""
+This file keeps the bootstrap replicates of E[Y], theta_gender and theta_ideology on disk, so that a bootstrap
+can be resumed after a crash or extended (e.g., from 1000 to 10000 samples) instead of starting over, and
+confidence intervals (percentile, BCa) can be computed from the stored replicates
+
+    python bootstrap_store.py [--num_bootstraps N] [--cluster case_id] [--seed 0]
+
+The replicates of a data frame are stored in config['estimates_path']+'bootstrap/<fingerprint>_seed<seed>_<cluster>/'
+    - meta.json: the data fingerprint, justices, cluster, seed and batch size
+    - batch_00000.npz, batch_00001.npz, ...: the replicates (ey, gender, ideology; batch size x num justices)
+Batch b is drawn with the random generator seeded by (seed, b), so the first N replicates are the same
+however many batches are computed (or in which runs), and a missing batch is simply recomputed.
+The intervals are written to config['results_path']+'bootstrap_intervals.csv'
+"""
+import os
+import json
+import hashlib
+import argparse
+import pprint
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from utils import *
+
+KEYS = ['ey', 'gender', 'ideology']
+
+def data_fingerprint(df, cluster=None):
+    """
+    Hash of the columns the bootstrap uses (in row order), so the replicates are only reused for the same data
+    """
+    cols = ['justice_name', 'advocate_gender', 'ideology_matches', 'adv_interruption_rate']
+    if cluster is not None: cols += [cluster] if isinstance(cluster, str) else list(cluster)
+    hashes = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+    return hashlib.sha256(hashes.tobytes()).hexdigest()
+
+def replicate_store_path(path, fingerprint, seed, cluster=None):
+    cluster_name = 'chunk' if cluster is None else (cluster if isinstance(cluster, str) else '+'.join(cluster))
+    return os.path.join(path, f'{fingerprint[:16]}_seed{seed}_{cluster_name}')
+
+def save_batch(fname, batch):
+    # write to a temporary file first, so a run that dies while saving never leaves a partial batch
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'wb') as w:
+        np.savez(w, **{key: batch[key] for key in KEYS})
+    os.replace(tmp_fname, fname)
+
+def load_or_extend_replicates(df, num_bootstraps, path, seed=0, cluster=None, batch_size=100):
+    """
+    Returns the first num_bootstraps bootstrap replicates of df (see utils.bootstrap_replicates),
+    computing and saving only the batches that are not in the store yet
+
+    Inputs:
+        - path (str): directory with the replicate stores, e.g. config['estimates_path']+'bootstrap/'
+        - seed (int)
+        - cluster (str, optional): resample whole clusters (e.g., 'case_id'); None resamples chunks
+        - batch_size (int): number of replicates per file (an existing store keeps its own batch size)
+    Output: dictionary with keys ey, gender, ideology (arrays of shape (num_bootstraps, num justices)) and justices
+    """
+    justices = sorted(df['justice_name'].unique())
+    fingerprint = data_fingerprint(df, cluster)
+    store_path = replicate_store_path(path, fingerprint, seed, cluster)
+    meta_fname = os.path.join(store_path, 'meta.json')
+    if os.path.exists(meta_fname):
+        with open(meta_fname, 'r') as r:
+            meta = json.load(r)
+        assert meta['fingerprint'] == fingerprint and meta['justices'] == justices
+        batch_size = meta['batch_size']
+    else:
+        if not os.path.exists(store_path): os.makedirs(store_path)
+        with open(meta_fname, 'w') as w:
+            json.dump({'fingerprint': fingerprint, 'justices': justices, 'cluster': cluster,
+                       'seed': seed, 'batch_size': batch_size}, w)
+
+    num_batches = -(-num_bootstraps // batch_size)
+    fnames = [os.path.join(store_path, f'batch_{b:05d}.npz') for b in range(num_batches)]
+    missing = [b for b in range(num_batches) if not os.path.exists(fnames[b])]
+    print(f"Bootstrap replicates: {num_batches-len(missing)} of {num_batches} batches in store", store_path)
+    if len(missing) > 0:
+        cell_sums = cluster_cell_sums(df, cluster)
+        for b in missing:
+            save_batch(fnames[b], replicates_from_cell_sums(cell_sums, justices, batch_size, np.random.default_rng([seed, b])))
+
+    out = {key: [] for key in KEYS}
+    for fname in fnames:
+        with np.load(fname) as batch:
+            for key in KEYS: out[key].append(batch[key])
+    out = {key: np.concatenate(out[key])[:num_bootstraps] for key in KEYS}
+    out['justices'] = justices
+    return out
+
+def jackknife_estimates(df, cluster=None):
+    """
+    Leave-one-cluster-out (cluster == None: leave-one-chunk-out) estimates per justice, from the cluster cell sums
+
+    Output: dictionary with keys ey, gender, ideology, each a list (one array of num clusters per justice), and justices
+    """
+    justices = sorted(df['justice_name'].unique())
+    cell_sums = cluster_cell_sums(df, cluster)
+    out = {key: [] for key in KEYS}
+    for justice in justices:
+        for key, estimates in zip(KEYS, estimates_from_cell_sums(cell_sums[justice].sum(axis=0) - cell_sums[justice])):
+            out[key].append(estimates)
+    out['justices'] = justices
+    return out
+
+def percentile_interval(replicates, alpha=0.05):
+    """
+    Percentile interval per justice from the replicates (num_bootstraps x num justices), ignoring NaN replicates
+    """
+    return np.array([np.nanquantile(col, [alpha/2, 1-alpha/2]) if np.isfinite(col).any() else [np.nan, np.nan]
+                     for col in replicates.T])
+
+def bca_interval(replicates, point, jackknife, alpha=0.05):
+    """
+    Bias-corrected and accelerated (BCa) interval per justice
+
+    Inputs:
+        - replicates (np.array): num_bootstraps x num justices
+        - point (np.array): the estimates on the full data, per justice
+        - jackknife (list): the leave-one-cluster-out estimates per justice (see jackknife_estimates)
+    """
+    out = np.full((len(point), 2), np.nan)
+    z_alpha = norm.ppf([alpha/2, 1-alpha/2])
+    for j, (col, theta, jack) in enumerate(zip(replicates.T, point, jackknife)):
+        col, jack = col[np.isfinite(col)], jack[np.isfinite(jack)]
+        if len(col) == 0 or not np.isfinite(theta): continue
+        # bias correction: the share of replicates below the estimate (ties count half)
+        z0 = norm.ppf((np.sum(col < theta) + 0.5*np.sum(col == theta)) / len(col))
+        if not np.isfinite(z0): continue
+        # acceleration: the skewness of the jackknife estimates
+        diff = jack.mean() - jack
+        denom = 6 * np.sum(diff**2)**1.5
+        acc = np.sum(diff**3) / denom if denom > 0 else 0.
+        levels = norm.cdf(z0 + (z0 + z_alpha) / (1 - acc * (z0 + z_alpha)))
+        out[j] = np.quantile(col, levels)
+    return out
+
+def bootstrap_intervals(df, replicates, cluster=None, alpha=0.05):
+    """
+    Output: pd.DataFrame with one row per justice and effect (E[Y], theta_gender, theta_ideology) and columns
+    estimate, std, percentile_lower, percentile_upper, bca_lower, bca_upper, num_bootstraps
+    """
+    cell_sums = cluster_cell_sums(df, cluster)
+    point = dict(zip(KEYS, estimates_from_cell_sums(np.stack([cell_sums[justice].sum(axis=0) for justice in replicates['justices']]))))
+    jackknife = jackknife_estimates(df, cluster)
+    out = []
+    for key, effect in zip(KEYS, ['E[Y]', 'theta_gender', 'theta_ideology']):
+        percentile = percentile_interval(replicates[key], alpha)
+        bca = bca_interval(replicates[key], point[key], jackknife[key], alpha)
+        out.append(pd.DataFrame({'justice_name': replicates['justices'], 'effect': effect, 'estimate': point[key],
+                                 'std': replicate_std(replicates[key]),
+                                 'percentile_lower': percentile[:, 0], 'percentile_upper': percentile[:, 1],
+                                 'bca_lower': bca[:, 0], 'bca_upper': bca[:, 1],
+                                 'num_bootstraps': len(replicates[key])}))
+    return pd.concat(out, ignore_index=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_bootstraps', type=int, default=None, help='default: num_bootstrap_samples in config.yaml')
+    parser.add_argument('--cluster', default=None, help='e.g. case_id (default: bootstrap_cluster in config.yaml)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    args = parser.parse_args()
+
+    config = load_config()
+    pprint.pprint(config)
+    num_bootstraps = args.num_bootstraps or config['num_bootstrap_samples']
+    cluster = args.cluster or config.get('bootstrap_cluster')
+    df = load_final_df(config)
+    replicates = load_or_extend_replicates(df, num_bootstraps, os.path.join(config['estimates_path'], 'bootstrap'),
+                                           seed=args.seed, cluster=cluster)
+    df_intervals = bootstrap_intervals(df, replicates, cluster=cluster, alpha=args.alpha)
+    print(df_intervals.to_string())
+
+    if not os.path.exists(config['results_path']): os.makedirs(config['results_path'])
+    fname = os.path.join(config['results_path'], 'bootstrap_intervals.csv')
+    df_intervals.to_csv(fname, index=False)
+    print("Saved bootstrap intervals to ->", fname)
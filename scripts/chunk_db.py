@@ -0,0 +1,132 @@
+"""
+This file holds the SQLite chunk database, an indexed copy of the chunks written by create_analyze_chunks.py
+
+If config['chunk_db_path'] is set, analyzechunks also writes the chunks of every case to it
+(one transaction per case, so several extraction workers can write to the same database).
+The chunks can then be queried by justice, advocate, case or term without reading every chunk file,
+and load_chunks_df_sql / load_final_df_sql push the config filters down into the query.
+
+To build the database from chunk files that are already on disk:
+
+    python chunk_db.py
+"""
+import os
+import json
+import sqlite3
+
+from utils import load_config, list_chunk_files
+from chunk_records import read_chunk_file, json_line
+
+# Columns we index or filter on; the full chunk dictionary is kept in "record"
+COLUMNS = ['case_id', 'case_year', 'justice_name', 'advocate_name', 'utt_id_first', 'advocate_ideology', 'female_issue']
+
+def connect_chunk_db(db_path, timeout=60):
+    """
+    Opens (and if needed creates) the chunk database in WAL mode, so readers do not block the writers
+    and concurrent writers wait up to timeout seconds for each other instead of failing
+    """
+    if os.path.dirname(db_path) and not os.path.exists(os.path.dirname(db_path)): os.makedirs(os.path.dirname(db_path))
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={int(timeout*1000)}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute("""CREATE TABLE IF NOT EXISTS chunks (
+                        case_id TEXT NOT NULL, case_year INTEGER, justice_name TEXT, advocate_name TEXT,
+                        utt_id_first TEXT, advocate_ideology TEXT, female_issue INTEGER, record TEXT NOT NULL)""")
+    for col in ['justice_name', 'case_id', 'case_year', 'advocate_name']:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_chunks_{col} ON chunks ({col})')
+    return conn
+
+def write_case_chunks(db_path, case_id, chunks):
+    """
+    Replaces the chunks of case_id with chunks (chunk_records.ChunkColumns, the chunks analyzechunks wrote for this case)
+    in a single transaction, so re-running a case never leaves duplicate or partial chunks
+    """
+    positions = [chunks.fields.index(col) for col in COLUMNS] if len(chunks) > 0 else []
+    conn = connect_chunk_db(db_path)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM chunks WHERE case_id = ?', (case_id,))
+        conn.executemany(f'INSERT INTO chunks ({", ".join(COLUMNS)}, record) VALUES ({", ".join(["?"]*(len(COLUMNS)+1))})',
+                         [[row[p] for p in positions] + [json_line(chunks.fields, row)] for row in chunks.rows()])
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def import_chunk_files(config):
+    """
+    Fills config['chunk_db_path'] from the chunk files in config['chunk_path']
+    """
+    fnames = sorted(list_chunk_files(config))
+    for fname in fnames:
+        case_id = os.path.splitext(os.path.basename(fname))[0]
+        write_case_chunks(config['chunk_db_path'], case_id, read_chunk_file(fname))
+    print(f"Imported {len(fnames)} cases ->", config['chunk_db_path'])
+
+def chunk_query(config, justices=None, advocates=None, case_ids=None, years=None):
+    """
+    Returns the WHERE clause and its parameters for the chunks load_chunks_df keeps
+    (case_year >= start_year and, if exclude_adv_first_utt, not starting at the first two utterances),
+    optionally restricted to some justices, advocates, cases or years (terms)
+    """
+    where = ['case_year >= ?']
+    params = [config['start_year']]
+    if config['exclude_adv_first_utt'] == True:
+        where.append("substr(utt_id_first, -3) NOT IN ('000', '001')")
+    for col, values in [('justice_name', justices), ('advocate_name', advocates), ('case_id', case_ids), ('case_year', years)]:
+        if values is None: continue
+        values = list(values)
+        where.append(f'{col} IN ({", ".join(["?"]*len(values))})')
+        params += values
+    return ' AND '.join(where), params
+
+def load_chunks_df_sql(config, justices=None, advocates=None, case_ids=None, years=None):
+    """
+    Same as utils.load_chunks_df, but from config['chunk_db_path'] with the filters in the query
+    (see chunk_query for the optional justices, advocates, case_ids and years)
+    """
+    import pandas as pd
+    conn = connect_chunk_db(config['chunk_db_path'])
+    where, params = chunk_query(config, justices, advocates, case_ids, years)
+    rows = conn.execute(f'SELECT record FROM chunks WHERE {where} ORDER BY case_id, rowid', params).fetchall()
+    if config['exclude_adv_first_utt'] == True:
+        num_exclude_adv_first_utt = conn.execute("SELECT COUNT(*) FROM chunks WHERE case_year >= ? AND substr(utt_id_first, -3) IN ('000', '001')",
+                                                 [config['start_year']]).fetchone()[0]
+    else:
+        num_exclude_adv_first_utt = 0
+    conn.close()
+
+    df = pd.DataFrame([json.loads(row[0]) for row in rows])
+    assert df.shape == df.drop_duplicates().shape
+    print(f'num_exclude_adv_first_utt={num_exclude_adv_first_utt}')
+    return df
+
+def load_final_df_sql(config, verbose=False):
+    """
+    The final dataframe of filter.py (go_join_filter) straight from config['chunk_db_path'].
+
+    The row filters are in the query: the chunks with a conservative/liberal advocate ideology (the rows
+    join_chunk_features keeps). The joins are then made as in filter.py, and the justices are counted after
+    them (join_chunk_features drops the chunks with missing values in any column), so the justices with more than
+    min_num_chunks_per_just chunks and, if include_fem_issue == False, the female issue filter are those of filter.py.
+    """
+    import pandas as pd
+    from filter import join_chunk_features, filter_justices
+    conn = connect_chunk_db(config['chunk_db_path'])
+    where, params = chunk_query(config)
+    where += " AND advocate_ideology IN ('conservative', 'liberal')"
+    rows = conn.execute(f'SELECT record FROM chunks WHERE {where} ORDER BY case_id, rowid', params).fetchall()
+    conn.close()
+
+    df = join_chunk_features(pd.DataFrame([json.loads(row[0]) for row in rows]), verbose=verbose, config=config)
+    df = filter_justices(df, config, verbose=verbose)
+    print("Loaded final df from ", config['chunk_db_path'])
+    print("Number of rows=", len(df))
+    return df
+
+if __name__ == '__main__':
+    config = load_config()
+    import_chunk_files(config)
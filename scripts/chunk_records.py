@@ -0,0 +1,145 @@
+"""
+This file holds the chunk record type (ChunkRecord, one chunk of analyzechunks) and the typed column buffers
+the chunk files are written from and loaded into (ChunkColumns), so no dictionary is built per chunk
+
+The fields have a fixed order (FIELDS, then the optional groups a run computes, see record_fields) and a type.
+The chunk file of a case is, depending on config['chunk_format']:
+    - "jsonl": <case_id>.jsonl, one json dictionary per chunk (as in our paper)
+    - "columns": <case_id>.columns, a header line
+          {"schema": "chunk_records", "version": 1, "fields": [...], "num_chunks": n}
+      and then one json list (the column) per field, in field order. Readers check the header (read_header)
+      before parsing the columns, so a file of another schema version is rejected by reading one line.
+"""
+import json
+import numpy as np
+
+SCHEMA_NAME = 'chunk_records'
+SCHEMA_VERSION = 1
+
+# (field, type) in record order
+FIELDS = [('case_id', str), ('case_year', int), ('justice_name', str), ('advocate_name', str),
+          ('utt_id_first', str), ('utt_id_last', str), ('advocate_gender', str), ('num_utts', int),
+          ('num_utts_adv', int), ('num_utts_justice', int), ('num_toks_total', int), ('num_toks_adv', int),
+          ('num_toks_justice', int), ('advocate_ideology', str), ('justice_ideology', str),
+          ('adv_experience_int', int), ('adv_experience_bin', int), ('female_issue', int),
+          ('num_adv_utts_interrupted', int), ('num_justice_utts_interrupted', int),
+          ('adv_interruption_rate', float), ('justice_interruption_rate', float),
+          ('num_adv_disfl', int), ('num_justice_disfl', int),
+          ('num_adv_toks_in_utts_interrupted', int), ('num_justice_toks_in_utts_interrupted', int)]
+# optional groups: adv_experience "timeline", mq_scores_path, timing_features and the candidate chunks of the sweep
+TIMELINE_FIELDS = [('adv_days_since_last_arg', int), ('adv_experience_justice_int', int)]
+MQ_FIELDS = [('justice_ideology_term', str)]
+TIMING_FIELDS = [('num_adv_to_justice_turns', int), ('num_justice_to_adv_turns', int),
+                 ('num_adv_utts_overlapped', int), ('num_justice_utts_overlapped', int),
+                 ('adv_overlap_sec', float), ('justice_overlap_sec', float),
+                 ('adv_to_justice_latency_sec', float), ('justice_to_adv_latency_sec', float),
+                 ('adv_turn_sec', float), ('justice_turn_sec', float)]
+SWEEP_FIELDS = [('sweep_min_num_utts', int)]
+ALL_FIELDS = FIELDS + TIMELINE_FIELDS + MQ_FIELDS + TIMING_FIELDS + SWEEP_FIELDS
+FIELD_DTYPES = {name: {str: object, int: np.int64, float: np.float64}[t] for name, t in ALL_FIELDS}
+
+CHUNK_FILE_EXTS = {'jsonl': '.jsonl', 'columns': '.columns'}
+
+def record_fields(config, timeline=False, sweep=False):
+    """
+    The fields of the chunk records of a run: FIELDS and the optional groups it computes
+    """
+    fields = FIELDS + (TIMELINE_FIELDS if timeline else []) + (MQ_FIELDS if config.get('mq_scores_path') else []) \
+        + (TIMING_FIELDS if config.get('timing_features', False) else []) + (SWEEP_FIELDS if sweep else [])
+    return [name for name, _ in fields]
+
+def json_line(fields, values):
+    # the same text as json.dumps of the dictionary, without building it
+    return '{' + ', '.join(f'{json.dumps(name)}: {json.dumps(value)}' for name, value in zip(fields, values)) + '}'
+
+class ChunkRecord:
+    """
+    One chunk; the fields that are not set are None
+    """
+    __slots__ = tuple(name for name, _ in ALL_FIELDS)
+
+    def __init__(self, **values):
+        for name in self.__slots__: setattr(self, name, None)
+        for name, value in values.items(): setattr(self, name, value)
+
+    def values(self, fields):
+        return [getattr(self, name) for name in fields]
+
+class ChunkColumns:
+    """
+    Column buffers (one list per field) of chunk records with the same fields
+    """
+    def __init__(self, fields=None):
+        self.fields = list(fields) if fields is not None else None
+        self.columns = [[] for _ in self.fields] if fields is not None else None
+
+    def __len__(self):
+        return 0 if not self.columns else len(self.columns[0])
+
+    def append(self, record):
+        for col, name in zip(self.columns, self.fields):
+            col.append(getattr(record, name))
+
+    def extend(self, other):
+        """
+        Appends the chunks of other (with the same fields) to these buffers
+        """
+        if len(other) == 0: return self
+        if self.fields is None or len(self) == 0 and self.fields != other.fields:
+            self.fields, self.columns = list(other.fields), [[] for _ in other.fields]
+        if other.fields != self.fields:
+            raise ValueError(f"chunk files with different fields ({len(self.fields)} and {len(other.fields)}); re-run create_analyze_chunks.py")
+        for col, other_col in zip(self.columns, other.columns):
+            col.extend(other_col)
+        return self
+
+    def arrays(self):
+        """
+        Output: dictionary field -> typed np.array (object for strings, int64, float64)
+        """
+        return {name: np.array(col, dtype=FIELD_DTYPES.get(name, object)) for name, col in zip(self.fields or [], self.columns or [])}
+
+    def rows(self):
+        return zip(*self.columns) if self.columns else iter([])
+
+    def write(self, fname, chunk_format='jsonl'):
+        with open(fname, 'w') as w:
+            if chunk_format == 'columns':
+                w.write(json.dumps({'schema': SCHEMA_NAME, 'version': SCHEMA_VERSION, 'fields': self.fields, 'num_chunks': len(self)}) + '\n')
+                for col in self.columns:
+                    w.write(json.dumps(col) + '\n')
+            else:
+                for row in self.rows():
+                    w.write(json_line(self.fields, row) + '\n')
+
+def read_header(fname):
+    """
+    Reads and checks the header line of a "columns" chunk file
+    """
+    with open(fname, 'r') as r:
+        header = json.loads(r.readline())
+    if header.get('schema') != SCHEMA_NAME or header.get('version') != SCHEMA_VERSION:
+        raise ValueError(f"{fname}: chunk schema {header.get('schema')} version {header.get('version')}, expected {SCHEMA_NAME} version {SCHEMA_VERSION}")
+    return header
+
+def read_chunk_file(fname):
+    """
+    Loads a chunk file (either format, by its extension) into column buffers
+    """
+    if fname.endswith(CHUNK_FILE_EXTS['columns']):
+        header = read_header(fname)
+        chunks = ChunkColumns(header['fields'])
+        with open(fname, 'r') as r:
+            r.readline()
+            chunks.columns = [json.loads(line) for line in r]
+        if len(chunks.columns) != len(chunks.fields) or any(len(col) != header['num_chunks'] for col in chunks.columns):
+            raise ValueError(f"{fname}: truncated chunk file")
+        return chunks
+    chunks = ChunkColumns()
+    for line in open(fname, 'r'):
+        dd = json.loads(line)
+        if chunks.fields is None: chunks = ChunkColumns(list(dd))
+        if dd.keys() != set(chunks.fields): raise ValueError(f"{fname}: chunks with different fields")
+        for col, name in zip(chunks.columns, chunks.fields):
+            col.append(dd.get(name))
+    return chunks
@@ -0,0 +1,166 @@
+"""
+This file resolves the ConvoKit corpora from a local mirror directory and loads the upcoming terms in the background
+
+If config['corpus_mirror_path'] is set, a corpus such as "supreme-2019" is read from <corpus_mirror_path>/supreme-2019/
+(a corpus directory as ConvoKit downloads it). The mirror keeps a sha256 checksum of every corpus in
+<corpus_mirror_path>/checksums.json and a corpus is only used if it still matches it. Corpora that are not in the mirror
+yet are downloaded with ConvoKit (unless offline) and copied into it.
+
+iter_term_corpora loads term N+1 (up to config['corpus_prefetch'] terms ahead) on a background thread while term N is chunked,
+so the I/O and deserialization of the corpora overlap with the chunking. To fill the mirror without chunking:
+
+    python corpus_cache.py [--offline]
+"""
+import os
+import json
+import queue
+import shutil
+import hashlib
+import argparse
+import threading
+
+from utils import load_config, load_corpus
+
+CHECKSUMS_FNAME = 'checksums.json'
+
+def corpus_checksum(path):
+    """
+    sha256 hex digest over the relative paths and contents of all the files in the corpus directory path
+    """
+    h = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(path)):
+        dirs.sort()
+        for fname in sorted(files):
+            full_fname = os.path.join(root, fname)
+            h.update(os.path.relpath(full_fname, path).encode())
+            with open(full_fname, 'rb') as r:
+                for block in iter(lambda: r.read(1 << 20), b''):
+                    h.update(block)
+    return h.hexdigest()
+
+def load_checksums(mirror_path):
+    fname = os.path.join(mirror_path, CHECKSUMS_FNAME)
+    if not os.path.exists(fname): return {}
+    with open(fname, 'r') as r:
+        return json.load(r)
+
+def save_checksums(mirror_path, checksums):
+    fname = os.path.join(mirror_path, CHECKSUMS_FNAME)
+    with open(f'{fname}.{os.getpid()}.tmp', 'w') as w:
+        json.dump(checksums, w, indent=1, sort_keys=True)
+    os.replace(f'{fname}.{os.getpid()}.tmp', fname)
+
+def add_to_mirror(name, mirror_path, offline=False):
+    """
+    Copies the corpus name from the ConvoKit downloads into the mirror and records its checksum
+    """
+    from convokit import download
+    src = download(name, use_local=True) if offline else download(name)
+    if src is None or not os.path.exists(src):
+        raise FileNotFoundError(f"{name} not found in the local ConvoKit downloads; run once without offline to download it")
+    dest = os.path.join(mirror_path, name)
+    # a temporary copy per process, so an interrupted copy or a concurrent run cannot block the mirror
+    tmp = f'{dest}.{os.getpid()}.tmp'
+    if os.path.exists(tmp): shutil.rmtree(tmp)
+    shutil.copytree(src, tmp)
+    if os.path.exists(dest): shutil.rmtree(dest, ignore_errors=True)
+    try:
+        os.replace(tmp, dest)
+    except OSError:
+        # another run added the corpus in the meantime
+        shutil.rmtree(tmp)
+    checksums = load_checksums(mirror_path)
+    checksums[name] = corpus_checksum(dest)
+    save_checksums(mirror_path, checksums)
+    print(f"Added {name} to the corpus mirror ->", dest)
+    return dest
+
+def resolve_corpus(name, mirror_path, offline=False):
+    """
+    Returns the directory of the corpus name in the mirror, after checking it against its recorded checksum.
+    Corpora that are missing (or do not match their checksum) are (re-)copied from the ConvoKit downloads.
+    """
+    dest = os.path.join(mirror_path, name)
+    checksums = load_checksums(mirror_path)
+    if os.path.exists(dest):
+        checksum = corpus_checksum(dest)
+        if name not in checksums:
+            # e.g., a corpus copied into the mirror by hand: trust it and record its checksum
+            checksums[name] = checksum
+            save_checksums(mirror_path, checksums)
+            return dest
+        if checksum == checksums[name]:
+            return dest
+        print(f"WARNING: {name} in the corpus mirror does not match its checksum, copying it again")
+    return add_to_mirror(name, mirror_path, offline=offline)
+
+def load_corpus_cached(name, config, offline=False):
+    """
+    Same as utils.load_corpus, but from config['corpus_mirror_path'] if it is set
+    """
+    mirror_path = config.get('corpus_mirror_path')
+    if mirror_path is None:
+        return load_corpus(name, offline=offline)
+    from convokit import Corpus
+    if not os.path.exists(mirror_path): os.makedirs(mirror_path)
+    return Corpus(filename=resolve_corpus(name, mirror_path, offline=offline))
+
+def iter_term_corpora(years, config, offline=False):
+    """
+    Yields (year, corpus) for the terms in years, e.g. range(start, end)
+
+    With config['corpus_prefetch'] = k > 0 the next k corpora are loaded on a background thread while
+    the current one is used; the queue is bounded, so at most k loaded corpora wait at any time (plus the one in use
+    and the one being loaded). k = 0 loads every corpus in the foreground.
+    """
+    years = list(years)
+    depth = config.get('corpus_prefetch', 1)
+    if depth <= 0:
+        for year in years:
+            yield year, load_corpus_cached("supreme-"+str(year), config, offline=offline)
+        return
+
+    loaded = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # give up if the consumer stopped early, instead of blocking on the full queue forever
+        while not stop.is_set():
+            try:
+                loaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def prefetch():
+        for year in years:
+            try:
+                item = (year, load_corpus_cached("supreme-"+str(year), config, offline=offline), None)
+            except BaseException as e:
+                put((year, None, e))
+                return
+            if not put(item): return
+
+    thread = threading.Thread(target=prefetch, daemon=True)
+    thread.start()
+    try:
+        for _ in years:
+            year, corpus, error = loaded.get()
+            # errors of the background thread (e.g., a missing corpus) are raised here
+            if error is not None: raise error
+            yield year, corpus
+    finally:
+        stop.set()
+        thread.join()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--offline', action='store_true', help='only use local ConvoKit corpora (also set by offline in config.yaml)')
+    args = parser.parse_args()
+
+    config = load_config()
+    assert config.get('corpus_mirror_path') is not None, "set corpus_mirror_path in config.yaml"
+    if not os.path.exists(config['corpus_mirror_path']): os.makedirs(config['corpus_mirror_path'])
+    for year in range(config['start_year'], config['end_year']):
+        print(resolve_corpus("supreme-"+str(year), config['corpus_mirror_path'], offline=args.offline or config.get('offline', False)))
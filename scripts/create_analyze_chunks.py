@@ -4,21 +4,20 @@ Individual functions have more detailed description.
 
 """
 import os, sys, re
-from convokit import Corpus, download
+import shutil
 import datetime, argparse
 import json
 import math
 import yaml
-
-import nltk
-from nltk import word_tokenize
-nltk.download("punkt")
+import numpy as np
 
 import utils
 from advocate_gender import *
 from utils import *
-import matplotlib.pyplot as plt
-import datetime
+from chunk_db import write_case_chunks
+from corpus_cache import iter_term_corpora
+from name_resolution import resolve_advocate, write_unresolved_report
+from chunk_records import ChunkRecord, ChunkColumns, record_fields
 
 all_total_backchannel_utts_ignored = 0 
 
@@ -133,9 +132,181 @@ def print_prev_utt_for_chunk(corpus, caseid2stuff, case="2019_17-834"):
     return arr
 
 
-def analyzechunks(corpus,caseid2stuff, name2gender,caseid2gender,utt_list,seen_advocates,min_num_utts=4,min_tok_adv=20):
+_corpus_positions = (None, None, None)
+
+def corpus_positions(corpus):
+    """
+    Returns the utterance ids of the corpus (in corpus order) and a dictionary utterance id -> position,
+    computed once per corpus
+    """
+    global _corpus_positions
+    if _corpus_positions[0] is not corpus:
+        all_utt = corpus.get_utterance_ids()
+        _corpus_positions = (corpus, all_utt, {utt_id: i for i, utt_id in enumerate(all_utt)})
+    return _corpus_positions[1], _corpus_positions[2]
+
+def release_corpus_positions():
+    global _corpus_positions
+    _corpus_positions = (None, None, None)
+
+def utterance_feature_table(corpus, caseid2stuff, utt_ids, cues, exclude_backchannel):
+    """
+    Output: the per-utterance feature table of utt_ids, a dictionary of arrays with one row per utterance
+        - is_adv: the (corrected) speaker type is "A"; all other utterances count as the justice's in a chunk
+        - is_backchannel: the utterance is a backchannel cue (only if exclude_backchannel == True)
+        - num_toks, interrupted, num_disfl: filled in by add_token_features for the rows that need them
+          (has_toks marks the rows that have them)
+        - start, stop: the utterance's audio timing in seconds, filled in by add_timing_features (has_times marks the rows
+          that have them; NaN if the transcript has no timing)
+    """
+    utts = [corpus.get_utterance(utt_id) for utt_id in utt_ids]
+    texts = [utt.text.strip() for utt in utts]
+    n = len(utts)
+    return {'utt_ids': list(utt_ids),
+            'texts': texts,
+            'is_adv': np.array([get_corrected_speaker_type(utt.meta['case_id'], caseid2stuff, utt) == "A" for utt in utts], dtype=bool).reshape(n),
+            'is_backchannel': np.array([exclude_backchannel == True and backchannel_match(text, cues) for text in texts], dtype=bool).reshape(n),
+            'has_toks': np.zeros(n, dtype=bool),
+            'num_toks': np.zeros(n, dtype=np.int64),
+            'interrupted': np.zeros(n, dtype=bool),
+            'num_disfl': np.zeros(n, dtype=np.int64),
+            'has_times': np.zeros(n, dtype=bool),
+            'start': np.full(n, np.nan),
+            'stop': np.full(n, np.nan)}
+
+def extend_utterance_feature_table(table, corpus, caseid2stuff, utt_ids, cues, exclude_backchannel):
+    """
+    Appends the rows of utt_ids to the feature table
+    """
+    more = utterance_feature_table(corpus, caseid2stuff, utt_ids, cues, exclude_backchannel)
+    return {key: table[key] + more[key] if isinstance(table[key], list) else np.concatenate([table[key], more[key]]) for key in table}
+
+def add_token_features(table, corpus, rows):
+    """
+    Tokenizes the utterances in rows (that are not backchannels or tokenized already) and fills in
+    their token count, interruption flag (classify_interruption) and number of disfluencies (one_utt_rule_speech_disfluency)
+    """
+    for row in rows:
+        if table['has_toks'][row] or table['is_backchannel'][row]: continue
+        text = table['texts'][row]
+        tokenized_text = tokenize(text)
+        table['num_toks'][row] = len(tokenized_text)
+        table['interrupted'][row] = classify_interruption(text)
+        table['num_disfl'][row] = one_utt_rule_speech_disfluency(tokenized_text)
+        table['has_toks'][row] = True
+
+def add_timing_features(table, corpus, rows):
+    """
+    Fills in the start (first of start_times) and stop (last of stop_times) of the utterances in rows 
+    from the ConvoKit utterance metadata
+    """
+    for row in rows:
+        if table['has_times'][row]: continue
+        meta = corpus.get_utterance(table['utt_ids'][row]).meta
+        start_times, stop_times = meta.get('start_times'), meta.get('stop_times')
+        if start_times and stop_times:
+            table['start'][row] = float(start_times[0])
+            table['stop'][row] = float(stop_times[-1])
+        table['has_times'][row] = True
+
+def chunk_timing_stats(table, seg_rows, seg_starts):
+    """
+    Speech overlap and turn latency of the chunks from the audio timing (add_timing_features), as segment sums 
+    over the pairs of consecutive utterances in a chunk; all pairs are computed at once (no loop over pairs)
+
+    A pair counts if the speaker changes (advocate <-> justice), neither utterance is a backchannel and both are timed. 
+    Its latency is the start of the second utterance minus the stop of the first (negative: the second speaker 
+    started before the first one stopped) and its overlap is max(0, -latency). 
+    Only sums and counts are kept (no NaN), e.g. the mean latency after the advocate is 
+    adv_to_justice_latency_sec / num_adv_to_justice_turns. 
+
+    Inputs: as chunk_segment_stats 
+    Output: dictionary with one array per statistic and one entry per chunk 
+    """
+    is_adv = table['is_adv'][seg_rows]
+    kept = ~table['is_backchannel'][seg_rows]
+    start, stop = table['start'][seg_rows], table['stop'][seg_rows]
+    # pair (k-1, k): position k of seg_rows and the one before it, within the same chunk
+    latency = np.full(len(seg_rows), np.nan)
+    latency[1:] = start[1:] - stop[:-1]
+    prev_is_adv = np.concatenate([[False], is_adv[:-1]])
+    prev_kept = np.concatenate([[False], kept[:-1]])
+    is_pair = prev_kept & kept & (prev_is_adv != is_adv) & np.isfinite(latency)
+    is_pair[seg_starts] = False
+    latency = np.where(is_pair, latency, 0.)
+    overlap = np.clip(-latency, 0., None)
+    after_adv = is_pair & prev_is_adv
+    after_justice = is_pair & ~prev_is_adv
+    duration = np.where(kept & np.isfinite(start) & np.isfinite(stop), stop - start, 0.)
+    segment_sum = lambda x: np.add.reduceat(x.astype(float), seg_starts)
+    return {'num_adv_to_justice_turns': segment_sum(after_adv).astype(np.int64),
+            'num_justice_to_adv_turns': segment_sum(after_justice).astype(np.int64),
+            'num_adv_utts_overlapped': segment_sum(after_adv & (overlap > 0)).astype(np.int64),
+            'num_justice_utts_overlapped': segment_sum(after_justice & (overlap > 0)).astype(np.int64),
+            'adv_overlap_sec': segment_sum(overlap * after_adv),
+            'justice_overlap_sec': segment_sum(overlap * after_justice),
+            'adv_to_justice_latency_sec': segment_sum(latency * after_adv),
+            'justice_to_adv_latency_sec': segment_sum(latency * after_justice),
+            'adv_turn_sec': segment_sum(duration * is_adv),
+            'justice_turn_sec': segment_sum(duration * ~is_adv)}
+
+def chunk_segment_stats(table, seg_rows, seg_starts):
+    """
+    Chunk statistics as segment sums (np.add.reduceat) over the feature table
+
+    Inputs: seg_rows, the feature table rows of all chunks concatenated,
+            seg_starts, the offset of each chunk in seg_rows (every chunk has at least one utterance)
+    Output: dictionary with one array per statistic and one entry per chunk; backchannel utterances are left out
+    """
+    kept = ~table['is_backchannel'][seg_rows]
+    adv = table['is_adv'][seg_rows] & kept
+    justice = ~table['is_adv'][seg_rows] & kept
+    num_toks = table['num_toks'][seg_rows] * kept
+    interrupted = table['interrupted'][seg_rows]
+    num_disfl = table['num_disfl'][seg_rows]
+    segment_sum = lambda x: np.add.reduceat(x.astype(np.int64), seg_starts)
+    return {'num_utts_adv': segment_sum(adv),
+            'num_utts_justice': segment_sum(justice),
+            'num_toks_total': segment_sum(num_toks),
+            'num_toks_adv': segment_sum(num_toks * adv),
+            'num_toks_justice': segment_sum(num_toks * justice),
+            'num_adv_utts_interrupted': segment_sum(interrupted & adv),
+            'num_justice_utts_interrupted': segment_sum(interrupted & justice),
+            'num_adv_toks_in_utts_interrupted': segment_sum(num_toks * (interrupted & adv)),
+            'num_justice_toks_in_utts_interrupted': segment_sum(num_toks * (interrupted & justice)),
+            'num_adv_disfl': segment_sum(num_disfl * adv),
+            'num_justice_disfl': segment_sum(num_disfl * justice)}
+
+def analyzechunks(corpus,caseid2stuff, name2gender,caseid2gender,utt_list,seen_advocates,min_num_utts=4,min_tok_adv=20,keep_candidates=False,adv_timeline=None,case_id=None):
     """
     Output: This function writes to a jsonl file metadata for all chunks corresponding to one case.  
+    The chunks are ChunkRecords collected in typed column buffers and written in config['chunk_format'] (see chunk_records.py). 
+
+    If keep_candidates == True, it also writes the candidate chunks for every min_num_utts in config['sweep_min_num_utts'] 
+    (before the min_tok_adv threshold is applied) to config['candidate_path'], with the extra key "sweep_min_num_utts". 
+    sensitivity.py then evaluates a grid of thresholds on them without re-chunking. 
+    Advocate experience is always counted with the min_num_utts passed in here. 
+
+    If config['chunk_db_path'] is set, the chunks are also written to the SQLite chunk database (see chunk_db.py).
+    A case without chunk candidates (empty utt_list) has its rows deleted from it, if its case_id is given. 
+
+    The chunk statistics are computed in two phases: the walk over utt_list finds the chunks using the per-utterance 
+    feature table (utterance_feature_table), then the utterances in the chunks are tokenized once and the statistics 
+    are segment sums over the table (chunk_segment_stats). 
+
+    If config['resolve_advocate_names'] == True, the advocate's side (advocate ideology) and timeline entry are looked up 
+    with the advocate name resolved to the case's advocates in cases.jsonl (see name_resolution.py). 
+
+    If config['mq_scores_path'] is set, the chunks also get "justice_ideology_term", the justice's ideology from the sign of 
+    their Martin-Quinn score in the term of the case (utils.load_mq_scores). 
+
+    If config['timing_features'] == True, the chunks also get the speech overlap and turn latency statistics 
+    from the audio timing of the utterances (see chunk_timing_stats). 
+
+    If adv_timeline (utils.load_advocate_timeline) is given, advocate experience is looked up in the timeline index
+    instead of seen_advocates: it counts every case the advocate argued before this one (all terms in cases.jsonl),
+    so it does not depend on the order the cases are processed in, and adds the keys "adv_days_since_last_arg" 
+    and "adv_experience_justice_int" (earlier cases argued in front of the same justice). 
 
     Example:
     {"case_id": "1987_86-594", "case_year": 1987, "justice_name": "Antonin Scalia", "advocate_name": "Laurence E. Gold", "utt_id_first": "18304__1_064", "utt_id_last": "18304__1_077", "advocate_gender": "M", "num_utts": 14, "num_utts_adv": 7, "num_utts_justice": 7, "num_toks_total": 677, "num_toks_adv": 291, "num_toks_justice": 386, "advocate_ideology": "liberal", "justice_ideology": "conservative", "adv_experience": 1, "female_issue": 0, "num_adv_utts_interrupted": 2, "num_justice_utts_interrupted": 1, "adv_interruption_rate": 0.2857142857142857, "justice_interruption_rate": 0.14285714285714285, "num_adv_disfl": 5, "num_justice_disfl": 1, "num_adv_toks_in_utts_interrupted": 10, "num_justice_toks_in_utts_interrupted": 152}    {"case_id": "2015_13-1067", "case_year": 2015, "justice_name": "Elena Kagan", "advocate_name": "Juan C. Basombrio", "utt_id_first": "23997__0_007", "utt_id_last": "23997__0_010", "advocate_gender": "M", "num_utts": 4, "num_utts_adv": 2, "num_utts_justice": 2, "num_toks_total": 345, "num_toks_adv": 67, "num_toks_justice": 278, "advocate_ideology": "conservative", "justice_ideology": "liberal", "num_adv_utts_interrupted": 1, "interruption_rate": 0.5, "num_adv_disfl": 0, "num_justice_disfl": 8}
@@ -150,158 +321,209 @@ def analyzechunks(corpus,caseid2stuff, name2gender,caseid2gender,utt_list,seen_a
     cues = load_backchannel_cues()
     total_backchannel_utts_ignored = 0 
 
-    dict_list = []
+    config = load_config()
     if (len(utt_list)==0):
+        # re-runs must not leave the case's old chunks in the database
+        if case_id is not None and config.get('chunk_db_path'):
+            write_case_chunks(config['chunk_db_path'], case_id, ChunkColumns())
         return seen_advocates
     case = corpus.get_utterance(utt_list[0]).meta['case_id']
     
-    config = load_config()
     path = config['chunk_path']
     if not os.path.exists(path):os.makedirs(path)
     
-    f = open(config['chunk_path']+case + '.jsonl', 'w') 
+    if not os.path.exists(os.path.dirname(chunk_file_path(config, case))): os.makedirs(os.path.dirname(chunk_file_path(config, case)))
+    # the chunks of the case, in typed column buffers (see chunk_records.py)
+    chunks = ChunkColumns(record_fields(config, timeline=adv_timeline is not None))
     if (-1 in utt_list):
         utt_list.remove(-1)
     
-    all_utt = corpus.get_utterance_ids()
-    prev_utt_p1 = -1
-    prev_utt_p3 = -1
-    prev_utt_id = -1
+    all_utt, utt2pos = corpus_positions(corpus)
     advocates_in_this_case = []
+
+    # Phase 1: per-utterance roles and backchannel flags for the utterances of this case (rows of the feature table)
+    positions = [utt2pos[utt_id] for utt_id in utt_list]
+    table_start = min(positions)
+    table = utterance_feature_table(corpus, caseid2stuff, all_utt[table_start:max(positions)+1], cues, config["exclude_backchannel"])
+
+    # Sensitivity sweep: a chunk is valid iff num_utt >= min_num_utts and an invalid chunk is skipped, but a valid chunk with 
+    # too few advocate or justice utterances (e.g. every chunk of 2 utterances) is merged into the next one, so the chunk 
+    # boundaries still depend on min_num_utts. The walk over utt_list keeps the previous utterance of every min_num_utts value 
+    # and looks up each chunk (speakers, ideologies, gender, experience) once for all values (case_chunks). 
+    walk_min_num_utts = [min_num_utts]
+    if keep_candidates:
+        walk_min_num_utts += [m for m in config['sweep_min_num_utts'] if m != min_num_utts]
+        candidate_fname = chunk_file_path(config, case, key='candidate_path')
+        if not os.path.exists(os.path.dirname(candidate_fname)):os.makedirs(os.path.dirname(candidate_fname))
+        candidates = ChunkColumns(record_fields(config, timeline=adv_timeline is not None, sweep=True))
+    segments = [] #(first row, number of utterances, chunk record with the metadata, the min_num_utts values with this chunk) of every chunk
+    case_chunks = {} #(prev_utt_id, utt_id) -> the chunk between them (None if the speakers are not a justice and an advocate)
+    walk_state = {m: (-1, -1, -1) for m in walk_min_num_utts} #min_num_utts -> (prev_utt_id, prev_utt_p1, prev_utt_p3)
+
     for utt_id in utt_list:
         utt_p1 = utt_id.split('_')[0]
         utt_p3 = utt_id.split('_')[3]
-        #if the chunk has only one speaker 
-        if (prev_utt_p1 == -1 or prev_utt_p3 == -1 or prev_utt_p1 != utt_p1 or int(utt_p3) == int(prev_utt_p3)+1):
-            x=1 #do nothing
-        #if the chunk has more than one speaker
-        elif (prev_utt_id != -1): 
-            
+        for chunk_min_num_utts in walk_min_num_utts:
+            is_main_walk = (chunk_min_num_utts == min_num_utts)
+            prev_utt_id, prev_utt_p1, prev_utt_p3 = walk_state[chunk_min_num_utts]
+            #if the chunk has only one speaker 
+            if (prev_utt_p1 == -1 or prev_utt_p3 == -1 or prev_utt_p1 != utt_p1 or int(utt_p3) == int(prev_utt_p3)+1):
+                x=1 #do nothing
+            #if the chunk has more than one speaker
+            elif (prev_utt_id != -1): 
+                prev_next_utt_id = all_utt[utt2pos[prev_utt_id]+1]
             
-            #print speakers in the chunk
-            #print the first two speakers in the chunk, which are:
-            # the immediate next speaker of the utterance after prev_utt: call this prev_next_utt
-            # the immediate next speaker of the utterance after prev_next_utt: call this prev_next2_utt
-            prev_next_utt_id = all_utt[all_utt.index(prev_utt_id)+1]
-            prev_next_utt = corpus.get_utterance(prev_next_utt_id)
-            spkr1 = prev_next_utt.speaker.meta['name'].replace(',', '')
-            prev_next2_utt_id = all_utt[all_utt.index(prev_utt_id)+2]
-            prev_next2_utt = corpus.get_utterance(prev_next2_utt_id)
-            spkr2 = prev_next2_utt.speaker.meta['name'].replace(',', '')            
-            
-            #determine if the chunk is "valid"
-            if ((int(utt_p3) >= int(prev_utt_p3)+min_num_utts) 
-                    or ((int(prev_next_utt_id.split('_')[3])==0) 
-                    and (int(utt_p3) >=min_num_utts-1))):
-                
-                num_utt = int(utt_p3) - int(prev_utt_p3)
-
-                if (int(prev_next_utt_id.split('_')[3])==0):
-                    num_utt =  int(utt_p3) + 1
-                spkr1type = get_corrected_speaker_type(prev_next_utt.meta['case_id'], caseid2stuff, prev_next_utt)
-                spkr2type = get_corrected_speaker_type(prev_next2_utt.meta['case_id'], caseid2stuff, prev_next2_utt)
-                
-                if ((spkr1type == "J" and spkr2type == "A") or (spkr1type == "A" and spkr2type == "J")):
-                    #valid chunk
-                    utt =  corpus.get_utterance(utt_id)
-                    caseid = utt.meta['case_id']
-                    uttidlast = utt_id
-                    uttidfirst = prev_next_utt_id
-                    caseyear = int(caseid.split('_')[0])
-                    if (spkr1type == "J"):
-                        justicename = spkr1
-                        advocatename = spkr2
-                    else:
-                        justicename = spkr2
-                        advocatename = spkr1
-
-                    #Justice last name check 
-                    if (justicename.split()[len(justicename.split())-1] != "Jr."):
-                        justicelastname = justicename.split()[len(justicename.split())-1]
-                    else:
-                        justicelastname = justicename.split()[len(justicename.split())-2]
-
-                    # Get justice ideology 
-                    if justicelastname in justice_ideologies_dict:    
-                        justice_ideology = justice_ideologies_dict[justicelastname]
-                    else:
-                        justice_ideology = "unknown"
-
-                    # Advocate ideology 
-                    advocate_ideology = get_advocate_ideology(caseid2stuff,df,caseid,advocatename)
-                    female_issue = is_female_issue(caseid2stuff,df,caseid,advocatename)
-                    if (advocatename in caseid2gender[caseid] and (caseid2gender[caseid][advocatename]=="M" or caseid2gender[caseid][advocatename]=="F")):
-                        gender = caseid2gender[caseid][advocatename]
-                    else: 
-                        gender = get_speaker_gender_dictionary(advocatename, name2gender)
-                    if (advocatename in seen_advocates):
-                        adv_experience_bin = 1
-                        adv_experience_int = seen_advocates[advocatename]
-                    else:
-                        adv_experience_bin = 0
-                        adv_experience_int = 0
-                    if advocatename not in advocates_in_this_case:
-                        advocates_in_this_case.append(advocatename)
-                    
-                    num_utts_adv = 0
-                    num_utts_justice = 0
-                    num_toks_total = 0
-                    num_toks_adv = 0
-                    num_toks_justice = 0
-                    num_adv_utts_interrupted = 0
-                    num_justice_utts_interrupted = 0
-                    num_adv_toks_in_utts_interrupted = 0
-                    num_justice_toks_in_utts_interrupted = 0
-                    num_adv_disfl = 0 
-                    num_justice_disfl = 0
-                    
-                    for u in range(1, num_utt + 1):
-                        utter = corpus.get_utterance(all_utt[all_utt.index(prev_utt_id)+u])
-                        text = utter.text.strip()
-
-                        # Check backchannel cues (if applicable)
-                        if config["exclude_backchannel"] == True: 
-                            has_backchannel = backchannel_match(text, cues)
-                            if has_backchannel == True: 
-                                total_backchannel_utts_ignored  += 1
-                                continue
-
-                        # Otherwise, continue on 
-                        tokenized_text = word_tokenize(text)
-                        num_toks = len(tokenized_text)
-                        num_toks_total = num_toks_total + num_toks
-
-                        if (get_corrected_speaker_type(utter.meta['case_id'],caseid2stuff,utter)=="A"):
-                            num_utts_adv = num_utts_adv + 1
-                            num_toks_adv = num_toks_adv + num_toks
-                            if (classify_interruption(text)==True):
-                                num_adv_utts_interrupted = num_adv_utts_interrupted + 1
-                                num_adv_toks_in_utts_interrupted = num_adv_toks_in_utts_interrupted+num_toks
-                            num_adv_disfl = num_adv_disfl + one_utt_rule_speech_disfluency(tokenized_text)
-                        else:
-                            num_utts_justice = num_utts_justice + 1 
-                            num_toks_justice =  num_toks_justice + num_toks
-                            if (classify_interruption(text)==True):
-                                num_justice_utts_interrupted = num_justice_utts_interrupted + 1
-                                num_justice_toks_in_utts_interrupted = num_justice_toks_in_utts_interrupted+num_toks
-                            num_justice_disfl = num_justice_disfl + one_utt_rule_speech_disfluency(tokenized_text)
+                #determine if the chunk is "valid"
+                if ((int(utt_p3) >= int(prev_utt_p3)+chunk_min_num_utts) 
+                        or ((int(prev_next_utt_id.split('_')[3])==0) 
+                        and (int(utt_p3) >=chunk_min_num_utts-1))):
+
+                    if (prev_utt_id, utt_id) not in case_chunks:
+                        case_chunks[(prev_utt_id, utt_id)] = None
+                        #print speakers in the chunk
+                        #print the first two speakers in the chunk, which are:
+                        # the immediate next speaker of the utterance after prev_utt: call this prev_next_utt
+                        # the immediate next speaker of the utterance after prev_next_utt: call this prev_next2_utt
+                        prev_next_utt = corpus.get_utterance(prev_next_utt_id)
+                        spkr1 = prev_next_utt.speaker.meta['name'].replace(',', '')
+                        prev_next2_utt_id = all_utt[utt2pos[prev_utt_id]+2]
+                        prev_next2_utt = corpus.get_utterance(prev_next2_utt_id)
+                        spkr2 = prev_next2_utt.speaker.meta['name'].replace(',', '')            
                     
-                    # Could end up with invalid num utterances if all backchannels
-                    if num_utts_adv < 2 or num_utts_justice <2 : continue 
+                        num_utt = int(utt_p3) - int(prev_utt_p3)
+
+                        if (int(prev_next_utt_id.split('_')[3])==0):
+                            num_utt =  int(utt_p3) + 1
+                        spkr1type = get_corrected_speaker_type(prev_next_utt.meta['case_id'], caseid2stuff, prev_next_utt)
+                        spkr2type = get_corrected_speaker_type(prev_next2_utt.meta['case_id'], caseid2stuff, prev_next2_utt)
                     
-                    adv_interruption_rate = num_adv_utts_interrupted / num_utts_adv
-                    justice_interruption_rate = num_justice_utts_interrupted / num_utts_justice
-                    if (num_toks_adv >= min_tok_adv):
-                        dic = dict(case_id=caseid,case_year=caseyear,justice_name=justicename,advocate_name=advocatename,utt_id_first=uttidfirst,utt_id_last=uttidlast,advocate_gender=gender,
-                        num_utts=num_utt,num_utts_adv= num_utts_adv,num_utts_justice=num_utts_justice,num_toks_total=num_toks_total,num_toks_adv=num_toks_adv,num_toks_justice=num_toks_justice,advocate_ideology=advocate_ideology,
-                        justice_ideology=justice_ideology,adv_experience_int=adv_experience_int,adv_experience_bin=adv_experience_bin,female_issue=female_issue,num_adv_utts_interrupted=num_adv_utts_interrupted,num_justice_utts_interrupted=num_justice_utts_interrupted,adv_interruption_rate=adv_interruption_rate,
-                        justice_interruption_rate=justice_interruption_rate,num_adv_disfl=num_adv_disfl,num_justice_disfl=num_justice_disfl, num_adv_toks_in_utts_interrupted=num_adv_toks_in_utts_interrupted,num_justice_toks_in_utts_interrupted=num_justice_toks_in_utts_interrupted)
-                        dict_list.append(dic)
-                        json.dump(dic, f) 
-                        f.write('\n')
-        prev_utt_id = utt_id
-        prev_utt_p1 = utt_p1
-        prev_utt_p3 = utt_p3
+                        if ((spkr1type == "J" and spkr2type == "A") or (spkr1type == "A" and spkr2type == "J")):
+                            #valid chunk
+                            utt =  corpus.get_utterance(utt_id)
+                            caseid = utt.meta['case_id']
+                            uttidlast = utt_id
+                            uttidfirst = prev_next_utt_id
+                            caseyear = int(caseid.split('_')[0])
+                            if (spkr1type == "J"):
+                                justicename = spkr1
+                                advocatename = spkr2
+                            else:
+                                justicename = spkr2
+                                advocatename = spkr1
+
+                            #Justice last name check 
+                            if (justicename.split()[len(justicename.split())-1] != "Jr."):
+                                justicelastname = justicename.split()[len(justicename.split())-1]
+                            else:
+                                justicelastname = justicename.split()[len(justicename.split())-2]
+
+                            # Get justice ideology 
+                            if justicelastname in justice_ideologies_dict:    
+                                justice_ideology = justice_ideologies_dict[justicelastname]
+                            else:
+                                justice_ideology = "unknown"
+
+                            # Advocate ideology 
+                            advocate_ideology = get_advocate_ideology(caseid2stuff,df,caseid,advocatename,resolve_names=config.get('resolve_advocate_names', False))
+                            female_issue = is_female_issue(caseid2stuff,df,caseid,advocatename)
+                            if (advocatename in caseid2gender[caseid] and (caseid2gender[caseid][advocatename]=="M" or caseid2gender[caseid][advocatename]=="F")):
+                                gender = caseid2gender[caseid][advocatename]
+                            else: 
+                                gender = get_speaker_gender_dictionary(advocatename, name2gender)
+                            if adv_timeline is not None:
+                                timeline_name = advocatename
+                                if config.get('resolve_advocate_names', False):
+                                    # the timeline is keyed by the names in cases.jsonl (without commas)
+                                    timeline_name = (resolve_advocate(caseid2stuff, caseid, advocatename) or advocatename).replace(',', '')
+                                experience = advocate_experience(adv_timeline, timeline_name, caseid, justicelastname)
+                                adv_experience_bin = experience['adv_experience_bin']
+                                adv_experience_int = experience['adv_experience_int']
+                            elif (advocatename in seen_advocates):
+                                adv_experience_bin = 1
+                                adv_experience_int = seen_advocates[advocatename]
+                            else:
+                                adv_experience_bin = 0
+                                adv_experience_int = 0
+
+                            # The utterances of the chunk are rows first_row, ..., first_row+num_utt-1 of the feature table
+                            first_row = utt2pos[prev_utt_id]+1 - table_start
+                            if first_row+num_utt > len(table['utt_ids']):
+                                table = extend_utterance_feature_table(table, corpus, caseid2stuff, all_utt[table_start+len(table['utt_ids']):table_start+first_row+num_utt], cues, config["exclude_backchannel"])
+                            rows = slice(first_row, first_row+num_utt)
+                            kept = ~table['is_backchannel'][rows]
+
+                            # Could end up with invalid num utterances if all backchannels (chunk None: merged into the next one)
+                            chunk = None
+                            if (table['is_adv'][rows] & kept).sum() >= 2 and (~table['is_adv'][rows] & kept).sum() >= 2:
+                                chunk = ChunkRecord(case_id=caseid,case_year=caseyear,justice_name=justicename,advocate_name=advocatename,utt_id_first=uttidfirst,utt_id_last=uttidlast,advocate_gender=gender,
+                                num_utts=num_utt,advocate_ideology=advocate_ideology,justice_ideology=justice_ideology,adv_experience_int=adv_experience_int,adv_experience_bin=adv_experience_bin,female_issue=female_issue)
+                                if adv_timeline is not None:
+                                    chunk.adv_days_since_last_arg = experience['adv_days_since_last_arg']
+                                    chunk.adv_experience_justice_int = experience['adv_experience_justice_int']
+                            case_chunks[(prev_utt_id, utt_id)] = dict(advocate_name=advocatename, first_row=first_row, num_utt=num_utt, chunk=chunk, walks=[],
+                                                                      num_backchannel=int(table['is_backchannel'][rows].sum()))
+                    found = case_chunks[(prev_utt_id, utt_id)]
+                    if found is not None:
+                        if is_main_walk:
+                            if found['advocate_name'] not in advocates_in_this_case:
+                                advocates_in_this_case.append(found['advocate_name'])
+                            total_backchannel_utts_ignored += found['num_backchannel']
+                        if found['chunk'] is None: continue
+                        if len(found['walks']) == 0:
+                            segments.append((found['first_row'], found['num_utt'], found['chunk'], found['walks']))
+                        found['walks'].append(chunk_min_num_utts)
+            walk_state[chunk_min_num_utts] = (utt_id, utt_p1, utt_p3)
+
+    # Phase 2: token counts, interruptions and disfluencies of the utterances in the chunks, 
+    # then the chunk statistics as segment sums over the feature table
+    if len(segments) > 0:
+        first_rows = np.array([seg[0] for seg in segments])
+        num_utts = np.array([seg[1] for seg in segments])
+        seg_rows = np.concatenate([np.arange(first_row, first_row+num_utt) for first_row, num_utt in zip(first_rows, num_utts)])
+        add_token_features(table, corpus, np.unique(seg_rows))
+        seg_starts = np.concatenate([[0], np.cumsum(num_utts)[:-1]])
+        stats = chunk_segment_stats(table, seg_rows, seg_starts)
+        if config.get('timing_features', False):
+            add_timing_features(table, corpus, np.unique(seg_rows))
+            timing_stats = chunk_timing_stats(table, seg_rows, seg_starts)
+        if config.get('mq_scores_path'):
+            # the justice's ideology in the term of the case, one (justice, term) join for all chunks of the case
+            justice_ideology_term = term_ideology_labels(join_mq_scores(load_mq_scores(config['mq_scores_path']), [seg[2].justice_name for seg in segments], 
+                                                                        [seg[2].case_year for seg in segments]), [seg[2].justice_ideology for seg in segments])
+
+    for i, (first_row, num_utt, chunk, walks) in enumerate(segments):
+        # the chunk statistics complete the record of phase 1
+        chunk.num_utts_adv, chunk.num_utts_justice = int(stats['num_utts_adv'][i]), int(stats['num_utts_justice'][i])
+        chunk.num_toks_total = int(stats['num_toks_total'][i])
+        chunk.num_toks_adv = int(stats['num_toks_adv'][i])
+        chunk.num_toks_justice = int(stats['num_toks_justice'][i])
+        chunk.num_adv_utts_interrupted = int(stats['num_adv_utts_interrupted'][i])
+        chunk.num_justice_utts_interrupted = int(stats['num_justice_utts_interrupted'][i])
+        chunk.adv_interruption_rate = chunk.num_adv_utts_interrupted / chunk.num_utts_adv
+        chunk.justice_interruption_rate = chunk.num_justice_utts_interrupted / chunk.num_utts_justice
+        chunk.num_adv_disfl = int(stats['num_adv_disfl'][i])
+        chunk.num_justice_disfl = int(stats['num_justice_disfl'][i])
+        chunk.num_adv_toks_in_utts_interrupted = int(stats['num_adv_toks_in_utts_interrupted'][i])
+        chunk.num_justice_toks_in_utts_interrupted = int(stats['num_justice_toks_in_utts_interrupted'][i])
+        if config.get('mq_scores_path'):
+            chunk.justice_ideology_term = str(justice_ideology_term[i])
+        if config.get('timing_features', False):
+            for key, values in timing_stats.items():
+                setattr(chunk, key, int(values[i]) if values.dtype == np.int64 else round(float(values[i]), 3))
+        if (chunk.num_toks_adv >= min_tok_adv) and min_num_utts in walks:
+            chunks.append(chunk)
+    if keep_candidates:
+        # the candidate chunks of every min_num_utts value, with the value in "sweep_min_num_utts"
+        for chunk_min_num_utts in walk_min_num_utts:
+            for first_row, num_utt, chunk, walks in segments:
+                if chunk_min_num_utts in walks:
+                    chunk.sweep_min_num_utts = chunk_min_num_utts
+                    candidates.append(chunk)
+
+    chunks.write(chunk_file_path(config, case), config.get('chunk_format', 'jsonl'))
+    if keep_candidates: candidates.write(candidate_fname, config.get('chunk_format', 'jsonl'))
+    if config.get('chunk_db_path'):
+        write_case_chunks(config['chunk_db_path'], case, chunks)
 
     # Advocate experience piece 
     for advs in advocates_in_this_case:
@@ -318,11 +540,14 @@ def analyzechunks(corpus,caseid2stuff, name2gender,caseid2gender,utt_list,seen_a
 
     return seen_advocates
 
-def analyzechunks1year(corpus1,caseid2stuff,name2gender,caseid2gender,seen_advocates):
+def analyzechunks1year(corpus1,caseid2stuff,name2gender,caseid2gender,seen_advocates,keep_candidates=False,adv_timeline=None,case_ids=None):
     """
     Output: This function generates a jsonl file for each case in a year, where each jsonl file contains metadata for all chunks corresponding to the case corresponding to it.
+
+    case_ids (set, optional): only chunk these cases (e.g., a sample, see stratified_case_sample)
     """
 
+    import pandas as pd
     #iterates through the list of conversations in a year; sorts conversations in order of argument date
     df = load_docket_info()
     conv_date_list = []
@@ -330,13 +555,14 @@ def analyzechunks1year(corpus1,caseid2stuff,name2gender,caseid2gender,seen_advoc
         utt_ids = conv.get_utterance_ids()
         utt = conv.get_utterance(utt_ids[0])
         case_id = utt.meta["case_id"]
+        if case_ids is not None and case_id not in case_ids: continue
         docketid = caseid2stuff[case_id]["scdb_docket_id"]
         date_arg = df.loc[df['docketId'] == docketid]["dateArgument"]
         if (len(date_arg) == 0 or pd.isna(date_arg.item())):
             date_arg = datetime.date(2020,10,5)
             print("no argument date available")
         else:
-            date_arg = datetime.datetime.strptime(word_tokenize(str(date_arg))[1],"%m/%d/%Y").date()
+            date_arg = datetime.datetime.strptime(tokenize(str(date_arg))[1],"%m/%d/%Y").date()
         conv_date_list.append([conv,date_arg])
     conv_date_list = sorted(conv_date_list, key = lambda x: x[1])
     #iterates through the list of conversations in a year, ordered by argument date
@@ -346,37 +572,156 @@ def analyzechunks1year(corpus1,caseid2stuff,name2gender,caseid2gender,seen_advoc
         utt = conv.get_utterance(utt_ids[0])
         case_id = utt.meta["case_id"]
         utt_list = print_prev_utt_for_chunk(corpus1, caseid2stuff, case=case_id)
-        seen_advocates = analyzechunks(corpus1,caseid2stuff,name2gender,caseid2gender,utt_list,seen_advocates)
+        seen_advocates = analyzechunks(corpus1,caseid2stuff,name2gender,caseid2gender,utt_list,seen_advocates,keep_candidates=keep_candidates,adv_timeline=adv_timeline,case_id=case_id)
     return seen_advocates
 
+def term_case_ids(corpus):
+    """
+    Output: the case ids of the conversations in corpus (in corpus order)
+    """
+    case_ids = []
+    for conv in corpus.iter_conversations():
+        case_id = conv.get_utterance(conv.get_utterance_ids()[0]).meta["case_id"]
+        if case_id not in case_ids: case_ids.append(case_id)
+    return case_ids
+
+def stratified_case_sample(case_ids, caseid2gender, fraction, rng):
+    """
+    Samples the fraction of the cases of a term within two strata: cases with and without a female advocate
+    (at least one case of every non-empty stratum, so terms with few female advocates are still represented)
+
+    Output: dictionary sampled case id -> sampling weight (N_h/n_h, the inverse sampling fraction of its stratum)
+    """
+    strata = {True: [], False: []}
+    for case_id in case_ids:
+        strata["F" in caseid2gender[case_id].values()].append(case_id)
+    sample = {}
+    for cases in strata.values():
+        if len(cases) == 0: continue
+        num_sampled = min(len(cases), max(1, int(round(fraction*len(cases)))))
+        for case_id in rng.choice(cases, size=num_sampled, replace=False):
+            sample[str(case_id)] = len(cases)/num_sampled
+    return sample
+
 #prints metadata over all years
-def metadata_all_years(start=2019,end=2020):
+def metadata_all_years(start=2019,end=2020,keep_candidates=False,offline=False,sample_fraction=None,sample_seed=0):
     """
     Output: This function generates a jsonl file for each case in a year over a period of many years, where each jsonl file contains metadata for all chunks corresponding to the case corresponding to it.
+
+    keep_candidates == True also writes the candidate chunks for the sensitivity sweep (see analyzechunks)
+    offline == True only uses local copies of the ConvoKit corpora and NLTK punkt (no network access)
+
+    With config['adv_experience'] == "timeline" the advocate experience comes from the advocate timeline index 
+    (see utils.load_advocate_timeline) instead of the advocates seen in the earlier years of this loop
+
+    sample_fraction (float, optional): only chunks a stratified sample of the cases of every term (see stratified_case_sample) 
+    and returns the sampled cases and their sampling weights (dictionary case id -> weight)
     """
+    ensure_punkt(offline=offline)
+    set_tokenizer(config.get("tokenizer", "nltk"), offline=offline)
+    caseid2stuff = utils.load_case_file()
+    adv_timeline = None
+    if config.get("adv_experience", "sequential") == "timeline":
+        adv_timeline = load_advocate_timeline(config, caseid2stuff)
     #iterate through all years
     seen_advocates = {}
-    for year in range(start,end,1):
-        corpus1 = Corpus(filename=download("supreme-"+str(year)))
-        name2gender = create_load_lookupname2gender() 
-        caseid2gender = parse_gender(corpus1, name2gender, verbose=False, start_year=1980)
-        caseid2stuff = utils.load_case_file()
-        seen_advocates = analyzechunks1year(corpus1,caseid2stuff,name2gender,caseid2gender,seen_advocates)
+    sample = {} if sample_fraction is not None else None
+    name2gender = create_load_lookupname2gender() 
+    # the next terms are loaded in the background while a term is chunked (see corpus_cache.py)
+    for year, corpus1 in iter_term_corpora(range(start,end,1), config, offline=offline):
+        # merged into data/caseid2genders.json, so only the cases not seen in an earlier run are parsed
+        caseid2gender = parse_gender(corpus1, name2gender, verbose=False, start_year=config['start_year'])
+        case_ids = None
+        if sample is not None: 
+            # strata: term (this loop) x female advocate; one random stream per term
+            year_sample = stratified_case_sample(term_case_ids(corpus1), caseid2gender, sample_fraction, np.random.default_rng([sample_seed, year]))
+            sample.update(year_sample)
+            case_ids = set(year_sample)
+        seen_advocates = analyzechunks1year(corpus1,caseid2stuff,name2gender,caseid2gender,seen_advocates,keep_candidates=keep_candidates,adv_timeline=adv_timeline,case_ids=case_ids)
+        # drop the term before the next one is taken from the queue, so only the prefetched terms stay in memory
+        release_corpus_positions()
+        del corpus1
 
         if config["exclude_backchannel"] == True:
             print("total backchannel utterances ignored across all cases =", all_total_backchannel_utts_ignored)
+    if config.get('resolve_advocate_names', False):
+        write_unresolved_report()
+    return sample
+
+def approx_config(config, fraction):
+    """
+    The configuration of the approximate mode: all outputs go to config['approx_path'] (so the full run is not overwritten)
+    and min_num_chunks_per_just is scaled by the sampling fraction. It is saved to config['approx_path']+'config.yaml'
+    and selected with INTERRUPTIONS_CONFIG (analyzechunks and filter.py/analysis.py read it with load_config)
+
+    The advocate experience comes from the advocate timeline index (adv_experience: "timeline"): "sequential" only
+    counts the advocates of the chunked cases, so with a sample the advocates of the other cases would be missed
+    """
+    path = config['approx_path']
+    config = dict(config)
+    config.update({'chunk_path': path+'chunks/', 'prev_utt_path': path+'prev_utt/', 'candidate_path': path+'candidates/',
+                   'final_df_path': path+'df_final.csv', 'estimates_path': path+'estimates/', 'results_path': path+'results/',
+                   'figs_path': path+'figs/', 'chunk_db_path': '', 'adv_experience': 'timeline',
+                   'min_num_chunks_per_just': int(round(fraction*config['min_num_chunks_per_just'])),
+                   'approx_fraction': fraction})
+    # chunk files of an earlier sample would otherwise be mixed in
+    for key in ['chunk_path', 'prev_utt_path', 'candidate_path']:
+        if os.path.exists(config[key]): shutil.rmtree(config[key])
+    if not os.path.exists(path): os.makedirs(path)
+    with open(path+'config.yaml', 'w') as w:
+        yaml.safe_dump(config, w, sort_keys=False)
+    os.environ['INTERRUPTIONS_CONFIG'] = path+'config.yaml'
+    return config
+
+def approx_estimates(config, sample, num_bootstraps=1000, seed=0):
+    """
+    Filters the chunks of the sampled cases (as filter.py) and estimates E[Y], theta_gender and theta_ideology with
+    standard deviations that account for the sampling fraction (see utils.get_approx_estimates)
+
+    Output: pd.DataFrame, also written to config['approx_path']+'estimates.csv'
+    """
+    from filter import go_join_filter
+    df = go_join_filter(load_chunks_df(config), config)
+    df = df.assign(sampling_weight=df['case_id'].map(sample).to_numpy())
+    fraction = len(sample)/sum(sample.values())
+    df_approx = get_approx_estimates(df, fraction, weights=df['sampling_weight'].to_numpy(), num_bootstraps=num_bootstraps, seed=seed)
+    df_approx.to_csv(config['approx_path']+'estimates.csv', index=False)
+    print("Saved approximate estimates to ->", config['approx_path']+'estimates.csv')
+    return df_approx
       
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sweep', action='store_true', help='also keep candidate chunks for the threshold sensitivity sweep (see sensitivity.py)')
+    parser.add_argument('--offline', action='store_true', help='only use local ConvoKit corpora and NLTK punkt (also set by offline in config.yaml)')
+    parser.add_argument('--approx', type=float, default=None, metavar='FRACTION',
+                        help='quick look: only chunk this fraction of the cases (stratified by term and female advocate) and estimate, see approx_path')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the --approx sample')
+    args = parser.parse_args()
+
     all_total_backchannel_utts_ignored = 0 
     if not os.path.exists("data/"): os.makedirs("data/")
 
     config = load_config()
+    if args.approx is not None: 
+        assert 0 < args.approx <= 1, "--approx is a fraction of the cases"
+        config = approx_config(config, args.approx)
 
     #the start year is inclusive; the end year is not inclusive
-    metadata_all_years(start=config["start_year"], 
-                       end=config["end_year"])
+    sample = metadata_all_years(start=config["start_year"], 
+                                end=config["end_year"],
+                                keep_candidates=args.sweep,
+                                offline=args.offline or config.get("offline", False),
+                                sample_fraction=args.approx,
+                                sample_seed=args.seed)
     
     if config["exclude_backchannel"] == True:
         print("ALL CASES, ALL YEARS, total backchannel utterances ignored=", all_total_backchannel_utts_ignored)
-    print("DONE CHUNKING")
\ No newline at end of file
+    print("DONE CHUNKING")
+
+    if args.approx is not None: 
+        with open(config['approx_path']+'sample.json', 'w') as w: 
+            json.dump(sample, w)
+        df_approx = approx_estimates(config, sample, num_bootstraps=config['num_bootstrap_samples'], seed=args.seed)
+        print(f"APPROXIMATE theta_gender ({len(sample)} sampled cases, min_num_chunks_per_just={config['min_num_chunks_per_just']})")
+        print(df_approx[df_approx['effect'] == 'theta_gender'].to_string(index=False))
\ No newline at end of file
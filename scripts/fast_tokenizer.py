@@ -0,0 +1,314 @@
+"""
+A faster drop-in for nltk.word_tokenize (nltk==3.6.7, English) for the pipeline, which only uses the
+tokens to get token counts, speech disfluencies (one_utt_rule_speech_disfluency) and
+"Mr."/"Ms." mentions (extract_last_gender_title_mention).
+
+word_tokenize = Punkt sentence splitting + the NLTKWordTokenizer regexes on every sentence. Here
+    - Punkt is only run on the candidate sentence ends (".", "?" or "!" followed by more text),
+      with Punkt's own decision rules and its trained parameters (abbreviations, collocations, ...)
+    - the NLTKWordTokenizer regexes are precompiled at module level, in the same order, and a regex
+      is only applied if the characters it needs are in the text
+
+The token counts and flags should be identical to word_tokenize. To check this on the corpus, run
+
+    python fast_tokenizer.py [--start_year 2019] [--end_year 2020] [--offline]
+
+which reports every utterance where the token count, number of disfluencies or gender title mention differ.
+Select it for the pipeline with `tokenizer: "fast"` in config.yaml.
+"""
+import sys, re
+import argparse
+import time
+
+from utils import *
+
+#######################
+# NLTKWordTokenizer (nltk==3.6.7) regexes
+
+_STARTING_QUOTES_UNICODE = re.compile("([«“‘„]|[`]+)", re.U)
+_STARTING_DOUBLE_QUOTE = re.compile(r"^\"")
+_STARTING_BACKTICKS = re.compile(r"(``)")
+_STARTING_OPEN_QUOTE = re.compile(r"([ \(\[{<])(\"|\'{2})")
+_STARTING_SINGLE_QUOTE = re.compile(r"(?i)(\')(?!re|ve|ll|m|t|s|d|n)(\w)\b", re.U)
+
+_FINAL_PERIOD_1 = re.compile(r'([^\.])(\.)([\]\)}>"\'' "»”’ " r"]*)\s*$", re.U)
+_COLON_COMMA = re.compile(r"([:,])([^\d])")
+_COLON_COMMA_END = re.compile(r"([:,])$")
+_ELLIPSIS = re.compile(r"\.{2,}", re.U)
+_SYMBOLS = re.compile(r"[;@#$%&]")
+_FINAL_PERIOD_2 = re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$')
+_QUESTION_EXCLAMATION = re.compile(r"[?!]")
+_TRAILING_SINGLE_QUOTE = re.compile(r"([^'])' ")
+_ASTERISK = re.compile(r"[*]", re.U)
+_PARENS_BRACKETS = re.compile(r"[\]\[\(\)\{\}\<\>]")
+_DOUBLE_DASHES = re.compile(r"--")
+
+_ENDING_QUOTES_UNICODE = re.compile("([»”’])", re.U)
+_ENDING_TWO_SINGLE_QUOTES = re.compile(r"''")
+_ENDING_DOUBLE_QUOTE = re.compile(r'"')
+_ENDING_CLITICS_1 = re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') ")
+_ENDING_CLITICS_2 = re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) ")
+
+_CONTRACTIONS2 = [re.compile(pattern) for pattern in [r"(?i)\b(can)(?#X)(not)\b", r"(?i)\b(d)(?#X)('ye)\b", r"(?i)\b(gim)(?#X)(me)\b",
+                                                      r"(?i)\b(gon)(?#X)(na)\b", r"(?i)\b(got)(?#X)(ta)\b", r"(?i)\b(lem)(?#X)(me)\b",
+                                                      r"(?i)\b(more)(?#X)('n)\b", r"(?i)\b(wan)(?#X)(na)(?=\s)"]]
+_CONTRACTIONS2_SUBSTRINGS = ["cannot", "d'ye", "gimme", "gonna", "gotta", "lemme", "more'n", "wanna"]
+_CONTRACTIONS3 = [re.compile(pattern) for pattern in [r"(?i) ('t)(?#X)(is)\b", r"(?i) ('t)(?#X)(was)\b"]]
+
+def treebank_tokenize(text):
+    """
+    Same output as nltk.tokenize.destructive.NLTKWordTokenizer().tokenize(text) (nltk==3.6.7),
+    skipping the regexes whose characters are not in the text
+    """
+    has_single_quote = "'" in text
+    if any(c in text for c in "«“‘„`"): text = _STARTING_QUOTES_UNICODE.sub(r" \1 ", text)
+    if text[:1] == '"': text = _STARTING_DOUBLE_QUOTE.sub(r"``", text)
+    if "``" in text: text = _STARTING_BACKTICKS.sub(r" \1 ", text)
+    if '"' in text or "''" in text: text = _STARTING_OPEN_QUOTE.sub(r"\1 `` ", text)
+    if has_single_quote: text = _STARTING_SINGLE_QUOTE.sub(r"\1 \2", text)
+
+    has_period = "." in text
+    if has_period: text = _FINAL_PERIOD_1.sub(r"\1 \2 \3 ", text)
+    if ":" in text or "," in text:
+        text = _COLON_COMMA.sub(r" \1 \2", text)
+        text = _COLON_COMMA_END.sub(r" \1 ", text)
+    if ".." in text: text = _ELLIPSIS.sub(r" \g<0> ", text)
+    text = _SYMBOLS.sub(r" \g<0> ", text)
+    if has_period: text = _FINAL_PERIOD_2.sub(r"\1 \2\3 ", text)
+    if "?" in text or "!" in text: text = _QUESTION_EXCLAMATION.sub(r" \g<0> ", text)
+    if has_single_quote: text = _TRAILING_SINGLE_QUOTE.sub(r"\1 ' ", text)
+    if "*" in text: text = _ASTERISK.sub(r" \g<0> ", text)
+
+    text = _PARENS_BRACKETS.sub(r" \g<0> ", text)
+    if "--" in text: text = _DOUBLE_DASHES.sub(r" -- ", text)
+
+    text = " " + text + " "
+
+    if any(c in text for c in "»”’"): text = _ENDING_QUOTES_UNICODE.sub(r" \1 ", text)
+    if "''" in text: text = _ENDING_TWO_SINGLE_QUOTES.sub(" '' ", text)
+    if '"' in text: text = _ENDING_DOUBLE_QUOTE.sub(" '' ", text)
+    if "'" in text:
+        text = _ENDING_CLITICS_1.sub(r"\1 \2 ", text)
+        text = _ENDING_CLITICS_2.sub(r"\1 \2 ", text)
+
+    lower = text.lower()
+    if any(s in lower for s in _CONTRACTIONS2_SUBSTRINGS):
+        for regexp in _CONTRACTIONS2:
+            text = regexp.sub(r" \1 \2 ", text)
+    if "'t" in lower:
+        for regexp in _CONTRACTIONS3:
+            text = regexp.sub(r" \1 \2 ", text)
+    return text.split()
+
+#######################
+# Punkt (nltk==3.6.7) sentence breaks, only checked at the candidate sentence ends
+
+_NON_WORD = r"(?:[)\";}\]\*:@\'\({\[?!])"
+_MULTI_CHAR = r"(?:\-{2,}|\.{2,}|(?:\.\s){2,}\.)"
+_PUNKT_WORD = re.compile(r"""(
+        %(MultiChar)s
+        |
+        (?=[^\(\"\`{\[:;&\#\*@\)}\]\-,])\S+?
+        (?=
+            \s|
+            $|
+            %(NonWord)s|%(MultiChar)s|
+            ,(?=$|\s|%(NonWord)s|%(MultiChar)s)
+        )
+        |
+        \S
+    )""" % {"NonWord": _NON_WORD, "MultiChar": _MULTI_CHAR}, re.UNICODE | re.VERBOSE)
+_PERIOD_CONTEXT = re.compile(r"[.?!](?=(?P<after_tok>%s|\s+(?P<next_tok>\S+)))" % _NON_WORD, re.UNICODE)
+_BOUNDARY_REALIGNMENT = re.compile(r'["\')\]}]+?(?:\s+|(?=--)|$)', re.MULTILINE)
+_NUMERIC = re.compile(r"^-?[\.,]?\d[\d,\.-]*\.?$")
+_INITIAL = re.compile(r"[^\W\d]\.$", re.UNICODE)
+_ELLIPSIS_TOK = re.compile(r"\.\.+$")
+_ORTHO_MID_UC = 1 << 2
+_ORTHO_UC = (1 << 1) + (1 << 2) + (1 << 3)
+_ORTHO_BEG_LC = 1 << 4
+_ORTHO_LC = (1 << 4) + (1 << 5) + (1 << 6)
+
+_punkt_params = None
+
+def load_punkt_params():
+    """
+    The trained parameters of NLTK's English Punkt model (loaded once)
+    """
+    global _punkt_params
+    if _punkt_params is None:
+        ensure_punkt()
+        import nltk
+        _punkt_params = nltk.data.load("tokenizers/punkt/english.pickle")._params
+    return _punkt_params
+
+def _token_type(tok):
+    return _NUMERIC.sub("##number##", tok.lower())
+
+def _type_no_period(typ):
+    if len(typ) > 1 and typ[-1] == ".": return typ[:-1]
+    return typ
+
+def _ortho_heuristic(tok, typ, params):
+    """
+    Punkt's orthographic heuristic: True, False or "unknown" if tok starts a sentence
+    """
+    if tok in tuple(";:,.!?"): return False
+    ortho_context = params.ortho_context[typ]
+    if tok[0].isupper() and (ortho_context & _ORTHO_LC) and not (ortho_context & _ORTHO_MID_UC):
+        return True
+    if tok[0].islower() and ((ortho_context & _ORTHO_UC) or not (ortho_context & _ORTHO_BEG_LC)):
+        return False
+    return "unknown"
+
+def _first_pass(tok, params):
+    """
+    Returns (sentbreak, abbr, ellipsis) of a single Punkt token
+    """
+    if tok in (".", "?", "!"): return True, False, False
+    if _ELLIPSIS_TOK.match(tok): return False, False, True
+    if tok.endswith(".") and not tok.endswith(".."):
+        if tok[:-1].lower() in params.abbrev_types or tok[:-1].lower().split("-")[-1] in params.abbrev_types:
+            return False, True, False
+        return True, False, False
+    return False, False, False
+
+def _second_pass(tok1, annot1, tok2, annot2, params):
+    """
+    Punkt's token-based reclassification of tok1 given the next token tok2, returns whether tok1 is a sentence break
+    """
+    sentbreak, abbr, ellipsis = annot1
+    if not tok1.endswith("."): return sentbreak
+    typ = _type_no_period(_token_type(tok1))
+    typ2 = _token_type(tok2)
+    next_typ = _type_no_period(typ2) if annot2[0] else typ2
+    tok_is_initial = _INITIAL.match(tok1)
+
+    if (typ, next_typ) in params.collocations: return False
+    if (abbr or ellipsis) and not tok_is_initial:
+        is_sent_starter = _ortho_heuristic(tok2, next_typ, params)
+        if is_sent_starter == True: return True
+        if tok2[0].isupper() and next_typ in params.sent_starters: return True
+    if tok_is_initial or typ == "##number##":
+        is_sent_starter = _ortho_heuristic(tok2, next_typ, params)
+        if is_sent_starter == False: return False
+        if is_sent_starter == "unknown" and tok_is_initial and tok2[0].isupper() and not (params.ortho_context[next_typ] & _ORTHO_LC):
+            return False
+    return sentbreak
+
+def _contains_sentbreak(context, params):
+    """
+    PunktSentenceTokenizer.text_contains_sentbreak: a sentence break before the last token of context
+    """
+    toks = _PUNKT_WORD.findall(context)
+    annots = [_first_pass(tok, params) for tok in toks]
+    for i in range(len(toks)-1):
+        if _second_pass(toks[i], annots[i], toks[i+1], annots[i+1], params): return True
+    return False
+
+def sentence_spans(text, params):
+    """
+    Same spans as PunktSentenceTokenizer.span_tokenize(text) (nltk==3.6.7)
+    """
+    matches = []
+    before_start = None
+    for match in reversed(list(_PERIOD_CONTEXT.finditer(text))):
+        if matches and match.end() > before_start: continue
+        split = text[:match.start()].rsplit(maxsplit=1)
+        before_start = len(split[0]) if len(split) == 2 else 0
+        matches.append((match, split[-1] if split else ""))
+
+    slices = []
+    last_break = 0
+    for match, before_word in reversed(matches):
+        context = before_word + match.group() + match.group("after_tok")
+        if _contains_sentbreak(context, params):
+            slices.append((last_break, match.end()))
+            last_break = match.start("next_tok") if match.group("next_tok") else match.end()
+    slices.append((last_break, len(text.rstrip())))
+
+    # realign closing punctuation to the previous sentence
+    spans = []
+    realign = 0
+    for i, (start, stop) in enumerate(slices):
+        start = start + realign
+        if i == len(slices)-1:
+            if text[start:stop]: spans.append((start, stop))
+            continue
+        m = _BOUNDARY_REALIGNMENT.match(text[slices[i+1][0]:slices[i+1][1]])
+        if m:
+            spans.append((start, slices[i+1][0] + len(m.group(0).rstrip())))
+            realign = m.end()
+        else:
+            realign = 0
+            if text[start:stop]: spans.append((start, stop))
+    return spans
+
+def fast_word_tokenize(text):
+    """
+    Same tokens as nltk.word_tokenize(text) for the pipeline's purposes (see the top of this file)
+    """
+    if not _PERIOD_CONTEXT.search(text):
+        # a single sentence
+        return treebank_tokenize(text.rstrip()) if text.strip() else []
+    params = load_punkt_params()
+    toks = []
+    for start, stop in sentence_spans(text, params):
+        toks.extend(treebank_tokenize(text[start:stop]))
+    return toks
+
+#######################
+
+def token_features(toks):
+    """
+    What the pipeline uses from the tokens of an utterance
+    """
+    from advocate_gender import extract_last_gender_title_mention
+    return (len(toks), one_utt_rule_speech_disfluency(toks), extract_last_gender_title_mention(toks))
+
+def verify_fast_tokenizer(start_year, end_year, offline=False, max_print=20):
+    """
+    Compares fast_word_tokenize to nltk.word_tokenize on every utterance from start_year to end_year
+    and prints the utterances where the token count, number of disfluencies or gender title mention differ
+    """
+    ensure_punkt(offline=offline)
+    from nltk import word_tokenize
+    num_utts, num_diff, num_diff_toks = 0, 0, 0
+    time_nltk, time_fast = 0, 0
+    for year in range(start_year, end_year):
+        corpus = load_corpus("supreme-"+str(year), offline=offline)
+        for utt in corpus.iter_utterances():
+            text = utt.text
+            t = time.time()
+            toks_nltk = word_tokenize(text)
+            time_nltk += time.time() - t
+            t = time.time()
+            toks_fast = fast_word_tokenize(text)
+            time_fast += time.time() - t
+
+            num_utts += 1
+            if toks_nltk != toks_fast: num_diff_toks += 1
+            if token_features(toks_nltk) != token_features(toks_fast):
+                num_diff += 1
+                if num_diff <= max_print:
+                    print("utterance", utt.id, repr(text))
+                    print("\tword_tokenize (count, disfluencies, title) =", token_features(toks_nltk))
+                    print("\tfast          (count, disfluencies, title) =", token_features(toks_fast))
+        print(f"{year}: {num_utts} utterances so far, {num_diff} with different counts or flags")
+
+    print(f"Number of utterances = {num_utts}")
+    print(f"Utterances with different counts or flags = {num_diff}")
+    print(f"Utterances with different tokens (e.g. `` for a double quote) = {num_diff_toks}")
+    print(f"word_tokenize {time_nltk:.1f}s, fast_word_tokenize {time_fast:.1f}s")
+    return num_diff
+
+if __name__ == '__main__':
+    config = load_config()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start_year', type=int, default=config['start_year'])
+    parser.add_argument('--end_year', type=int, default=config['end_year'])
+    parser.add_argument('--offline', action='store_true', help='only use local ConvoKit corpora and NLTK punkt')
+    parser.add_argument('--max_print', type=int, default=20, help='maximum number of differing utterances to print')
+    args = parser.parse_args()
+
+    num_diff = verify_fast_tokenizer(args.start_year, args.end_year, offline=args.offline or config.get("offline", False), max_print=args.max_print)
+    sys.exit(1 if num_diff > 0 else 0)
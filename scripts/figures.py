@@ -0,0 +1,304 @@
+"""
+This file builds all the figures in our paper headlessly (no jupyter kernel needed)
+
+    python figures.py [--force] [--workers N]
+
+1. The input data of every figure is prepared from the cached estimator outputs
+   (see utils.load_or_compute_estimates and analysis.py) and the chunk / final dataframes.
+2. Each figure's input data, style parameters and rendering code are hashed. Only the figures
+   whose hash differs from the one recorded in `figure_hashes.json` (or whose output is missing) are re-rendered.
+3. The figures that need re-rendering are rendered in parallel worker processes.
+   Figure 5 is rendered by calling interruptionsPlot.r with Rscript.
+"""
+import os, sys
+import argparse
+import hashlib
+import inspect
+import json
+import pprint
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils import *
+from analysis import justice_effects_ordered, figure5_df
+
+# Style parameters for each figure, changing any of these re-renders the figure
+FIGURE_STYLES = {
+    'fig1-num-chunks': {'figsize': [32, 7], 'label_fontsize': 35, 'tick_fontsize': 25, 'text_fontsize': 25, 'legend_fontsize': 23, 'ylim': [0, 3500]},
+    'fig2a-fem-advocate': {'ylim': [0, 0.55], 'ylabel': "Prop. Chunks where a Fem. Adv. Speaks"},
+    'fig2b-fem-justice': {'ylim': [0, 0.55], 'ylabel': "Prop. Chunks where a Fem. Justice Speaks"},
+    'fig3-interruption-over-time': {'figsize': [30, 8], 'label_fontsize': 35, 'tick_fontsize': 25, 'text_fontsize': 20, 'legend_fontsize': 24, 'ylim': [0, 20]},
+    'fig4-justice-effects': {'figsize': [30, 20], 'label_fontsize': 40, 'ytick_fontsize': 30, 'tick_labelsize': 28, 'ey_xlim': [5, 23], 'theta_xlim': [-4, 5]},
+    'fig5-gendereffect-ideologyscore': {'rscript': 'interruptionsPlot.r'},
+    'figA1-heatedness': {'figsize': [12, 9], 'fontsize': 12},
+}
+
+#######################
+# Input data for each figure
+
+def chunk_counts_by_year(config):
+    """
+    Number of chunks and cases per year (before the justice filter), cached on the contents of the chunk files
+    """
+    fnames = sorted(list_chunk_files(config))
+    fingerprint = content_fingerprint(fnames, extra={key: config[key] for key in ['start_year', 'end_year', 'exclude_adv_first_utt']})
+    fname = os.path.join(config['estimates_path'], 'chunk_counts_by_year.csv')
+    fingerprint_fname = os.path.join(config['estimates_path'], 'chunk_counts_by_year.txt')
+    if os.path.exists(fname) and os.path.exists(fingerprint_fname):
+        with open(fingerprint_fname, 'r') as r:
+            if r.read().strip() == fingerprint: return pd.read_csv(fname)
+
+    df_raw = load_chunks_df(config)
+    years = np.arange(config['start_year'], config['end_year'], 1)
+    df_counts = pd.DataFrame({'year': years,
+                              'num_chunks': [len(df_raw[df_raw.case_year==year]) for year in years],
+                              'num_cases': [len(set(df_raw[df_raw.case_year==year].case_id)) for year in years]})
+    if not os.path.exists(config['estimates_path']): os.makedirs(config['estimates_path'])
+    df_counts.to_csv(fname, index=False)
+    with open(fingerprint_fname, 'w') as w:
+        w.write(fingerprint)
+    return df_counts
+
+def proportion_female_by_year(df, config):
+    years = [k for k in range(config['start_year'],config['end_year'],1)]
+    prop_fem_adv = []
+    prop_fem_just = []
+    for y in years:
+        total_chunks = len(df[df['case_year']==y])
+        prop_fem_adv.append(len(df[(df['case_year']==y) & (df['advocate_gender']=='F')])/total_chunks)
+        prop_fem_just.append(len(df[(df['case_year']==y) & (df['justice_gender']=='F')])/total_chunks)
+    return pd.DataFrame({'year': years, 'prop_fem_adv': prop_fem_adv, 'prop_fem_just': prop_fem_just})
+
+def interruption_rate_by_year(df, config):
+    years = np.arange(config['start_year'], config['end_year'])
+    return pd.DataFrame({'year': years,
+                         'adv_interruption_rate': [df[df.case_year==year]['adv_interruption_rate'].mean() for year in years],
+                         'justice_interruption_rate': [df[df.case_year==year]['justice_interruption_rate'].mean() for year in years]})
+
+def heatedness_df(df):
+    df_heat = df[['advocate_gender', 'justice_gender', 'adv_interruption_rate', 'justice_interruption_rate']]
+    return df_heat[(df_heat.adv_interruption_rate!=0) & (df_heat.justice_interruption_rate!=0)].reset_index(drop=True)
+
+#######################
+# Rendering (runs in the worker processes)
+
+def render_fig1(data, style, out):
+    import matplotlib.pyplot as plt
+    years = data['year'].to_numpy()
+    fig, ax1 = plt.subplots(figsize=style['figsize'])
+    # Left axis: Number of chunks
+    ax1.set_xlabel('Year', fontsize=style['label_fontsize'])
+    ax1.set_ylabel('Number of Chunks', fontsize=style['label_fontsize'])
+    ax1.bar(years, data['num_chunks'], color='lavender', label='Chunks')
+    plt.xticks(years, rotation=90, fontsize=style['tick_fontsize'])
+    plt.yticks(fontsize=style['tick_fontsize'])
+    plt.ylim(*style['ylim'])
+    for x, y in zip(years, data['num_chunks']):
+        plt.text(x-0.2, y+30, y, fontsize=style['text_fontsize'], rotation=90, color='black')
+
+    #Right axis: Number of cases
+    ax2 = ax1.twinx()
+    ax2.set_ylabel('Number of Cases',  fontsize=style['label_fontsize'])
+    ax2.plot(years, data['num_cases'], color='blue',  label='Cases')
+    ax2.set_yticks(np.arange(0, 250, 40))
+    plt.yticks(fontsize=style['tick_fontsize'])
+    fig.legend(loc="upper right", bbox_to_anchor=(1,1), bbox_transform=ax1.transAxes, fontsize=style['legend_fontsize'])
+    plt.tight_layout()
+    plt.savefig(out)
+    plt.close('all')
+
+def render_fig2(data, style, out):
+    import matplotlib.pyplot as plt
+    years = data['year'].to_numpy()
+    plt.stem(years, data['prop'])
+    plt.xlabel("Year")
+    plt.ylim(*style['ylim'])
+    plt.xlim(years[0]-1, years[-1]+1)
+    plt.ylabel(style['ylabel'])
+    plt.title(style['ylabel']+f" over Years {years[0]}-{years[-1]}")
+    plt.tight_layout()
+    plt.savefig(out)
+    plt.close('all')
+
+def render_fig3(data, style, out):
+    import matplotlib.pyplot as plt
+    years = data['year'].to_numpy()
+    plt.figure(figsize=style['figsize'])
+    plt.plot(data['adv_interruption_rate'].to_numpy(), 'o--', label='Advocate interruption rate')
+    plt.plot(data['justice_interruption_rate'].to_numpy(), 'o--', color='red', label='Justice interruption rate')
+    plt.xticks(ticks=np.arange(len(years)), labels=years, fontsize=style['tick_fontsize'], rotation=90)
+    for col in ['adv_interruption_rate', 'justice_interruption_rate']:
+        for x, y in zip(np.arange(len(years)), data[col]):
+            plt.text(x-0.2, y+0.2, np.round(y, 1), fontsize=style['text_fontsize'])
+    plt.ylim(*style['ylim'])
+    plt.yticks(fontsize=style['tick_fontsize'])
+    plt.ylabel('Mean interruption rate', fontsize=style['label_fontsize']) #advocate utts
+    plt.xlabel('Years',fontsize=style['label_fontsize'])
+    plt.tight_layout()
+    plt.legend(loc='best', fontsize=style['legend_fontsize'])
+    plt.savefig(out)
+    plt.close('all')
+
+def render_fig4(data, style, out):
+    import matplotlib.pyplot as plt
+    num_justices = len(data)
+    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=style['figsize'])
+
+    # y-ticks: Liberal or conservative, Justice name and then number of chunks
+    y1 = [str(x[0].upper()) for x in data['justice_ideology']] # Upper case e.g., 'C' or 'L' for conservative or liberal
+    y2 = [parse_last_name(x) for x in data['justice_name'].to_list()]
+    y3 = [str(x) for x in data['N (Chunks)'].to_list()]
+    yticks = [y11+'-'+y22+'\n('+y33+')' for y11, y22, y33 in zip(y1, y2, y3)]
+
+    # Ax 1: Y (token-normalized interruption rate)
+    ax1.set_yticks(np.arange(num_justices), yticks, rotation=0, fontsize=style['ytick_fontsize'])
+    ax1.set_xlim(*style['ey_xlim'])
+    ax1.set_xticks(np.arange(0, 25, 2))
+    ax1.set_xlabel('Y', fontsize=style['label_fontsize'])
+    for i in range(num_justices):
+        plot_confidence_interval(ax1, i, data.iloc[i]['E[Y]'], data.iloc[i]['Y std'], color='blue', horizontal_line_width=0.25, shift=True)
+
+    # Ax 2: Theta_Gender and Ax 3: Theta_Ideology
+    for ax, col, label in [(ax2, 'Gender Effect', r'$\theta_{Gender}$'),
+                           (ax3, 'Ideological Alignment Effect', r'$\theta_{Ideological\;Alignment}$')]:
+        ax.set_xlabel(label, fontsize=style['label_fontsize'])
+        for i in range(num_justices):
+            plot_confidence_interval(ax, i, data.iloc[i][col], data.iloc[i][col+' (Std)'])
+        ax.plot([0]*num_justices, list(np.arange(num_justices)), '--', color='red')
+        ax.set_xlim(*style['theta_xlim'])
+        ax.set_xticks(np.arange(style['theta_xlim'][0], style['theta_xlim'][1], 1))
+
+    for ax in fig.get_axes():
+        ax.label_outer()
+        ax.tick_params(axis='both', which='major', labelsize=style['tick_labelsize'])
+    plt.tight_layout()
+    plt.savefig(out)
+    plt.close('all')
+
+def render_fig5(data, style, out):
+    """
+    Writes the dataframe for Figure 5 next to the output and calls the R script
+    """
+    csv_fname = os.path.splitext(out)[0] + '.csv'
+    data.to_csv(csv_fname)
+    if shutil.which('Rscript') is None:
+        raise RuntimeError(f"Rscript not found, wrote {csv_fname}; run {style['rscript']} by hand")
+    subprocess.run(['Rscript', style['rscript'], csv_fname, out], check=True)
+
+def render_figA1(data, style, out):
+    import matplotlib.pyplot as plt
+    from scipy.stats import pearsonr
+    fig, axes = plt.subplots(2, 2, figsize=style['figsize'])
+    panels = [(0, 0, 'F', 'F', 'female advocate, female justice', (0.8, 0.9)),
+              (0, 1, 'F', 'M', 'female advocate, male justice', (2, 0.9)),
+              (1, 0, 'M', 'F', 'male advocate, female justice', (0.8, -0.3)),
+              (1, 1, 'M', 'M', 'male advocate, male justice', (2, -0.3))]
+    for row, col, adv_gender, just_gender, title, text_xy in panels:
+        df_panel = data[(data.advocate_gender==adv_gender) & (data.justice_gender==just_gender)]
+        x = np.log(df_panel['adv_interruption_rate'].to_numpy())
+        y = np.log(df_panel['justice_interruption_rate'].to_numpy())
+        corr, _ = pearsonr(x, y)
+        corr = np.round(corr, 2)
+        axes[row][col].scatter(x, y, s=2)
+        axes[row][col].set_title(title, fontsize=style['fontsize'])
+        axes[row][col].axes.text(text_xy[0], text_xy[1], r'$\rho$='+str(corr), horizontalalignment='left',\
+                                 verticalalignment='center', transform=axes[0][0].transAxes,\
+                                 fontsize=style['fontsize'])
+    fig.text(0.5, 0.03, 'advocate interruption rate (log scale)', ha='center', fontsize=style['fontsize'])
+    fig.text(0.05, 0.5, 'justice interruption rate (log scale)', va='center', rotation='vertical', fontsize=style['fontsize'])
+    plt.savefig(out)
+    plt.close('all')
+
+def render_figure(name, render_fn, data, style, out):
+    import matplotlib
+    matplotlib.use('Agg')
+    render_fn(data, style, out)
+    return name
+
+#######################
+
+def figure_inputs(config):
+    """
+    Output: dictionary of figure name -> (render function, input data (pd.DataFrame), style parameters)
+    """
+    df = load_final_df(config)
+    df_ey_j, df_theta_gender_j, df_theta_ideology_j = load_or_compute_estimates(config, df=df)
+    df_new = justice_effects_ordered(df_ey_j, df_theta_gender_j, df_theta_ideology_j)
+    df_prop = proportion_female_by_year(df, config)
+
+    inputs = {
+        'fig1-num-chunks': (render_fig1, chunk_counts_by_year(config)),
+        'fig2a-fem-advocate': (render_fig2, df_prop[['year', 'prop_fem_adv']].rename(columns={'prop_fem_adv': 'prop'})),
+        'fig2b-fem-justice': (render_fig2, df_prop[['year', 'prop_fem_just']].rename(columns={'prop_fem_just': 'prop'})),
+        'fig3-interruption-over-time': (render_fig3, interruption_rate_by_year(df, config)),
+        'fig4-justice-effects': (render_fig4, df_new),
+        'fig5-gendereffect-ideologyscore': (render_fig5, figure5_df(df_new, config)),
+        'figA1-heatedness': (render_figA1, heatedness_df(df)),
+    }
+    return {name: (render_fn, data, FIGURE_STYLES[name]) for name, (render_fn, data) in inputs.items()}
+
+def figure_hash(render_fn, data, style):
+    """
+    Content hash of a figure's input data, style parameters and rendering code
+    """
+    h = hashlib.sha256()
+    h.update(data.to_csv(index=False).encode())
+    h.update(json.dumps(style, sort_keys=True).encode())
+    h.update(inspect.getsource(render_fn).encode())
+    if 'rscript' in style:
+        with open(style['rscript'], 'rb') as r: h.update(r.read())
+    return h.hexdigest()
+
+def build_figures(config, force=False, workers=None):
+    """
+    Re-renders the figures whose content hash changed, in parallel worker processes
+
+    Output: the content hashes of the up-to-date figures (also written to figure_hashes.json) and the names of the
+    figures that failed to render (their hashes are left out, so they are re-rendered on the next run)
+    """
+    figs_path = config['figs_path']
+    if not os.path.exists(figs_path): os.makedirs(figs_path)
+    hashes_fname = os.path.join(figs_path, 'figure_hashes.json')
+    old_hashes = {}
+    if os.path.exists(hashes_fname):
+        with open(hashes_fname, 'r') as r: old_hashes = json.load(r)
+
+    inputs = figure_inputs(config)
+    new_hashes = {name: figure_hash(*spec) for name, spec in inputs.items()}
+    outs = {name: os.path.join(figs_path, name+'.pdf') for name in inputs}
+    to_render = [name for name in inputs if force or old_hashes.get(name) != new_hashes[name] or not os.path.exists(outs[name])]
+    print(f"Rendering {len(to_render)} of {len(inputs)} figures:", to_render)
+
+    hashes = {name: old_hashes[name] for name in inputs if name in old_hashes and name not in to_render}
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(render_figure, name, *inputs[name], outs[name]) for name in to_render}
+        for name, future in futures.items():
+            try:
+                future.result()
+                hashes[name] = new_hashes[name]
+                print("Saved", outs[name])
+            except Exception as e:
+                print(f"Error rendering {name}:", e)
+                failed.append(name)
+
+    with open(hashes_fname, 'w') as w:
+        json.dump(hashes, w, indent=1, sort_keys=True)
+    return hashes, failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--force', action='store_true', help='re-render all figures')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+
+    config = load_config()
+    pprint.pprint(config)
+    hashes, failed = build_figures(config, force=args.force, workers=args.workers)
+    if len(failed) > 0:
+        print(f"{len(failed)} figures failed to render:", failed)
+    sys.exit(1 if len(failed) > 0 else 0)
@@ -17,6 +17,36 @@ def go_join_filter(df, config):
     And then filters to justices with the minimum number of chunks 
     (set in `config.yaml` as `min_num_chunks_per_just`)
     """
+    df_final = join_chunk_features(df, config=config)
+    df = filter_justices(df_final, config)
+
+    #save the data frame 
+    df.to_csv(config['final_df_path'], index=False)
+    print("Saved final df to ->", config['final_df_path'])
+    return df 
+
+def join_chunk_features(df, verbose=True, config=None):
+    """
+    Makes all the necessary joins (justice gender, token-normalized interruption rates, ideological alignment)
+    and drops the chunks without a {0, 1} ideology match 
+
+    With config['mq_scores_path'] set, the justices' per-term Martin-Quinn scores are joined on (justice, term):
+        - ideology_matches compares the advocate to the justice's ideology in the term of the case 
+          ("justice_ideology_term") if config['ideology_alignment'] == "term", instead of the career label
+        - justice_mq_score: the justice's score in the term (NaN if the table has none; these chunks are kept)
+        - mq_alignment: justice_mq_score towards the advocate's side (times -1 for liberal advocates), 
+          a continuous alignment (> 0: the justice leans towards the advocate's side)
+    config defaults to load_config() 
+    """
+    if config is None: config = load_config()
+    justice_ideology_col = 'justice_ideology'
+    if config.get('mq_scores_path'):
+        mq = load_mq_scores(config['mq_scores_path'])
+        if 'justice_ideology_term' not in df.columns: # chunks extracted without mq_scores_path
+            df['justice_ideology_term'] = term_ideology_labels(join_mq_scores(mq, df['justice_name'], df['case_year']), df['justice_ideology'])
+    if config.get('ideology_alignment', 'label') == 'term':
+        assert config.get('mq_scores_path'), 'ideology_alignment: "term" needs mq_scores_path'
+        justice_ideology_col = 'justice_ideology_term'
 
     # Join with the justice genders
     justice_gender_map = load_justice_gender()
@@ -34,9 +64,9 @@ def go_join_filter(df, config):
             if row['advocate_name'] not in unk_advocates:
                 unk_advocates.append(row['advocate_name'])
             ideology_matches.append(np.nan)
-        elif row['advocate_ideology'] == row['justice_ideology']: 
+        elif row['advocate_ideology'] == row[justice_ideology_col]: 
             ideology_matches.append(1)
-        elif row['advocate_ideology'] != row['justice_ideology']:
+        elif row['advocate_ideology'] != row[justice_ideology_col]:
             ideology_matches.append(0)
     assert len(ideology_matches) == len(df)
     ideology_matches = np.array(ideology_matches)
@@ -51,9 +81,23 @@ def go_join_filter(df, config):
     #make the integer variables 
     df_final['ideology_matches'] = [int(x) for x in df_final['ideology_matches']]
 
-    print('original dataset num =', len(df))
-    print('dataset w/ {0, 1} ideology mathces num =', len(df_final))
+    if config.get('mq_scores_path'):
+        # after dropna, so the chunks of terms without a score are not dropped 
+        df_final['justice_mq_score'] = join_mq_scores(mq, df_final['justice_name'], df_final['case_year'])
+        df_final['mq_alignment'] = np.where(df_final['advocate_ideology'] == 'conservative', 1, -1) * df_final['justice_mq_score']
+
+    if verbose:
+        print('original dataset num =', len(df))
+        print('dataset w/ {0, 1} ideology mathces num =', len(df_final))
+    return df_final
 
+def filter_justices(df_final, config, verbose=True):
+    """
+    Filters to justices with more than config['min_num_chunks_per_just'] chunks 
+    and (if config['include_fem_issue'] == False) excludes cases with "female issues"
+
+    Input: df_final (pd.DataFrame) output of join_chunk_features 
+    """
     #checks if justices have enough chunks and cases 
     df_by_just = df_final.groupby('justice_name').agg({'case_id': pd.Series.nunique, 
                                                     'utt_id_first': pd.Series.nunique, 
@@ -70,23 +114,19 @@ def go_join_filter(df, config):
         if row['utt_id_first'] > config['min_num_chunks_per_just']: 
             valid_justices.append(row.name)
 
-    print(f"Number of justices with >{config['min_num_chunks_per_just']} chunks", len(valid_justices))
-    print("\t",valid_justices)
-
     # make the final datast with these justices 
     df = df_final.loc[df_final['justice_name'].isin(valid_justices)].copy()
     assert len(set(df['justice_name'].tolist())) == len(valid_justices)
-    print('before justice filter, num chunks =', len(df_final))
-    print('after justice filter, num chunks =', len(df))
+    if verbose:
+        print(f"Number of justices with >{config['min_num_chunks_per_just']} chunks", len(valid_justices))
+        print("\t",valid_justices)
+        print('before justice filter, num chunks =', len(df_final))
+        print('after justice filter, num chunks =', len(df))
 
     # KATIE TODO 
     if config['include_fem_issue'] == False: # exclude cases with "female issues"
         df = df[df["female_issue"] == 0]
-        print("Exluded female issues, num chunks", len(df))
-
-    #save the data frame 
-    df.to_csv(config['final_df_path'], index=False)
-    print("Saved final df to ->", config['final_df_path'])
+        if verbose: print("Exluded female issues, num chunks", len(df))
     return df 
 
 
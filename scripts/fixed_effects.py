@@ -0,0 +1,109 @@
+"""
+This file estimates theta_gender and theta_ideology for all justices at once with a (sparse) fixed-effects regression
+and analytic standard errors, as a fast alternative to the bootstrap standard deviations in utils.get_bootstrap_std
+
+    python fixed_effects.py
+
+For a binary treatment T (advocate gender with male=0, female=1, or ideology_matches) we fit by OLS
+
+    Y_i = sum_j alpha_j 1[justice_i = j] + sum_j theta_j 1[justice_i = j] T_i + e_i
+
+The model is saturated within each justice, so alpha_j = E[Y|justice j, T=0] and
+theta_j = E[Y|justice j, T=1] - E[Y|justice j, T=0], i.e. the same point estimates as calc_theta_gender and calc_theta_ideology.
+The standard errors are heteroskedasticity-robust (HC1) and clustered by case (CR1) sandwich estimators.
+The results are written to config['results_path']+'fixed_effects.csv'
+"""
+import os
+import pprint
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from utils import *
+from mediation_estimands import encode_treatment
+
+def design_matrix(df, treatment_colm_name):
+    """
+    Output: (X, justices), where X is the sparse (num chunks x 2*num justices) design matrix with
+    columns 2j (justice j) and 2j+1 (justice j x treatment)
+    """
+    justices, codes = np.unique(df['justice_name'].to_numpy(), return_inverse=True)
+    t = encode_treatment(df, treatment_colm_name)
+    n = len(df)
+    rows = np.concatenate([np.arange(n), np.arange(n)])
+    cols = np.concatenate([2*codes, 2*codes+1])
+    vals = np.concatenate([np.ones(n), t.astype(float)])
+    X = sp.csr_matrix((vals, (rows, cols)), shape=(n, 2*len(justices)))
+    return X, list(justices)
+
+def sandwich(bread, scores, factor):
+    """
+    factor * bread @ (scores' scores) @ bread, where the rows of scores are the score contributions
+    (of a chunk for HC1, summed over a cluster for CR1)
+    """
+    meat = (scores.T @ scores)
+    meat = meat.toarray() if sp.issparse(meat) else meat
+    return factor * bread @ meat @ bread
+
+def fit_fixed_effects(df, treatment_colm_name='advocate_gender', outcome_colm_name='adv_interruption_rate', cluster='case_id'):
+    """
+    Fits the regression above for one treatment
+
+    Output: pd.DataFrame with one row per justice and columns justice_name, theta, theta_se_hc1,
+    theta_se_cluster, total_num_chunks (the justices' chunks with T in {0, 1})
+    """
+    # as in calc_theta_gender, only the chunks with a male or female advocate are used
+    if treatment_colm_name == 'advocate_gender':
+        df = df[df['advocate_gender'].isin(['M', 'F'])]
+    else:
+        df = df[df[treatment_colm_name].isin([0, 1])]
+    X, justices = design_matrix(df, treatment_colm_name)
+    y = df[outcome_colm_name].to_numpy().astype(float)
+
+    # justices with only one treatment level have no theta; drop their (all zero or collinear) treatment column
+    col_counts = np.asarray(X.sum(axis=0)).ravel()
+    num_chunks = col_counts[0::2]
+    keep = np.ones(X.shape[1], dtype=bool)
+    keep[1::2] = (col_counts[1::2] > 0) & (col_counts[1::2] < num_chunks)
+    X = X[:, np.flatnonzero(keep)]
+    n, k = X.shape
+
+    XtX = (X.T @ X).toarray()
+    bread = np.linalg.inv(XtX)
+    beta = bread @ (X.T @ y)
+    resid = y - X @ beta
+    X_resid = sp.csr_matrix(X.multiply(resid[:, np.newaxis]))
+
+    V_hc1 = sandwich(bread, X_resid, n/(n-k))
+    cluster_codes = df.groupby(cluster, sort=False).ngroup().to_numpy()
+    num_clusters = cluster_codes.max()+1
+    C = sp.csr_matrix((np.ones(n), (cluster_codes, np.arange(n))), shape=(num_clusters, n))
+    V_cr1 = sandwich(bread, C @ X_resid, num_clusters/(num_clusters-1) * (n-1)/(n-k))
+
+    full = np.full((len(keep), 3), np.nan)
+    full[keep] = np.column_stack([beta, np.sqrt(np.diag(V_hc1)), np.sqrt(np.diag(V_cr1))])
+    return pd.DataFrame({'justice_name': justices,
+                         'theta': full[1::2, 0],
+                         'theta_se_hc1': full[1::2, 1],
+                         'theta_se_cluster': full[1::2, 2],
+                         'total_num_chunks': num_chunks.astype(int)})
+
+def fixed_effects_estimates(df, cluster='case_id'):
+    """
+    Output: (df_theta_gender_fe, df_theta_ideology_fe), see fit_fixed_effects
+    """
+    return (fit_fixed_effects(df, 'advocate_gender', cluster=cluster),
+            fit_fixed_effects(df, 'ideology_matches', cluster=cluster))
+
+if __name__ == '__main__':
+    config = load_config()
+    pprint.pprint(config)
+    df = load_final_df(config)
+    df_gender, df_ideology = fixed_effects_estimates(df)
+    df_fe = pd.concat([df_gender.assign(effect='theta_gender'), df_ideology.assign(effect='theta_ideology')])
+    print(df_fe.to_string())
+
+    if not os.path.exists(config['results_path']): os.makedirs(config['results_path'])
+    fname = os.path.join(config['results_path'], 'fixed_effects.csv')
+    df_fe.to_csv(fname, index=False)
+    print("Saved fixed effects estimates to ->", fname)
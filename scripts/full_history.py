@@ -0,0 +1,136 @@
+"""
+This file runs the justice filter and the per-justice estimators over the full ConvoKit history out of core: the chunks
+are read one term at a time, so the peak memory is set by the largest term instead of the whole corpus
+
+    INTERRUPTIONS_CONFIG=config-full-history.yaml python create_analyze_chunks.py
+    INTERRUPTIONS_CONFIG=config-full-history.yaml python full_history.py [--num_bootstraps N] [--cluster case_id] [--seed 0]
+
+The filter (the same as filter.go_join_filter) takes two passes over the terms:
+    1. join_chunk_features on every term, which is written to config['final_partition_path']<term>.csv,
+       and the number of chunks (unique utt_id_first) of every justice is added up over the terms
+    2. every term partition is filtered to the justices with more than min_num_chunks_per_just chunks (and without the
+       female issues, see filter.filter_justices) and appended to config['final_df_path']
+The estimators then read the term partitions one at a time and only keep the cluster cell sums of every justice
+(see utils.cluster_cell_sums; a case never spans two terms), from which E[Y], theta_gender, theta_ideology and their
+bootstrap standard deviations are computed -> config['results_path']+'full_history_estimates.csv'
+"""
+import os
+import argparse
+import pprint
+from collections import defaultdict, Counter
+import numpy as np
+import pandas as pd
+
+from utils import *
+from filter import join_chunk_features
+
+def chunk_files_by_term(config):
+    """
+    Output: dictionary term -> the chunk files of its cases (the term is the prefix of the case id, e.g. 1987_86-1234)
+    """
+    term2fnames = defaultdict(list)
+    for fname in list_chunk_files(config):
+        term2fnames[int(os.path.basename(fname).split('_')[0])].append(fname)
+    return {term: sorted(fnames) for term, fnames in sorted(term2fnames.items())}
+
+def iter_chunk_partitions(config):
+    """
+    Yields (term, the data frame of the term's chunks), with the filters of utils.load_chunks_df
+    """
+    for term, fnames in chunk_files_by_term(config).items():
+        if term < config['start_year']: continue
+        df = load_chunks_df(config, fnames=fnames)
+        if len(df) > 0: yield term, df
+
+def partition_fname(config, term):
+    return os.path.join(config['final_partition_path'], f'{term}.csv')
+
+def iter_final_partitions(config):
+    """
+    Yields (term, the data frame of the term's chunks in the final data frame), see streaming_filter
+    """
+    for fname in sorted(glob.glob(os.path.join(config['final_partition_path'], '*.csv'))):
+        df = pd.read_csv(fname)
+        if len(df) > 0: yield int(os.path.basename(fname).split('.')[0]), df
+
+def streaming_filter(config):
+    """
+    filter.go_join_filter, one term at a time (see above)
+
+    Output: the valid justices
+    """
+    if not os.path.exists(config['final_partition_path']): os.makedirs(config['final_partition_path'])
+    for fname in glob.glob(os.path.join(config['final_partition_path'], '*.csv')): os.remove(fname)
+
+    # pass 1: joins and the number of chunks per justice
+    just2num_chunks = Counter()
+    num_chunks = 0
+    for term, df in iter_chunk_partitions(config):
+        df = join_chunk_features(df, verbose=False, config=config)
+        just2num_chunks.update(df.groupby('justice_name')['utt_id_first'].nunique().to_dict())
+        num_chunks += len(df)
+        df.to_csv(partition_fname(config, term), index=False)
+        print(f"{term}: {len(df)} chunks with a {{0, 1}} ideology match")
+    valid_justices = sorted(justice for justice, count in just2num_chunks.items() if count > config['min_num_chunks_per_just'])
+    print(f"Number of justices with >{config['min_num_chunks_per_just']} chunks", len(valid_justices))
+    print("\t", valid_justices)
+    print('before justice filter, num chunks =', num_chunks)
+
+    # pass 2: filter every term and append it to the final data frame
+    if os.path.exists(config['final_df_path']): os.remove(config['final_df_path'])
+    columns = None
+    header_written = False
+    num_chunks = 0
+    for term, df in iter_final_partitions(config):
+        df = df[df['justice_name'].isin(valid_justices)]
+        if config['include_fem_issue'] == False: # exclude cases with "female issues"
+            df = df[df["female_issue"] == 0]
+        df.to_csv(partition_fname(config, term), index=False)
+        if columns is None: columns = list(df.columns)
+        df[columns].to_csv(config['final_df_path'], mode='a', header=not header_written, index=False)
+        header_written = True # also when the first terms are empty after the filter
+        num_chunks += len(df)
+    print('after justice (and female issue) filter, num chunks =', num_chunks)
+    print("Saved final df to ->", config['final_df_path'])
+    return valid_justices
+
+def streaming_estimates(config, num_bootstraps, cluster='case_id', seed=0):
+    """
+    E[Y], theta_gender and theta_ideology per justice and their bootstrap standard deviations (see utils.estimates_table)
+    from the final term partitions; only the cluster cell sums are kept in memory (cluster == None: one row per chunk)
+
+    Output: pd.DataFrame with one row per justice and effect
+    """
+    just2cell_sums = defaultdict(list)
+    just2num_chunks, just2num_cases = Counter(), Counter()
+    for term, df in iter_final_partitions(config):
+        for justice, cell_sums in cluster_cell_sums(df, cluster).items():
+            just2cell_sums[justice].append(cell_sums)
+        just_groups = df.groupby('justice_name')
+        just2num_chunks.update(just_groups.size().to_dict())
+        just2num_cases.update(just_groups['case_id'].nunique().to_dict())
+    justices = sorted(just2cell_sums)
+    cell_sums = {justice: np.concatenate(just2cell_sums[justice]) for justice in justices}
+    return estimates_table(cell_sums, justices, [just2num_chunks[justice] for justice in justices],
+                           [just2num_cases[justice] for justice in justices], num_bootstraps, np.random.default_rng(seed))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_bootstraps', type=int, default=None, help='default: num_bootstrap_samples in config.yaml')
+    parser.add_argument('--cluster', default=None, help='e.g. case_id (default: bootstrap_cluster in config.yaml)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip_filter', action='store_true', help='only the estimators, on the existing term partitions')
+    args = parser.parse_args()
+
+    config = load_config()
+    pprint.pprint(config)
+    if not args.skip_filter:
+        streaming_filter(config)
+    df_estimates = streaming_estimates(config, args.num_bootstraps or config['num_bootstrap_samples'],
+                                       cluster=args.cluster or config.get('bootstrap_cluster'), seed=args.seed)
+    print(df_estimates.to_string())
+
+    if not os.path.exists(config['results_path']): os.makedirs(config['results_path'])
+    fname = os.path.join(config['results_path'], 'full_history_estimates.csv')
+    df_estimates.to_csv(fname, index=False)
+    print("Saved the full history estimates to ->", fname)
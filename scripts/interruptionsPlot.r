@@ -4,7 +4,12 @@
 # =-=-=-=-=-=-
 library(ggplot2)
 
-data <- read.csv("./data/df_figure5.csv") 
+# optional arguments: input csv and output pdf (used by figures.py)
+args <- commandArgs(trailingOnly = TRUE)
+in_fname <- if (length(args) >= 1) args[1] else "./data/df_figure5.csv"
+out_fname <- if (length(args) >= 2) args[2] else "./figs/fig5-gendereffect-ideologyscore.pdf"
+
+data <- read.csv(in_fname) 
 
 data$justices <- data$justice_last_name
 data$genderEffect <- as.numeric(data$Gender.Effect)
@@ -24,4 +29,4 @@ p <- ggplot(data, aes(x=ideology, y=genderEffect)) +
   theme_bw()
 
 
-ggsave(filename = './figs/fig5-gendereffect-ideologyscore.pdf', plot = p, width = 8, height = 6)
\ No newline at end of file
+ggsave(filename = out_fname, plot = p, width = 8, height = 6)
\ No newline at end of file
@@ -161,3 +161,242 @@ def pearls_mediation(df_just, justice_name):
     out["nde"] = nde
     out["nie"] = nie
     return out
+
+def encode_treatment(df, treatment_colm_name):
+    """
+    Returns the treatment column as a numpy array of 0/1 ints 
+    (advocate_gender is mapped to male=0, female=1 as in make_df_justice_general)
+    """
+    if(treatment_colm_name=="advocate_gender"):
+        t = df[treatment_colm_name].map({'M': 0, 'F': 1}).to_numpy()
+    else:
+        t = df[treatment_colm_name].to_numpy()
+    assert set(np.unique(t)) <= {0, 1}, f"{treatment_colm_name} is not a binary treatment"
+    return t.astype(int)
+
+def mediation_from_counts(counts, sums):
+    """
+    Vectorized version of pearls_mediation (same NDE and NIE) computed from cell counts and outcome sums 
+
+    Inputs:
+        - counts (np.array): shape (num_samples, 2, num_levels), count_chunks(T=t, M=m) for each (re)sample 
+        - sums (np.array): same shape, sum of Y over the chunks with T=t, M=m
+
+    Output: (nde, nie) each an np.array of shape (num_samples,)
+
+    Like pearls_mediation, only the m's in the support of each (re)sample are summed over 
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_m_cond_t = counts / counts.sum(axis=2, keepdims=True) # P(M=m|T=t)
+        e_y = sums / counts # E[Y|T=t, M=m]
+    in_support = counts.sum(axis=1) > 0
+
+    nde_m = (e_y[:, 1, :] - e_y[:, 0, :]) * p_m_cond_t[:, 0, :]
+    nie_m = e_y[:, 0, :] * (p_m_cond_t[:, 1, :] - p_m_cond_t[:, 0, :])
+    nde = np.where(in_support, nde_m, 0).sum(axis=1)
+    nie = np.where(in_support, nie_m, 0).sum(axis=1)
+    return nde, nie
+
+def nanmean_justices(values):
+    """
+    Mean over the justices (axis 0) that have an estimate; like DataFrame.mean in get_std, 
+    NaN (an empty (T, M) cell) is skipped and only an all-NaN column gives NaN
+    """
+    has_estimate = ~np.isnan(values)
+    num = has_estimate.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(num > 0, np.where(has_estimate, values, 0).sum(axis=0) / num, np.nan)
+
+def get_estimands_multi(df_input, mediator_colm_names, treatment_colm_names, outcome_colm_name,\
+                        num_bootstraps, justice_gender_map, seed=0):
+    """
+    Runs the per-justice mediation analysis (NDE and NIE, see pearls_mediation) for every 
+    combination of mediator and treatment in one call. 
+
+    The data frame is partitioned by justice once and the bootstrap resample indices are drawn 
+    once per justice, so every mediator/treatment combination is evaluated on the same resamples. 
+    Each resample is reduced with np.bincount over the (T, M) cells, so mediators with many levels 
+    (e.g., disfluency deciles) cost about the same as binary ones. 
+
+    Inputs: 
+        - df_input (pd.DataFrame): finalized data frame 
+        - mediator_colm_names (list): discrete mediator columns 
+        - treatment_colm_names (list): binary treatment columns (advocate_gender is mapped to male=0, female=1)
+        - outcome_colm_name (str): outcome column, e.g. 'adv_interruption_rate'
+        - num_bootstraps (int): number of bootstrap resamples per justice 
+        - justice_gender_map (dict): justice name -> 'M' or 'F'
+        - seed (int, optional): seed for the resample indices 
+
+    Output: tidy pd.DataFrame with one row per (treatment, mediator, group, justice, estimand) and columns 
+        treatment, mediator, group ('justice', 'all', 'male' or 'female'), justice_name (None for the 
+        averages over justices), estimand ('nde' or 'nie'), estimate, std, num_chunks
+
+        std is the standard deviation of the bootstrap distribution (as in get_std); for the averages 
+        over justices, each bootstrap replicate is the mean of the per-justice replicates. The averages skip 
+        the justices without an estimate (an empty (T, M) cell), as DataFrame.mean does in get_std. 
+    """
+    rng = np.random.default_rng(seed)
+    justices = sorted(df_input['justice_name'].unique())
+    just2rows = df_input.groupby('justice_name').indices 
+
+    y = df_input[outcome_colm_name].to_numpy().astype(float)
+    t_all = {t: encode_treatment(df_input, t) for t in treatment_colm_names}
+    m_all = {}
+    for m in mediator_colm_names:
+        levels, codes = np.unique(df_input[m].to_numpy(), return_inverse=True)
+        m_all[m] = (codes, len(levels))
+
+    # (treatment, mediator) -> estimand -> list (per justice) of (point estimate, bootstrap replicates)
+    results = {(t, m): {'nde': [], 'nie': []} for t in treatment_colm_names for m in mediator_colm_names if t != m}
+    for just in justices: 
+        rows = just2rows[just]
+        num_rows = len(rows)
+        y_just = y[rows]
+
+        # shared resamples; row 0 is the original sample 
+        resample_idx = rng.integers(0, num_rows, size=(num_bootstraps, num_rows))
+        sample_idx = np.vstack([np.arange(num_rows)[np.newaxis, :], resample_idx])
+        y_sample = y_just[sample_idx].ravel()
+        offset = np.arange(num_bootstraps + 1)[:, np.newaxis]
+
+        for t in treatment_colm_names: 
+            t_just = t_all[t][rows]
+            for m in mediator_colm_names: 
+                if t == m: continue
+                m_codes, num_levels = m_all[m]
+                cells = (t_just * num_levels + m_codes[rows])[sample_idx]
+                flat = (cells + offset * 2 * num_levels).ravel()
+                size = (num_bootstraps + 1) * 2 * num_levels
+                counts = np.bincount(flat, minlength=size).reshape(-1, 2, num_levels)
+                sums = np.bincount(flat, weights=y_sample, minlength=size).reshape(-1, 2, num_levels)
+                nde, nie = mediation_from_counts(counts, sums)
+                results[t, m]['nde'].append((nde[0], nde[1:]))
+                results[t, m]['nie'].append((nie[0], nie[1:]))
+
+    num_chunks = [len(just2rows[just]) for just in justices]
+    groups = {'all': [True for just in justices], 
+              'male': [justice_gender_map[just]=='M' for just in justices], 
+              'female': [justice_gender_map[just]=='F' for just in justices]}
+    out = []
+    for (t, m), estimands in results.items(): 
+        for estimand, per_justice in estimands.items(): 
+            point = np.array([p for p, _ in per_justice])
+            boots = np.array([b for _, b in per_justice]) # shape (num_justices, num_bootstraps)
+            for i, just in enumerate(justices): 
+                out.append({'treatment': t, 'mediator': m, 'group': 'justice', 'justice_name': just, 'estimand': estimand,
+                            'estimate': point[i], 'std': np.std(boots[i]), 'num_chunks': num_chunks[i]})
+            missing = [just for i, just in enumerate(justices) if np.isnan(point[i])]
+            if len(missing) > 0:
+                print(f"{t}, {m}, {estimand}: no estimate (empty (T, M) cell) for {missing}, left out of the averages over justices")
+            for group, mask in groups.items(): 
+                mask = np.array(mask)
+                if mask.sum() == 0: continue
+                out.append({'treatment': t, 'mediator': m, 'group': group, 'justice_name': None, 'estimand': estimand,
+                            'estimate': float(nanmean_justices(point[mask])), 'std': np.std(nanmean_justices(boots[mask])), 
+                            'num_chunks': int(np.array(num_chunks)[mask].sum())})
+    return pd.DataFrame(out)
+
+def get_std(bootstraps, T_hat, metric):
+    #Using 6.16 Theorem (Normal-based Confidence Interval; 95%) in Wasserman 2004 
+    bootstrap_distribution = []
+    for b in bootstraps:
+        bootstrap_distribution.append(b[metric].mean())
+    
+    std_error = np.std(bootstrap_distribution)   
+    return std_error
+
+def get_estimands(df_input, mediator_colm_name, treatment_colm_name, outcome_colm_name,\
+                  num_bootstraps, justice_gender_map): 
+    """
+    Per-justice mediation analysis (NDE and NIE, see pearls_mediation) with bootstrap standard deviations, 
+    and the averages over all, male and female justices (as in supplemental_analysis.ipynb, Table 4)
+
+    Inputs: 
+        - df_input (pd.DataFrame): finalized data frame 
+        - mediator_colm_name (str): discrete mediator column 
+        - treatment_colm_name (str): binary treatment column (advocate_gender is mapped to male=0, female=1)
+        - outcome_colm_name (str): outcome column, e.g. 'adv_interruption_rate'
+        - num_bootstraps (int): number of bootstrap resamples per justice 
+        - justice_gender_map (dict): justice name -> 'M' or 'F'
+    """
+    justices = list(set(df_input['justice_name']))
+    
+    #ideology per justice
+    ideology_map = {}
+    for just in justices: 
+        ideology_map[just] = df_input[df_input.justice_name==just]['justice_ideology'].iloc[0]
+
+    #get estimands through mediated paths 
+    df_mediated_effects = []
+    bootsraps_for_mediated_effects = {}
+    for just in justices: 
+        df_just = make_df_justice_general(just, df_input,\
+                                        mediator_colm_name = mediator_colm_name,\
+                                        treatment_colm_name = treatment_colm_name,\
+                                        outcome_colm_name = outcome_colm_name)
+
+        T_hat = pearls_mediation(df_just, just)
+
+        # get bootstrap std
+        bootstraps = []
+        for bs in range(num_bootstraps):
+            df_just_bs = df_just.sample(frac=1, replace=True)
+            out_bs = pearls_mediation(df_just_bs, just)
+            bootstraps.append(out_bs)
+
+        for m in ['nde', 'nie']:
+            std = get_std(bootstraps, T_hat, m)
+            T_hat['std_'+m] = std
+
+        T_hat["num_chunks"] = len(df_input[df_input.justice_name==just]) 
+        df_mediated_effects.append(T_hat)
+        bootsraps_for_mediated_effects[just] = bootstraps
+        
+    df_mediated_effects = pd.DataFrame(df_mediated_effects)
+
+    out = {'mediator_colm_name': mediator_colm_name,  
+           'mediated': df_mediated_effects, 
+           'ideology_map': ideology_map}
+
+    #average nde and nie over all, male and female justices 
+    groups = {'justices': justices, 
+              'male_justices': [just for just in justices if justice_gender_map[just]=='M'], 
+              'female_justices': [just for just in justices if justice_gender_map[just]=='F']}
+    for metric, effect_name in [('nde', 'direct_effect'), ('nie', 'indirect_effect')]: 
+        for group, group_justices in groups.items(): 
+            bootsraps_for_mean_mediated_effect = []
+            for boot in range(num_bootstraps):
+                mediated_effects_over_just = [bootsraps_for_mediated_effects[just][boot][metric] for just in group_justices]
+                bootsraps_for_mean_mediated_effect.append(pd.DataFrame(mediated_effects_over_just, columns=[metric]))
+
+            avg_hat = {metric: df_mediated_effects[df_mediated_effects['justice_name'].isin(group_justices)][metric].mean()}
+            avg_hat['std_'+metric] = get_std(bootsraps_for_mean_mediated_effect, avg_hat, metric)
+            out[f'avg_{effect_name}_over_{group}'] = avg_hat
+    return out
+
+def add_disfluency_tertiles(df_subset): 
+    """
+    Adds the advocate's token-normalized speech disfluency rate ('adv_disfl_rate') and 
+    its tertiles ('adv_disfl_rate_tertiles' in {0, 1, 2}), the speech disfluency mediator 
+    """
+    df_subset = df_subset.copy()
+    df_subset['adv_disfl_rate'] = 1000*df_subset['num_adv_disfl']/df_subset['num_toks_adv']
+    adv_disfl_rate = df_subset['adv_disfl_rate'].to_numpy()
+
+    # discretizing disfluency rates into tertiles 
+    t1 = np.quantile(adv_disfl_rate, 1/3)
+    t2 = np.quantile(adv_disfl_rate, 2/3)
+    print('disfluency rate (first quantile): ', t1)
+    print('disfluency rate (second quantile): ', t2)
+
+    adv_disfl_rate_tertiles = []
+    for x in adv_disfl_rate: 
+        if 0 <= x < t1: 
+            adv_disfl_rate_tertiles.append(0)
+        elif t1 <= x < t2: 
+            adv_disfl_rate_tertiles.append(1)
+        elif t2 <= x: 
+            adv_disfl_rate_tertiles.append(2)
+    assert len(adv_disfl_rate_tertiles) == len(adv_disfl_rate) == len(df_subset)
+    df_subset['adv_disfl_rate_tertiles'] = np.array(adv_disfl_rate_tertiles).astype(int)
+    return df_subset
@@ -0,0 +1,108 @@
+"""
+This file matches the advocate names in the transcripts (ConvoKit speaker names) to the advocates of the case in cases.jsonl
+
+The names often differ only in punctuation and suffixes (e.g. "John G. Roberts Jr." in the transcript and "John G. Roberts, Jr."
+in cases.jsonl), and then get_advocate_ideology could not find the advocate's side. With config['resolve_advocate_names'] == True
+a transcript name is resolved to the case's advocate by
+    1. the normalized name (lower case, no accents, punctuation, suffixes or titles), or else
+    2. the best difflib similarity among the case's advocates with the same last name and first initial (the blocking index),
+       or with the same last name only (e.g. nicknames), with a higher minimum score
+The blocking index of a case is built once and every resolution is memoized. The names that could not be resolved are
+written to UNRESOLVED_ADVOCATES_PATH (case_id, advocate_name, best_candidate, score) by write_unresolved_report.
+"""
+import os
+import re
+import csv
+import difflib
+import unicodedata
+
+UNRESOLVED_ADVOCATES_PATH = 'data/unresolved_advocates.csv'
+
+SUFFIXES = {'jr', 'sr', 'ii', 'iii', 'iv', 'esq', 'mr', 'mrs', 'ms', 'dr'}
+# minimum similarity within the (last name, first initial) block and within the last name block
+MIN_SCORE_BLOCK = 0.6
+MIN_SCORE_LAST_NAME = 0.8
+
+_case_indexes = {}
+_resolved = {}
+_unresolved = {}
+
+def normalize_name(name):
+    """
+    Lower case ascii name without punctuation, suffixes and titles, e.g. "John G. Roberts, Jr." -> "john g roberts"
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    return ' '.join(tok for tok in re.sub(r'[^a-z0-9]+', ' ', name).split() if tok not in SUFFIXES)
+
+def block_keys(normalized):
+    """
+    The blocking keys of a normalized name: (last name, first initial) and last name
+    """
+    toks = normalized.split()
+    if len(toks) == 0: return None, None
+    return (toks[-1], toks[0][0]), toks[-1]
+
+def build_case_index(advocates):
+    """
+    Inputs: advocates, the advocate names of a case (the keys of caseid2stuff[case_id]["advocates"])
+    Output: dictionary with the exact index (normalized name -> advocate) and the two blocking indexes
+    (block key -> [(normalized name, advocate), ...])
+    """
+    index = {'exact': {}, 'block': {}, 'last_name': {}}
+    for advocate in advocates:
+        normalized = normalize_name(advocate)
+        index['exact'].setdefault(normalized, advocate)
+        block, last_name = block_keys(normalized)
+        if block is None: continue
+        index['block'].setdefault(block, []).append((normalized, advocate))
+        index['last_name'].setdefault(last_name, []).append((normalized, advocate))
+    return index
+
+def best_match(normalized, candidates):
+    """
+    Output: (advocate, score) of the most similar candidate, advocate is None if two candidates tie
+    """
+    scores = sorted(((difflib.SequenceMatcher(None, normalized, cand).ratio(), advocate) for cand, advocate in candidates), reverse=True)
+    if len(scores) == 0: return None, 0.
+    if len(scores) > 1 and scores[1][0] == scores[0][0] and scores[1][1] != scores[0][1]: return None, scores[0][0]
+    return scores[0][1], scores[0][0]
+
+def resolve_advocate(caseid2stuff, case_id, name):
+    """
+    Output: the key of the transcript advocate name in caseid2stuff[case_id]["advocates"], None if it cannot be resolved
+    """
+    if (case_id, name) in _resolved: return _resolved[(case_id, name)]
+    advocates = caseid2stuff[case_id].get("advocates") or {}
+    if name in advocates:
+        _resolved[(case_id, name)] = name
+        return name
+    if case_id not in _case_indexes:
+        _case_indexes[case_id] = build_case_index(advocates)
+    index = _case_indexes[case_id]
+
+    normalized = normalize_name(name)
+    advocate, score = index['exact'].get(normalized), 1.
+    if advocate is None:
+        block, last_name = block_keys(normalized)
+        advocate, score = best_match(normalized, index['block'].get(block, []))
+        if advocate is None or score < MIN_SCORE_BLOCK:
+            advocate, score = best_match(normalized, index['last_name'].get(last_name, []))
+            if score < MIN_SCORE_LAST_NAME: advocate = None
+    if advocate is None:
+        # the closest advocate of the case, for the report
+        _unresolved[(case_id, name)] = best_match(normalized, [(normalize_name(a), a) for a in advocates])
+    _resolved[(case_id, name)] = advocate
+    return advocate
+
+def write_unresolved_report(fname=UNRESOLVED_ADVOCATES_PATH):
+    """
+    Writes the advocate names that could not be resolved (so far in this process) to fname
+    """
+    if os.path.dirname(fname) and not os.path.exists(os.path.dirname(fname)): os.makedirs(os.path.dirname(fname))
+    with open(fname, 'w', newline='') as w:
+        writer = csv.writer(w)
+        writer.writerow(['case_id', 'advocate_name', 'best_candidate', 'score'])
+        for (case_id, name), (candidate, score) in sorted(_unresolved.items()):
+            writer.writerow([case_id, name, candidate if candidate is not None else '', round(score, 3)])
+    num_resolved = sum(advocate is not None and advocate != name for (case_id, name), advocate in _resolved.items())
+    print(f"Advocate names: {num_resolved} resolved to a different spelling, {len(_unresolved)} unresolved ->", fname)
@@ -0,0 +1,126 @@
+"""
+This file runs randomization (permutation) tests for the per-justice effects, e.g. theta_gender (see utils.calc_theta_gender)
+
+    python permutation_test.py [--num_permutations N] [--within_case] [--treatment advocate_gender]
+
+For each justice, the treatment labels (advocate gender by default) are permuted among the justice's chunks
+(or, with --within_case, among the chunks of the same case) and theta is recomputed on every permutation.
+The two-sided p-value is the share of permutations with |theta| at least as large as the observed one.
+The results are written to config['results_path']+'permutation_tests.csv'
+"""
+import os
+import argparse
+import pprint
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from utils import *
+from mediation_estimands import encode_treatment
+
+def permutation_null(y, t, strata, num_permutations, rng, batch_elements=4000000):
+    """
+    Null distribution of theta = E[Y|T=1] - E[Y|T=0] under permutations of the 0/1 labels t within strata
+
+    Inputs:
+        - y (np.array): outcomes
+        - t (np.array): 0/1 treatment labels
+        - strata (np.array or None): integer codes; labels are only permuted among rows with the same code
+        - num_permutations (int)
+        - rng (np.random.Generator)
+        - batch_elements (int): permutations are drawn in batches of about this many labels
+    Output: np.array of shape (num_permutations,)
+    """
+    num_rows = len(y)
+    num_treated = t.sum()
+    total = y.sum()
+    if strata is None:
+        blocks = [np.arange(num_rows)]
+    else:
+        # only the strata with both labels change under a permutation
+        blocks = [rows for rows in pd.Series(np.arange(num_rows)).groupby(strata).indices.values() if 0 < t[rows].sum() < len(rows)]
+    fixed = np.ones(num_rows, dtype=bool)
+    for rows in blocks: fixed[rows] = False
+    sum_fixed = y[fixed & (t==1)].sum()
+
+    batch_size = max(1, batch_elements // max(1, num_rows - fixed.sum()))
+    null = np.empty(num_permutations)
+    for start in range(0, num_permutations, batch_size):
+        b = min(batch_size, num_permutations - start)
+        sum_treated = np.full(b, sum_fixed)
+        for rows in blocks:
+            # the treated rows of a random permutation are the k rows with the smallest random keys (k = number treated)
+            k = t[rows].sum()
+            keys = rng.random((b, len(rows)))
+            treated = np.argpartition(keys, k-1, axis=1)[:, :k] if k < len(rows) else np.broadcast_to(np.arange(k), (b, k))
+            sum_treated += y[rows][treated].sum(axis=1)
+        null[start:start+b] = sum_treated/num_treated - (total - sum_treated)/(num_rows - num_treated)
+    return null
+
+def permutation_test(df, treatment_colm_name='advocate_gender', outcome_colm_name='adv_interruption_rate',
+                     num_permutations=10000, within_case=False, seed=0, return_null=False, workers=None):
+    """
+    Per-justice permutation test of theta for a binary treatment (advocate_gender is mapped to male=0, female=1,
+    so theta is theta_gender as in calc_theta_gender; ideology_matches gives theta_ideology)
+
+    Inputs:
+        - df (pd.DataFrame): finalized data frame
+        - within_case (bool): only permute the labels among chunks of the same case
+        - return_null (bool): also return the null distributions
+        - workers (int, optional): number of threads (default: one per CPU)
+
+    Output: pd.DataFrame with columns justice_name, theta, p_value, null_mean, null_std, num_permutations, total_num_chunks
+    (and, if return_null, a dictionary justice name -> null distribution)
+    """
+    justices = sorted(df['justice_name'].unique())
+    # one random stream per justice, so the justices can run in parallel threads (numpy releases the GIL)
+    rngs = dict(zip(justices, [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(justices))]))
+    just2rows = df.groupby('justice_name').indices
+    y_all = df[outcome_colm_name].to_numpy().astype(float)
+    t_all = encode_treatment(df, treatment_colm_name)
+    case_codes = pd.factorize(df['case_id'])[0] if within_case else None
+
+    def one_justice(just):
+        rows = just2rows[just]
+        y, t = y_all[rows], t_all[rows]
+        num_treated = t.sum()
+        if num_treated == 0 or num_treated == len(t):
+            return np.nan, np.nan, np.full(num_permutations, np.nan)
+        theta = y[t==1].mean() - y[t==0].mean()
+        null = permutation_null(y, t, None if case_codes is None else case_codes[rows], num_permutations, rngs[just])
+        # +1: the observed labels are one of the permutations; the tolerance guards against float ties
+        p_value = (1 + np.sum(np.abs(null) >= np.abs(theta) - 1e-12)) / (1 + num_permutations)
+        return theta, p_value, null
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(justices, executor.map(one_justice, justices)))
+
+    out = []
+    nulls = {}
+    for just in justices:
+        theta, p_value, null = results[just]
+        nulls[just] = null
+        out.append({'justice_name': just, 'theta': theta, 'p_value': p_value, 'null_mean': np.mean(null),
+                    'null_std': np.std(null), 'num_permutations': num_permutations, 'total_num_chunks': len(just2rows[just])})
+    out = pd.DataFrame(out)
+    if return_null: return out, nulls
+    return out
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_permutations', type=int, default=10000)
+    parser.add_argument('--within_case', action='store_true', help='only permute labels among chunks of the same case')
+    parser.add_argument('--treatment', default='advocate_gender', help='advocate_gender (theta_gender) or ideology_matches (theta_ideology)')
+    args = parser.parse_args()
+
+    config = load_config()
+    pprint.pprint(config)
+    df = load_final_df(config)
+    df_perm = permutation_test(df, treatment_colm_name=args.treatment, num_permutations=args.num_permutations,
+                               within_case=args.within_case)
+    print(df_perm.to_string())
+
+    if not os.path.exists(config['results_path']): os.makedirs(config['results_path'])
+    fname = os.path.join(config['results_path'], 'permutation_tests.csv')
+    df_perm.to_csv(fname, index=False)
+    print("Saved permutation tests to ->", fname)
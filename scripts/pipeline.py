@@ -0,0 +1,233 @@
+"""
+This file runs the whole pipeline (the steps in the README) for one or more configurations
+
+    python pipeline.py [config.yaml config-backchannels.yaml ...] [--jobs N] [--force] [--dry_run] [--offline]
+
+The stages are declared in pipeline_stages with the stages they depend on, their input files, the config keys
+they read and their outputs:
+
+    genders (advocate_gender.py, shared by all configurations)
+    -> chunks (create_analyze_chunks.py) -> filter (filter.py) -> analysis (analysis.py --part main) -> figures (figures.py, incl. interruptionsPlot.r)
+                                                               -> supplemental (analysis.py --part supplemental)
+                                                               -> fixed_effects (fixed_effects.py)
+                                                               -> permutation_test (permutation_test.py)
+
+Every stage runs as its own process (with INTERRUPTIONS_CONFIG set to its configuration, see utils.load_config).
+A stage is skipped if the content hashes of its inputs (files, directories, the config keys and the upstream outputs)
+and of its outputs are the same as after its last successful run. The stages whose dependencies are done run
+concurrently, e.g. the two configurations, or the analysis and the supplementary analyses of one configuration.
+The state and the log of every stage are kept in data/pipeline/.
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils import load_config
+from advocate_gender import CASEID2GENDERS_PATH
+
+PIPELINE_STATE_PATH = 'data/pipeline/'
+
+# the modules imported by all stages
+COMMON_CODE = ['utils.py']
+
+def pipeline_stages(config_fnames, offline=False):
+    """
+    Output: dictionary stage name -> stage (dictionary with cmd, deps, inputs, config_keys, outputs and config_fname)
+    for the configuration files in config_fnames. The stage names are "<config name>:<stage>", except for genders
+    """
+    configs = {config_fname: load_config(config_fname) for config_fname in config_fnames}
+    offline_args = ['--offline'] if offline else []
+    start = min(config['start_year'] for config in configs.values())
+    end = max(config['end_year'] for config in configs.values())
+    stages = {'genders': dict(cmd=['advocate_gender.py', '--terms', str(start), str(end)] + offline_args, deps=[],
+                              inputs=['advocate_gender.py', 'corpus_cache.py', 'fast_tokenizer.py', 'data/name2gender.json'],
+                              config_keys=['tokenizer', 'corpus_mirror_path'],
+                              outputs=[CASEID2GENDERS_PATH], config_fname=config_fnames[0])}
+
+    for config_fname, config in configs.items():
+        name = os.path.splitext(os.path.basename(config_fname))[0]
+        results_path = config['results_path']
+        mq_inputs = [config['mq_scores_path']] if config.get('mq_scores_path') else []
+        variant = {
+            'chunks': dict(cmd=['create_analyze_chunks.py'] + offline_args, deps=['genders'],
+                           inputs=['create_analyze_chunks.py', 'advocate_gender.py', 'chunk_db.py', 'chunk_records.py', 'corpus_cache.py', 'fast_tokenizer.py', 'name_resolution.py',
+                                   '../raw_data/cases.jsonl', '../raw_data/scdb_docket.csv', '../raw_data/justice-ideology.txt',
+                                   '../raw_data/backchannel.txt', CASEID2GENDERS_PATH] + mq_inputs,
+                           config_keys=['start_year', 'end_year', 'exclude_backchannel', 'timing_features', 'tokenizer', 'adv_experience',
+                                        'resolve_advocate_names', 'chunk_path', 'chunk_format', 'partition_chunks_by_term', 'chunk_db_path', 'prev_utt_path', 'mq_scores_path'],
+                           outputs=[config['chunk_path'], config['prev_utt_path']]),
+            'filter': dict(cmd=['filter.py'], deps=['chunks'],
+                           inputs=['filter.py', 'chunk_records.py', config['chunk_path']] + mq_inputs,
+                           config_keys=['start_year', 'min_num_chunks_per_just', 'include_fem_issue', 'exclude_adv_first_utt', 'final_df_path',
+                                        'mq_scores_path', 'ideology_alignment'],
+                           outputs=[config['final_df_path']]),
+            # results.json fingerprints the chunk files and the whole config (analysis.analysis_fingerprint)
+            'analysis': dict(cmd=['analysis.py', '--part', 'main'], deps=['filter'],
+                             inputs=['analysis.py', 'mediation_estimands.py', 'filter.py', 'bootstrap_store.py', config['chunk_path'], config['final_df_path'],
+                                     '../raw_data/justice2ideologyscores.json'] + mq_inputs,
+                             config_keys=['num_bootstrap_samples', 'bootstrap_cluster', 'bootstrap_store', 'estimates_path', 'results_path',
+                                          'include_fem_issue', 'min_num_chunks_per_just', 'mq_scores_path'],
+                             outputs=[os.path.join(results_path, 'results.json')]),
+            # Table A1 re-reads the chunks (with the cases with "female issues")
+            'supplemental': dict(cmd=['analysis.py', '--part', 'supplemental'], deps=['filter'],
+                                 inputs=['analysis.py', 'mediation_estimands.py', 'filter.py', 'chunk_records.py', config['chunk_path'], config['final_df_path']] + mq_inputs,
+                                 config_keys=['num_bootstrap_samples', 'estimates_path', 'results_path', 'start_year', 'exclude_adv_first_utt',
+                                              'include_fem_issue', 'min_num_chunks_per_just', 'partition_chunks_by_term', 'mq_scores_path', 'ideology_alignment'],
+                                 outputs=[os.path.join(results_path, 'supplemental_results.json')]),
+            # after analysis, so the two do not compute the cached per-justice estimates in estimates_path at the same time
+            'figures': dict(cmd=['figures.py'], deps=['analysis'],
+                            inputs=['figures.py', 'interruptionsPlot.r', config['final_df_path'], os.path.join(results_path, 'results.json')],
+                            config_keys=['estimates_path', 'figs_path'],
+                            outputs=[config['figs_path']]),
+            'fixed_effects': dict(cmd=['fixed_effects.py'], deps=['filter'],
+                                  inputs=['fixed_effects.py', 'mediation_estimands.py', config['final_df_path']],
+                                  config_keys=['results_path'],
+                                  outputs=[os.path.join(results_path, 'fixed_effects.csv')]),
+            'permutation_test': dict(cmd=['permutation_test.py'], deps=['filter'],
+                                     inputs=['permutation_test.py', 'mediation_estimands.py', config['final_df_path']],
+                                     config_keys=['results_path'],
+                                     outputs=[os.path.join(results_path, 'permutation_tests.csv')]),
+        }
+        for stage_name, stage in variant.items():
+            stage['deps'] = [dep if dep == 'genders' else f'{name}:{dep}' for dep in stage['deps']]
+            stage['config_fname'] = config_fname
+            stages[f'{name}:{stage_name}'] = stage
+    return stages
+
+class FileHashes:
+    """
+    sha256 of files and directories, remembered by (size, mtime) in data/pipeline/file_hashes.json
+    so unchanged files (e.g. the chunk files) are not read again on every run
+    """
+    def __init__(self, fname=os.path.join(PIPELINE_STATE_PATH, 'file_hashes.json')):
+        self.fname = fname
+        self.lock = threading.Lock()
+        self.hashes = {}
+        if os.path.exists(fname):
+            with open(fname, 'r') as r: self.hashes = json.load(r)
+
+    def file_hash(self, fname):
+        stat = os.stat(fname)
+        with self.lock:
+            known = self.hashes.get(fname)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        h = hashlib.sha256()
+        with open(fname, 'rb') as r:
+            for block in iter(lambda: r.read(1 << 20), b''): h.update(block)
+        with self.lock:
+            self.hashes[fname] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def paths_hash(self, paths):
+        """
+        One hash over the contents of the files and directories in paths ("missing" for paths that do not exist)
+        """
+        h = hashlib.sha256()
+        for path in paths:
+            h.update(path.encode())
+            if os.path.isdir(path):
+                for root, dirs, files in sorted(os.walk(path)):
+                    dirs.sort()
+                    for fname in sorted(files):
+                        h.update(os.path.relpath(os.path.join(root, fname), path).encode())
+                        h.update(self.file_hash(os.path.join(root, fname)).encode())
+            elif os.path.exists(path):
+                h.update(self.file_hash(path).encode())
+            else:
+                h.update(b'missing')
+        return h.hexdigest()
+
+    def save(self):
+        with self.lock:
+            with open(self.fname + '.tmp', 'w') as w: json.dump(self.hashes, w)
+            os.replace(self.fname + '.tmp', self.fname)
+
+def stage_signature(stage, hashes):
+    config = load_config(stage['config_fname'])
+    extra = {'cmd': stage['cmd'], 'config': {key: config.get(key) for key in stage['config_keys']}}
+    return hashlib.sha256((hashes.paths_hash(COMMON_CODE + stage['inputs']) + json.dumps(extra, sort_keys=True)).encode()).hexdigest()
+
+def stage_state_fname(stage_name):
+    return os.path.join(PIPELINE_STATE_PATH, stage_name.replace(':', '.') + '.json')
+
+def is_up_to_date(stage_name, stage, signature, hashes):
+    fname = stage_state_fname(stage_name)
+    if not os.path.exists(fname): return False
+    with open(fname, 'r') as r: state = json.load(r)
+    return state['signature'] == signature and all(os.path.exists(out) for out in stage['outputs']) \
+        and state['outputs'] == hashes.paths_hash(stage['outputs'])
+
+def run_stage(stage_name, stage, hashes, force=False, dry_run=False):
+    """
+    Runs one stage (unless it is up to date) and records its signature and outputs
+
+    Output: "skipped", "ran" (or "would run" if dry_run) or "failed"
+    """
+    signature = stage_signature(stage, hashes)
+    if not force and is_up_to_date(stage_name, stage, signature, hashes):
+        return 'skipped'
+    if dry_run:
+        return 'would run'
+    log_fname = os.path.join(PIPELINE_STATE_PATH, stage_name.replace(':', '.') + '.log')
+    print(f"[{stage_name}] running {' '.join(stage['cmd'])} (log: {log_fname})")
+    env = dict(os.environ, INTERRUPTIONS_CONFIG=stage['config_fname'])
+    with open(log_fname, 'w') as log:
+        returncode = subprocess.run([sys.executable] + stage['cmd'], env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    if returncode != 0:
+        return 'failed'
+    with open(stage_state_fname(stage_name), 'w') as w:
+        json.dump({'signature': signature, 'outputs': hashes.paths_hash(stage['outputs'])}, w)
+    return 'ran'
+
+def run_pipeline(config_fnames, jobs=None, force=False, dry_run=False, offline=False):
+    """
+    Runs the stages of pipeline_stages, each as soon as its dependencies are done, with up to jobs stages at a time
+
+    Output: dictionary stage name -> "skipped", "ran", "would run", "failed" or "not run" (a dependency failed)
+    """
+    if not os.path.exists(PIPELINE_STATE_PATH): os.makedirs(PIPELINE_STATE_PATH)
+    stages = pipeline_stages(config_fnames, offline=offline)
+    hashes = FileHashes()
+    status = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        while len(status) < len(stages):
+            for stage_name, stage in stages.items():
+                if stage_name in status or stage_name in running.values(): continue
+                if any(status.get(dep) in ['failed', 'not run'] for dep in stage['deps']):
+                    status[stage_name] = 'not run'
+                elif dry_run and all(dep in status for dep in stage['deps']) and 'would run' in [status[dep] for dep in stage['deps']]:
+                    # its inputs would change
+                    status[stage_name] = 'would run'
+                elif all(status.get(dep) in ['skipped', 'ran'] for dep in stage['deps']):
+                    running[executor.submit(run_stage, stage_name, stage, hashes, force, dry_run)] = stage_name
+            if len(running) == 0: continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage_name = running.pop(future)
+                status[stage_name] = future.result()
+                print(f"[{stage_name}] {status[stage_name]}")
+    hashes.save()
+    return status
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('configs', nargs='*', default=['config.yaml', 'config-backchannels.yaml'])
+    parser.add_argument('--jobs', type=int, default=None, help='number of stages to run at the same time (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true', help='run all stages, even if they are up to date')
+    parser.add_argument('--dry_run', action='store_true', help='only print which stages would run')
+    parser.add_argument('--offline', action='store_true', help='only use local ConvoKit corpora and NLTK punkt')
+    args = parser.parse_args()
+
+    status = run_pipeline(args.configs, jobs=args.jobs, force=args.force, dry_run=args.dry_run, offline=args.offline)
+    for stage_name, stage_status in status.items():
+        print(f"{stage_name:40s} {stage_status}")
+    if any(stage_status in ['failed', 'not run'] for stage_status in status.values()):
+        print("See the logs in", PIPELINE_STATE_PATH)
+        sys.exit(1)
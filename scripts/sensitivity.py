@@ -0,0 +1,78 @@
+"""
+This file runs the threshold sensitivity sweep.
+
+It reads the candidate chunks written by `python create_analyze_chunks.py --sweep`
+(the chunks for every min_num_utts in the grid, before the min_tok_adv threshold is applied) and,
+for every point on the grid
+
+    sweep_min_num_utts x sweep_min_tok_adv x sweep_min_num_chunks_per_just   (set in config.yaml)
+
+re-applies the thresholds and the justice filter and reports the per-justice
+E[Y], theta_gender, theta_ideology and number of chunks. No re-chunking is needed.
+"""
+import itertools
+import pprint
+import pandas as pd
+
+from utils import *
+from filter import join_chunk_features, filter_justices
+
+def load_candidates_df(config):
+    """
+    Loads the candidate chunks (after chunking with create_analyze_chunks.py --sweep)
+    """
+    return load_chunks_df(dict(config, chunk_path=config['candidate_path']))
+
+def threshold_grid(config):
+    """
+    Returns a list of (min_num_utts, min_tok_adv, min_num_chunks_per_just) tuples
+    """
+    return list(itertools.product(config['sweep_min_num_utts'],
+                                  config['sweep_min_tok_adv'],
+                                  config['sweep_min_num_chunks_per_just']))
+
+def run_sensitivity_sweep(df_candidates, config):
+    """
+    Evaluates every grid point in threshold_grid(config) on the candidate chunks
+
+    Output: pd.DataFrame with one row per (grid point, justice) and columns
+        min_num_utts, min_tok_adv, min_num_chunks_per_just, justice_name,
+        E[Y], theta_gender, theta_ideology, num_chunks
+    """
+    missing = set(config['sweep_min_num_utts']) - set(df_candidates['sweep_min_num_utts'].unique())
+    assert len(missing) == 0, f"no candidate chunks for min_num_utts={missing}, re-run create_analyze_chunks.py --sweep"
+
+    # joins only need to happen once for all grid points
+    df_joined = join_chunk_features(df_candidates.copy(), verbose=False, config=config)
+
+    out = []
+    for min_num_utts, min_tok_adv, min_num_chunks_per_just in threshold_grid(config):
+        df_thresh = df_joined[(df_joined['sweep_min_num_utts'] == min_num_utts) & (df_joined['num_toks_adv'] >= min_tok_adv)]
+        df_grid = filter_justices(df_thresh, dict(config, min_num_chunks_per_just=min_num_chunks_per_just), verbose=False)
+        if set(df_grid['advocate_gender']) != {'F', 'M'} or set(df_grid['ideology_matches']) != {0, 1}:
+            print(f"Skipping grid point min_num_utts={min_num_utts}, min_tok_adv={min_tok_adv}, min_num_chunks_per_just={min_num_chunks_per_just}: not enough chunks")
+            continue
+
+        ey_results = calc_ey(df_grid, join_back=False)
+        gender_results = calc_theta_gender(df_grid, join_back=False).rename(columns={'theta': 'theta_gender'})
+        ideology_results = calc_theta_ideology(df_grid, join_back=False).rename(columns={'theta': 'theta_ideology'})
+
+        df_point = ey_results.merge(gender_results[['justice_name', 'theta_gender']], on='justice_name', how='left')
+        df_point = df_point.merge(ideology_results[['justice_name', 'theta_ideology']], on='justice_name', how='left')
+        df_point.insert(0, 'min_num_chunks_per_just', min_num_chunks_per_just)
+        df_point.insert(0, 'min_tok_adv', min_tok_adv)
+        df_point.insert(0, 'min_num_utts', min_num_utts)
+        out.append(df_point)
+
+    out = pd.concat(out, ignore_index=True)
+    return out[['min_num_utts', 'min_tok_adv', 'min_num_chunks_per_just', 'justice_name',
+                'E[Y]', 'theta_gender', 'theta_ideology', 'num_chunks']]
+
+if __name__ == '__main__':
+    config = load_config()
+    pprint.pprint(config)
+    df_candidates = load_candidates_df(config)
+    df_sweep = run_sensitivity_sweep(df_candidates, config)
+    df_sweep.to_csv(config['sweep_path'], index=False)
+    print("Number of grid points =", len(threshold_grid(config)))
+    print("Saved sensitivity sweep to ->", config['sweep_path'])
@@ -0,0 +1,156 @@
+"""
+This file runs a local analysis service that loads the final dataframe (and the justice metadata) once and then answers
+estimator requests over HTTP on localhost, so notebooks and scripts do not reload everything for every question
+
+    python service.py [--port PORT]
+
+(the port defaults to config['service_port']). Requests are answered by utils.service_request, e.g.
+
+    service_request('theta_gender', where={'justice_gender': 'F'}, years=[2007, 2020])
+    service_request('bootstrap_std', num_bootstraps=1000, cluster='case_id')
+    service_request('mediation', years=[2007, 2020], mediators=['ideology_matches'])
+
+Endpoints:
+    - GET /health, GET /info (number of chunks, justices, years and columns of the loaded dataframe)
+    - POST /estimate with a json body: estimator (see ESTIMATORS), where (column -> value or list of values),
+      years ([start, end), on case_year) and the estimator's parameters
+    - POST /reload: reloads the final dataframe (e.g., after re-running filter.py)
+"""
+import os
+import json
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+
+from utils import *
+from mediation_estimands import add_disfluency_tertiles, get_estimands_multi
+
+def load_service_state(config):
+    """
+    The resources the estimators need, loaded once
+    """
+    return {'config': config, 'df': load_final_df(config), 'justice_gender_map': load_justice_gender(),
+            'lock': threading.Lock()}
+
+def select_chunks(df, where=None, years=None):
+    """
+    Output: the chunks of df with column == value (or value in a list) for every column, value in where
+    and years[0] <= case_year < years[1]
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for col, value in (where or {}).items():
+        if col not in df.columns: raise ValueError(f"unknown column {col}")
+        mask &= df[col].isin(value if isinstance(value, list) else [value]).to_numpy()
+    if years is not None:
+        mask &= ((df['case_year'] >= years[0]) & (df['case_year'] < years[1])).to_numpy()
+    return df[mask]
+
+def estimate_bootstrap_std(df, justice_gender_map, num_bootstraps=1000, cluster=None, seed=0):
+    """
+    Bootstrap standard deviations of E[Y], theta_gender and theta_ideology per justice (see utils.bootstrap_replicates)
+    """
+    replicates = bootstrap_replicates(df, num_bootstraps, cluster=cluster, rng=np.random.default_rng(seed))
+    return pd.DataFrame({'justice_name': replicates['justices'], 'ey_std': replicate_std(replicates['ey']),
+                         'theta_gender_std': replicate_std(replicates['gender']),
+                         'theta_ideology_std': replicate_std(replicates['ideology'])})
+
+def estimate_mediation(df, justice_gender_map, mediators=['adv_disfl_rate_tertiles', 'ideology_matches', 'adv_experience_bin'],
+                       treatments=['advocate_gender'], num_bootstraps=1000, seed=0):
+    """
+    NDE and NIE per justice and averaged over justices (see mediation_estimands.get_estimands_multi);
+    the disfluency tertiles are computed on the selected chunks, as in analysis.py
+    """
+    return get_estimands_multi(add_disfluency_tertiles(df), mediators, treatments, 'adv_interruption_rate',
+                               num_bootstraps, justice_gender_map, seed=seed)
+
+# estimator name -> function of (selected chunks, justice_gender_map, **parameters)
+ESTIMATORS = {'ey': lambda df, justice_gender_map: calc_ey(df),
+              'theta_gender': lambda df, justice_gender_map: calc_theta_gender(df),
+              'theta_ideology': lambda df, justice_gender_map: calc_theta_ideology(df),
+              'bootstrap_std': estimate_bootstrap_std,
+              'mediation': estimate_mediation}
+
+def to_records(df):
+    # json has no NaN, missing values are sent as null
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+def answer(state, request):
+    """
+    Output: the response (a json-serializable dictionary) to an /estimate request
+    """
+    request = dict(request)
+    estimator = request.pop('estimator', None)
+    if estimator not in ESTIMATORS: raise ValueError(f"unknown estimator {estimator}, one of {sorted(ESTIMATORS)}")
+    df = select_chunks(state['df'], request.pop('where', None), request.pop('years', None))
+    if len(df) == 0: raise ValueError("no chunks selected")
+    result = ESTIMATORS[estimator](df.copy(), state['justice_gender_map'], **request)
+    return {'estimator': estimator, 'num_chunks': len(df), 'result': to_records(result)}
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj, default=lambda o: o.item() if hasattr(o, 'item') else str(o)).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/info':
+            df = self.state['df']
+            self.send_json(200, {'num_chunks': len(df), 'justices': sorted(df['justice_name'].unique()),
+                                 'years': [int(df['case_year'].min()), int(df['case_year'].max())],
+                                 'columns': list(df.columns), 'estimators': sorted(ESTIMATORS),
+                                 'final_df_path': self.state['config']['final_df_path']})
+        else:
+            self.send_json(404, {'error': f'unknown path {self.path}'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/estimate':
+                self.send_json(200, answer(self.state, request))
+            elif self.path == '/reload':
+                with self.state['lock']:
+                    self.state['df'] = load_final_df(self.state['config'])
+                self.send_json(200, {'num_chunks': len(self.state['df'])})
+            else:
+                self.send_json(404, {'error': f'unknown path {self.path}'})
+        except (ValueError, TypeError, KeyError) as e:
+            self.send_json(400, {'error': f'{type(e).__name__}: {e}'})
+        except Exception as e:
+            # any other estimator failure (e.g. LinAlgError, ZeroDivisionError) still gets a json response
+            self.send_json(500, {'error': f'{type(e).__name__}: {e}'})
+
+    def log_message(self, format, *args):
+        print(self.address_string(), format % args)
+
+def serve(config, port=None):
+    """
+    Loads the service state and serves requests on 127.0.0.1:port (one thread per request) until interrupted
+    """
+    ServiceHandler.state = load_service_state(config)
+    port = port or config.get('service_port', 8765)
+    server = ThreadingHTTPServer(('127.0.0.1', port), ServiceHandler)
+    print(f"Serving {len(ServiceHandler.state['df'])} chunks on http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=None, help='default: service_port in config.yaml')
+    args = parser.parse_args()
+
+    config = load_config()
+    serve(config, port=args.port)
@@ -6,10 +6,11 @@ import datetime
 import numpy as np
 import yaml 
 import glob
-import pandas as pd 
 import math
 import re
-from tqdm import tqdm 
+import os
+import hashlib
+import bisect
 
 def parse_first_name(name):
     ss = name.split(" ")
@@ -60,9 +61,10 @@ def load_justice2start_date():
     "Douglas": "1939-04-17",
     "Frankfurter": "1939-01-30",
     "Black": "1937-08-19",
+    "Burton": "1945-10-01",
     "Clark": "1949-09-18", 
     "Minton": "1949-10-04", 
-    "Warren": "1954-03-01",
+    "Warren": "1953-10-05",
     "Harlan": "1955-03-16",
     "Brennan": "1956-10-16", 
     "Whittaker": "1957-03-25", 
@@ -89,7 +91,8 @@ def load_justice2start_date():
     "Kagan": "2010-09-07", 
     "Gorsuch": "2017-04-10", 
     "Kavanaugh": "2018-10-06", 
-    "Barrett": "2020-10-27"
+    "Barrett": "2020-10-27",
+    "Jackson": "2022-06-30"
     }
     return justice2start_date
 
@@ -98,6 +101,7 @@ def load_chiefjustice2start_date():
     manually coded via: https://en.wikipedia.org/wiki/List_of_justices_of_the_Supreme_Court_of_the_United_States
     """
     chiefjustice2start_date = {
+    "Warren": "1953-10-05", 
     "Burger": "1969-06-09", 
     "Rehnquist": "1986-09-17", 
     "Roberts": "2005-09-29"
@@ -123,7 +127,7 @@ def is_chiefjustice_speaking(case_id, caseid2stuff, utt):
     #make justice last name
     last_name = get_justice_last_name(utt)
 
-    if (last_name not in ["Roberts","Rehnquist","Burger"]):
+    if (last_name not in ["Roberts","Rehnquist","Burger","Warren"]):
         return False 
     
     if chiefjustice2start_date.get(last_name) == None:
@@ -137,7 +141,8 @@ def is_chiefjustice_speaking(case_id, caseid2stuff, utt):
     #decision date
     ddate = caseid2stuff[case_id]['decided_date']
     if ddate == None: return False
-    decided_date = datetime.datetime.strptime(ddate, '%b %d, %Y').strftime('%Y-%d-%m')
+    decided_date = caseid2stuff[case_id].get('decided_key') #pre-parsed in the compact case file
+    if decided_date is None: decided_date = datetime.datetime.strptime(ddate, '%b %d, %Y').strftime('%Y-%d-%m')
    
     if decided_date < chiefjustice_start_date:
         #ipdb.set_trace()
@@ -145,6 +150,18 @@ def is_chiefjustice_speaking(case_id, caseid2stuff, utt):
     else: 
         return True
 
+def justice_last_name(name): 
+    """
+    Returns the last name (cased) of a justice name, without the suffixes " II" and " Jr." 
+    (with or without the comma, the chunks' justice_name has no commas)
+    """
+    name = name.strip()
+    name = name.replace(' II', ' ')
+    name = name.replace(', Jr.', ' ')
+    name = name.replace(' Jr.', ' ')
+    last_name = name.strip().split(' ')[-1]
+    return last_name
+
 def get_justice_last_name(utt): 
     """
     Returns the last name of the Justice (cased)
@@ -152,11 +169,7 @@ def get_justice_last_name(utt):
     Errors we were getting: 
         Removes 'Jr.' 
     """
-    name = utt.speaker.meta['name'].strip()
-    name = name.replace(' II', ' ')
-    name = name.replace(', Jr.', ' ')
-    last_name = name.strip().split(' ')[-1]
-    return last_name
+    return justice_last_name(utt.speaker.meta['name'])
 
 def get_corrected_speaker_type(case_id, caseid2stuff, utt):
     """
@@ -191,7 +204,8 @@ def get_corrected_speaker_type(case_id, caseid2stuff, utt):
     #decision date
     ddate = caseid2stuff[case_id]['decided_date']
     if ddate == None: return speaker_type
-    decided_date = datetime.datetime.strptime(ddate, '%b %d, %Y').strftime('%Y-%d-%m')
+    decided_date = caseid2stuff[case_id].get('decided_key') #pre-parsed in the compact case file
+    if decided_date is None: decided_date = datetime.datetime.strptime(ddate, '%b %d, %Y').strftime('%Y-%d-%m')
 
     if decided_date < justice_start_date:
         #ipdb.set_trace()
@@ -210,23 +224,115 @@ def classify_interruption(utt_text, interruption_symbols=['--', '...']):
         if last == inter_symbol: return True 
     return False 
 
-def load_case_file(): 
+_caseid2stuff = None
+
+def convert_case_file(fname='../raw_data/cases.jsonl', fout='data/cases_compact.json'):
     """
-    wget https://zissou.infosci.cornell.edu/convokit/datasets/supreme-corpus/cases.jsonl
+    One-time conversion of cases.jsonl into a compact store with only the fields the pipeline uses:
+        case_id -> {"decided_date", "decided_key", "scdb_docket_id", "win_side", "advocates": {name: {"side"}}}
+    where "decided_key" is the decision date pre-parsed into the string compared against the justice start dates
+    (see get_corrected_speaker_type). The size and modification time of cases.jsonl are saved with it.
     """
     caseid2stuff = {}
-    for line in open('../raw_data/cases.jsonl', 'r'): 
+    for line in open(fname, 'r'):
         dd = json.loads(line)
-        case_id = dd['id']
-        caseid2stuff[case_id] = dd 
-    return caseid2stuff 
+        ddate = dd.get('decided_date')
+        caseid2stuff[dd['id']] = {
+            'decided_date': ddate,
+            'decided_key': None if ddate is None else datetime.datetime.strptime(ddate, '%b %d, %Y').strftime('%Y-%d-%m'),
+            'scdb_docket_id': dd.get('scdb_docket_id'),
+            'win_side': dd.get('win_side'),
+            'advocates': {name: {'side': adv.get('side')} for name, adv in (dd.get('advocates') or {}).items()}
+        }
+    stat = os.stat(fname)
+    if not os.path.exists(os.path.dirname(fout)): os.makedirs(os.path.dirname(fout))
+    # written to a temporary file first, as several pipeline stages may convert the case file at the same time
+    with open(f'{fout}.{os.getpid()}.tmp', 'w') as w:
+        json.dump({'source': [stat.st_size, stat.st_mtime], 'cases': caseid2stuff}, w)
+    os.replace(f'{fout}.{os.getpid()}.tmp', fout)
+    print("Saved compact case file to ->", fout)
+    return caseid2stuff
+
+def load_case_file():
+    """
+    wget https://zissou.infosci.cornell.edu/convokit/datasets/supreme-corpus/cases.jsonl
+
+    Loaded from the compact store in data/cases_compact.json (see convert_case_file), which is
+    (re)built the first time and whenever cases.jsonl changes. The result is memoized, so do not modify it.
+    """
+    global _caseid2stuff
+    if _caseid2stuff is not None: return _caseid2stuff
+    fname, fout = '../raw_data/cases.jsonl', 'data/cases_compact.json'
+    stat = os.stat(fname)
+    if os.path.exists(fout):
+        with open(fout, 'r') as r:
+            store = json.load(r)
+        if store['source'] == [stat.st_size, stat.st_mtime]:
+            _caseid2stuff = store['cases']
+    if _caseid2stuff is None:
+        _caseid2stuff = convert_case_file(fname, fout)
+    return _caseid2stuff
 
 def load_justice_ideologies():
     #Doug created the dictionary loaded from: data/justice-ideology.txt manually
     with open('../raw_data/justice-ideology.txt') as f:
         data = f.read()
         return json.loads(data)
-        
+
+_mq_scores = {}
+_mq_unmatched = set()
+
+# MQ justice names whose last name is not the part after the initials
+MQ_NAME2LAST_NAME = {"SDOConnor": "O'Connor"}
+
+def mq_last_name(mq_name):
+    """
+    The last name (as in justice-ideology.txt) of a justice name in the Martin-Quinn tables, e.g. SAAlito -> Alito, JMHarlan2 -> Harlan
+    """
+    if mq_name in MQ_NAME2LAST_NAME: return MQ_NAME2LAST_NAME[mq_name]
+    return re.sub(r'^[A-Z]+(?=[A-Z][a-z])', '', mq_name.rstrip('0123456789'))
+
+def load_mq_scores(fname, score_column='post_med'):
+    """
+    Loads the per-term Martin-Quinn scores, the justices table of https://mqscores.wustl.edu
+    (one row per justice and term, with the columns term, justiceName, post_mn, post_med, ...)
+
+    Output: pd.Series of the scores (negative: liberal, positive: conservative) indexed by (justice last name, term); memoized
+    """
+    import pandas as pd
+    if (fname, score_column) not in _mq_scores:
+        mq = pd.read_csv(fname)
+        mq['last_name'] = mq['justiceName'].map({name: mq_last_name(name) for name in mq['justiceName'].unique()})
+        _mq_scores[(fname, score_column)] = mq.set_index(['last_name', 'term'])[score_column].astype(float).sort_index()
+    return _mq_scores[(fname, score_column)]
+
+def join_mq_scores(mq, justice_names, terms):
+    """
+    Vectorized (justice, term) join with the Martin-Quinn scores of load_mq_scores
+
+    Inputs: justice_names and terms (one entry per chunk)
+    Output: np.array of the justices' scores in those terms, NaN where the table has no score
+    (the (justice, term) pairs without a score are printed, once per process)
+    """
+    import pandas as pd
+    justice_names = pd.Series(justice_names)
+    last_names = justice_names.map({name: justice_last_name(name) for name in justice_names.unique()})
+    terms = np.asarray(terms, dtype=mq.index.levels[1].dtype)
+    idx = mq.index.get_indexer(pd.MultiIndex.from_arrays([last_names.to_numpy(), terms]))
+    if (idx < 0).any():
+        unmatched = set(zip(justice_names[idx < 0], terms[idx < 0])) - _mq_unmatched
+        if len(unmatched) > 0:
+            _mq_unmatched.update(unmatched)
+            print("No Martin-Quinn score (NaN; the per-term ideology falls back to the career label) for", sorted(unmatched))
+    return np.where(idx >= 0, mq.to_numpy()[idx], np.nan)
+
+def term_ideology_labels(mq_scores, career_labels):
+    """
+    "liberal" or "conservative" from the sign of the per-term scores (join_mq_scores),
+    the career label (justice-ideology.txt) where there is no score
+    """
+    return np.where(mq_scores < 0, 'liberal', np.where(mq_scores > 0, 'conservative', np.asarray(career_labels, dtype=object))).astype(object)
+
 def load_docket_info():
     import pandas as pd
     return pd.read_csv('../raw_data/scdb_docket.csv',encoding='cp1252')
@@ -252,8 +358,15 @@ def is_female_issue(caseid2stuff,df,caseid,advocatename):
 
     return 0 
 
-def get_advocate_ideology(caseid2stuff,df,caseid,advocatename):
+def get_advocate_ideology(caseid2stuff,df,caseid,advocatename,resolve_names=False):
+    """
+    resolve_names == True matches advocatename to the case's advocates up to punctuation, suffixes 
+    and small spelling differences (name_resolution.py) instead of exactly 
+    """
     import math
+    if resolve_names:
+        from name_resolution import resolve_advocate
+        advocatename = resolve_advocate(caseid2stuff, caseid, advocatename) or advocatename
     docketid = caseid2stuff[caseid]["scdb_docket_id"]
     if(len(df.loc[df['docketId'] == docketid]["decisionDirection"]) ==0 or math.isnan(df.loc[df['docketId'] == docketid]["decisionDirection"])):
         decisionDirection = "unknown"
@@ -280,12 +393,173 @@ def get_advocate_ideology(caseid2stuff,df,caseid,advocatename):
     else:
         return "liberal"
 
-def load_config(): 
-    with open('config.yaml', 'r') as file:
+def build_advocate_timeline(caseid2stuff, df):
+    """
+    Inputs: caseid2stuff (load_case_file) and df (load_docket_info)
+    Output: dictionary with
+        - "case_dates": case_id -> argument date ("%Y-%m-%d")
+        - "advocates": advocate name -> [[argument date, case_id], ...] sorted by argument date
+    over every case in cases.jsonl (all terms, including the ones before start_year).
+
+    The argument date is the SCDB dateArgument of the docket, or the decision date if there is none.
+    Advocate names have their commas removed to match the speaker names in analyzechunks.
+    """
+    docket2date = {}
+    for docketid, date_arg in zip(df['docketId'], df['dateArgument']):
+        if isinstance(date_arg, str):
+            docket2date[docketid] = datetime.datetime.strptime(date_arg, "%m/%d/%Y").strftime("%Y-%m-%d")
+
+    case_dates = {}
+    advocates = {}
+    for case_id, stuff in caseid2stuff.items():
+        date_arg = docket2date.get(stuff.get("scdb_docket_id"))
+        if date_arg is None and stuff.get("decided_date") is not None:
+            date_arg = datetime.datetime.strptime(stuff["decided_date"], '%b %d, %Y').strftime("%Y-%m-%d")
+        if date_arg is None: continue
+        case_dates[case_id] = date_arg
+        for advocatename in (stuff.get("advocates") or {}):
+            advocates.setdefault(advocatename.replace(',', ''), []).append([date_arg, case_id])
+    for appearances in advocates.values():
+        appearances.sort()
+    return {"case_dates": case_dates, "advocates": advocates}
+
+def load_advocate_timeline(config, caseid2stuff=None):
+    """
+    Returns the advocate timeline index (see build_advocate_timeline), cached in config['advocate_timeline_path']
+    and only rebuilt when cases.jsonl or scdb_docket.csv change.
+
+    On top of the saved json, it adds
+        - "position": (advocate name, case_id) -> number of earlier cases the advocate argued (O(1) lookups)
+        - "dates": advocate name -> sorted list of argument dates (for the bisect in advocate_experience)
+    """
+    fname = config.get('advocate_timeline_path', 'data/advocate_timeline.json')
+    fingerprint = content_fingerprint(['../raw_data/cases.jsonl', '../raw_data/scdb_docket.csv'])
+    timeline = None
+    if os.path.exists(fname):
+        with open(fname, 'r') as r:
+            timeline = json.load(r)
+        if timeline.get("fingerprint") != fingerprint: timeline = None
+    if timeline is None:
+        if caseid2stuff is None: caseid2stuff = load_case_file()
+        timeline = build_advocate_timeline(caseid2stuff, load_docket_info())
+        timeline["fingerprint"] = fingerprint
+        if os.path.dirname(fname) and not os.path.exists(os.path.dirname(fname)): os.makedirs(os.path.dirname(fname))
+        with open(f'{fname}.{os.getpid()}.tmp', 'w') as w:
+            json.dump(timeline, w)
+        os.replace(f'{fname}.{os.getpid()}.tmp', fname)
+        print("Saved advocate timeline to ->", fname)
+
+    timeline["position"] = {}
+    timeline["dates"] = {}
+    for advocatename, appearances in timeline["advocates"].items():
+        dates = [date_arg for date_arg, _ in appearances]
+        timeline["dates"][advocatename] = dates
+        for date_arg, case_id in appearances:
+            # cases argued on the same day do not count as experience for each other
+            timeline["position"][(advocatename, case_id)] = bisect.bisect_left(dates, date_arg)
+    return timeline
+
+def advocate_experience(timeline, advocatename, caseid, justicelastname=None):
+    """
+    Experience features of an advocate at the time of case caseid, from the advocate timeline index:
+        - adv_experience_int: number of cases the advocate argued before this one
+        - adv_experience_bin: 1 if adv_experience_int > 0
+        - adv_days_since_last_arg: days since the advocate's previous argument (-1 if there is none)
+        - adv_experience_justice_int: number of those earlier cases argued after the justice joined the Court,
+          i.e. in front of the same justice (-1 if the justice's start date is unknown)
+    Missing values are -1 rather than None so that the rows survive the dropna in filter.py
+    """
+    out = dict(adv_experience_int=0, adv_experience_bin=0, adv_days_since_last_arg=-1, adv_experience_justice_int=-1)
+    date_arg = timeline["case_dates"].get(caseid)
+    if date_arg is None: return out
+    dates = timeline["dates"].get(advocatename, [])
+    num_prior = timeline["position"].get((advocatename, caseid))
+    if num_prior is None: num_prior = bisect.bisect_left(dates, date_arg)
+    out["adv_experience_int"] = num_prior
+    out["adv_experience_bin"] = int(num_prior > 0)
+    if num_prior > 0:
+        out["adv_days_since_last_arg"] = (datetime.date.fromisoformat(date_arg) - datetime.date.fromisoformat(dates[num_prior-1])).days
+    justice_start_date = load_justice2start_date().get(justicelastname)
+    if justice_start_date is not None:
+        out["adv_experience_justice_int"] = num_prior - bisect.bisect_left(dates, justice_start_date, 0, num_prior)
+    return out
+
+def load_config(fname=None): 
+    """
+    Loads config.yaml, or fname, or the config file in the INTERRUPTIONS_CONFIG environment variable 
+    (e.g. INTERRUPTIONS_CONFIG=config-backchannels.yaml python filter.py, as pipeline.py runs the stages) 
+    """
+    if fname is None: fname = os.environ.get('INTERRUPTIONS_CONFIG', 'config.yaml')
+    with open(fname, 'r') as file:
         config = yaml.safe_load(file)
     #print("Loading config.yaml")
     assert type(config) == dict 
     return config 
+
+def ensure_punkt(offline=None): 
+    """
+    Checks that NLTK's punkt models are available locally (no network access). 
+    Only downloads them if they are missing and offline == False 
+    (offline == None: the offline setting of set_tokenizer, e.g. for the check on the first tokenize) 
+    """
+    import nltk
+    if offline is None: offline = _offline
+    try: 
+        nltk.data.find('tokenizers/punkt')
+    except LookupError: 
+        if offline: 
+            raise LookupError("NLTK punkt not found locally; run nltk.download('punkt') once with network access or set NLTK_DATA")
+        nltk.download('punkt')
+
+_tokenizer = "nltk"
+_word_tokenize = None 
+_offline = False 
+
+def set_tokenizer(name, offline=False): 
+    """
+    Selects the tokenizer used by tokenize: "nltk" (nltk.word_tokenize, as in our paper) 
+    or "fast" (fast_tokenizer.fast_word_tokenize, same counts and flags) 
+
+    offline == True: punkt is never downloaded when it is checked on first use (see ensure_punkt) 
+    """
+    global _tokenizer, _word_tokenize, _offline
+    assert name in ["nltk", "fast"], f"unknown tokenizer {name}"
+    _tokenizer = name
+    _word_tokenize = None 
+    _offline = offline 
+
+def tokenize(text): 
+    """
+    Tokenizes with the tokenizer selected by set_tokenizer, imported (and punkt checked) on first use 
+    """
+    global _word_tokenize
+    if _word_tokenize is None: 
+        ensure_punkt()
+        if _tokenizer == "fast": 
+            from fast_tokenizer import fast_word_tokenize
+            _word_tokenize = fast_word_tokenize
+        else: 
+            from nltk import word_tokenize
+            _word_tokenize = word_tokenize
+    return _word_tokenize(text)
+
+def load_corpus(name, offline=False): 
+    """
+    Loads a ConvoKit corpus, e.g. "supreme-2019" 
+
+    If offline == True, only uses a previously downloaded copy (ConvoKit's use_local) 
+    and never contacts the network 
+    """
+    from convokit import Corpus, download
+    if not offline: 
+        return Corpus(filename=download(name))
+    try: 
+        fname = download(name, use_local=True)
+    except Exception as e: 
+        raise FileNotFoundError(f"{name} not found in the local ConvoKit downloads ({e}); run once without offline to download it")
+    if fname is None or not os.path.exists(fname): 
+        raise FileNotFoundError(f"{name} not found in the local ConvoKit downloads; run once without offline to download it")
+    return Corpus(filename=fname)
     
 def load_justice_gender(): 
     """
@@ -316,27 +590,66 @@ def load_justice_gender():
                  'Lewis F. Powell Jr.': 'M',
                  'Potter Stewart': 'M', 
                  'William J. Brennan Jr.': 'M',
-                 'William O. Douglas': 'M'}
+                 'William O. Douglas': 'M',
+                 # the justices before 1982 and after 2020 (config-full-history.yaml)
+                 'Stanley F. Reed': 'M',
+                 'Felix Frankfurter': 'M',
+                 'Harold H. Burton': 'M',
+                 'Tom C. Clark': 'M',
+                 'Sherman Minton': 'M',
+                 'John M. Harlan': 'M',
+                 'John M. Harlan II': 'M',
+                 'Arthur J. Goldberg': 'M',
+                 'Abe Fortas': 'M',
+                 'Amy Coney Barrett': 'F',
+                 'Ketanji Brown Jackson': 'F'}
     return justice2gender
 
-def load_chunks_df(config): 
+def chunk_file_path(config, case_id, key='chunk_path'): 
+    """
+    The chunk file of case_id in config[key] (chunk_path or candidate_path). 
+    With config['partition_chunks_by_term'] == True the files are in one subdirectory per term, e.g. chunk_path/1987/ 
+    """
+    from chunk_records import CHUNK_FILE_EXTS
+    ext = CHUNK_FILE_EXTS[config.get('chunk_format', 'jsonl')]
+    if config.get('partition_chunks_by_term', False): 
+        return os.path.join(config[key], case_id.split('_')[0], case_id + ext)
+    return config[key] + case_id + ext
+
+def list_chunk_files(config, key='chunk_path'): 
+    """
+    All chunk files in config[key] (see chunk_file_path) 
+    """
+    if config.get('partition_chunks_by_term', False): 
+        return glob.glob(os.path.join(config[key], '*', '*.*'))
+    return glob.glob(config[key]+"*")
+
+def load_chunks_df(config, fnames=None): 
     """
     Loads the data frame with the chunks 
     (after chunking with create_analyze_chunks)
+
+    fnames (list, optional): only these chunk files, e.g. one term (see full_history.py); default: all of them 
+
+    The files are read into typed column buffers (chunk_records.ChunkColumns) and the filters are applied on the columns 
     """
+    import pandas as pd
+    from chunk_records import ChunkColumns, read_chunk_file
+    chunks = ChunkColumns()
+    for fname in (list_chunk_files(config) if fnames is None else fnames): 
+        chunks.extend(read_chunk_file(fname))
+    columns = chunks.arrays()
+
     num_exclude_adv_first_utt = 0 
-    df = []
-    for fname in glob.glob(config['chunk_path']+"*"): 
-        for line in open(fname, 'r'): 
-            dd = json.loads(line)
-            if dd['case_year'] < config['start_year']: 
-                continue 
-            if config['exclude_adv_first_utt']==True and dd['utt_id_first'].split('_')[-1] in ['000', '001']: 
-                num_exclude_adv_first_utt += 1
-            else:
-                df.append(dd)
-
-    df = pd.DataFrame(df) 
+    if len(chunks) > 0: 
+        keep = columns['case_year'] >= config['start_year']
+        if config['exclude_adv_first_utt']==True: 
+            first_utt = pd.Series(columns['utt_id_first']).str.split('_').str[-1].isin(['000', '001']).to_numpy()
+            num_exclude_adv_first_utt = int((keep & first_utt).sum())
+            keep &= ~first_utt
+        columns = {name: col[keep] for name, col in columns.items()}
+
+    df = pd.DataFrame(columns) 
 
     assert df.shape == df.drop_duplicates().shape
 
@@ -348,6 +661,7 @@ def load_final_df(config):
     """
     Loads the df created after first running (1) create_analyze_chunks.py and (2) justice_filter.py 
     """
+    import pandas as pd
     df = pd.read_csv(config['final_df_path'])
     print("Loaded final df from ", config['final_df_path'])
     print("Number of rows=", len(df))
@@ -485,7 +799,7 @@ def load_backchannel_cues():
             cues.append(line.strip())
     return cues
 
-def get_bootstrap_std(df, num_bootstraps=100): 
+def get_bootstrap_std(df, num_bootstraps=100, cluster=None, seed=None): 
     """
     Runs non-parametric bootstrap for E[Y], theta_gender, and theta_ideology
     simultaneously
@@ -497,10 +811,17 @@ def get_bootstrap_std(df, num_bootstraps=100):
 
     Return standard deviations of all bootstraps
 
+    If cluster is set (a column such as 'case_id', or a list of columns), whole clusters 
+    of chunks are resampled instead, see get_cluster_bootstrap_std 
+
     Output: Dictionary 
     - keys are ey, gender, ideology, justices 
     - values are arrays/list wiht the std of the values per justice  
     """
+    if cluster is not None: 
+        return get_cluster_bootstrap_std(df, num_bootstraps, cluster, seed=seed)
+    import pandas as pd
+    from tqdm import tqdm 
     justices = sorted(df['justice_name'].unique())
 
     stuff = {
@@ -544,4 +865,246 @@ def get_bootstrap_std(df, num_bootstraps=100):
         out[key] = std
     
     out['justices'] = justices
-    return out 
\ No newline at end of file
+    return out 
+
+def cluster_index(df, cluster): 
+    """
+    CSR-style index of the chunk rows per cluster per justice (cluster == None: every chunk is its own cluster)
+
+    Output: dictionary justice name -> (rows, indptr), where rows[indptr[c]:indptr[c+1]] are the 
+    row positions in df of the justice's chunks in cluster c 
+    """
+    codes = np.arange(len(df)) if cluster is None else df.groupby(cluster, sort=False).ngroup().to_numpy()
+    index = {}
+    for justice, rows in df.groupby('justice_name').indices.items(): 
+        _, just_codes = np.unique(codes[rows], return_inverse=True)
+        order = np.argsort(just_codes, kind='stable')
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(just_codes))])
+        index[justice] = (rows[order], indptr)
+    return index
+
+def cluster_cell_sums(df, cluster, weights=None): 
+    """
+    Output: dictionary justice name -> array (num clusters x 10) with, for every cluster of the justice, 
+    the (count, sum of Y) of all chunks, F, M, ideology match = 1 and ideology match = 0 
+    (segment sums over cluster_index) 
+
+    weights (np.array, optional): chunk weights (e.g., inverse sampling fractions), the counts and sums are then weighted 
+    """
+    y = df['adv_interruption_rate'].to_numpy().astype(float)
+    cells = [np.ones(len(df), dtype=bool), 
+             df['advocate_gender'].to_numpy() == 'F', df['advocate_gender'].to_numpy() == 'M', 
+             df['ideology_matches'].to_numpy() == 1, df['ideology_matches'].to_numpy() == 0]
+    values = np.column_stack([col for cell in cells for col in (cell.astype(float), np.where(cell, y, 0))])
+    if weights is not None: values *= np.asarray(weights, dtype=float)[:, np.newaxis]
+    return {justice: np.add.reduceat(values[rows], indptr[:-1], axis=0) for justice, (rows, indptr) in cluster_index(df, cluster).items()}
+
+def estimates_from_cell_sums(totals): 
+    """
+    Inputs: totals (np.array, shape (..., 10)), cell sums as in cluster_cell_sums 
+    Output: (E[Y], theta_gender, theta_ideology), NaN where a cell is empty 
+    """
+    with np.errstate(divide='ignore', invalid='ignore'): 
+        means = totals[..., 1::2] / totals[..., 0::2]
+    return means[..., 0], means[..., 1] - means[..., 2], means[..., 3] - means[..., 4]
+
+def bootstrap_replicates(df, num_bootstraps, cluster=None, rng=None, weights=None): 
+    """
+    Bootstrap replicates of E[Y], theta_gender, and theta_ideology: for each justice, resamples 
+    the justice's clusters (cluster == None: chunks) with replacement 
+
+    The cell sums are computed once per cluster (cluster_cell_sums), so a replicate is the cluster counts 
+    drawn with replacement (multinomial) times these sums, and all replicates of a justice are one matrix product 
+
+    Output: dictionary with keys ey, gender, ideology (arrays of shape (num_bootstraps, num justices)) and justices 
+    """
+    if rng is None: rng = np.random.default_rng()
+    justices = sorted(df['justice_name'].unique())
+    return replicates_from_cell_sums(cluster_cell_sums(df, cluster, weights), justices, num_bootstraps, rng)
+
+def replicates_from_cell_sums(cell_sums, justices, num_bootstraps, rng): 
+    """
+    Same as bootstrap_replicates, from the precomputed cluster_cell_sums (e.g., to draw the replicates in batches) 
+    """
+    out = {'ey': [], 'gender': [], 'ideology': []}
+    for justice in justices: 
+        num_clusters = len(cell_sums[justice])
+        weights = rng.multinomial(num_clusters, np.full(num_clusters, 1/num_clusters), size=num_bootstraps)
+        for key, replicates in zip(['ey', 'gender', 'ideology'], estimates_from_cell_sums(weights @ cell_sums[justice])): 
+            out[key].append(replicates)
+    out = {key: np.column_stack(replicates) for key, replicates in out.items()}
+    out['justices'] = justices
+    return out 
+
+def get_cluster_bootstrap_std(df, num_bootstraps, cluster='case_id', seed=None): 
+    """
+    Cluster bootstrap for E[Y], theta_gender, and theta_ideology: for each justice, resamples 
+    the justice's clusters (e.g., cases) with replacement, keeping all the chunks of a cluster together 
+    (see bootstrap_replicates) 
+
+    Replicates where a cell is empty (e.g., no chunks with a female advocate) are left out of the std 
+
+    Output: same as get_bootstrap_std 
+    """
+    replicates = bootstrap_replicates(df, num_bootstraps, cluster, np.random.default_rng(seed))
+    out = {key: replicate_std(replicates[key]) for key in ['ey', 'gender', 'ideology']}
+    out['justices'] = replicates['justices']
+    return out 
+
+def replicate_std(replicates): 
+    """
+    Standard deviation of the bootstrap replicates (num_bootstraps x num justices) per justice, ignoring NaN replicates 
+    """
+    return np.array([np.nanstd(col) if np.isfinite(col).any() else np.nan for col in replicates.T])
+
+def get_approx_estimates(df, sampling_fraction, weights=None, num_bootstraps=1000, seed=None): 
+    """
+    Estimates from a stratified sample of cases (create_analyze_chunks.py --approx) 
+
+    The point estimates are the (weighted) E[Y], theta_gender and theta_ideology of each justice, with weights 
+    the inverse sampling fractions of the cases' strata. The standard deviations come from the case-clustered 
+    bootstrap (cases are the sampled units), times the finite population correction sqrt(1 - sampling_fraction), 
+    i.e. they are the uncertainty of the estimate about the value on all the cases (zero for sampling_fraction = 1) 
+
+    Output: pd.DataFrame with one row per justice and effect (E[Y], theta_gender, theta_ideology) and columns 
+    estimate, std, total_num_chunks, num_cases 
+    """
+    justices = sorted(df['justice_name'].unique())
+    just_groups = df.groupby('justice_name')
+    return estimates_table(cluster_cell_sums(df, 'case_id', weights), justices, 
+                           just_groups.size()[justices].to_numpy(), just_groups['case_id'].nunique()[justices].to_numpy(), 
+                           num_bootstraps, np.random.default_rng(seed), std_factor=np.sqrt(max(0., 1 - sampling_fraction)))
+
+def estimates_table(cell_sums, justices, num_chunks, num_cases, num_bootstraps, rng, std_factor=1.): 
+    """
+    Point estimates and bootstrap standard deviations (times std_factor) of E[Y], theta_gender and theta_ideology 
+    from the cluster cell sums of each justice (see cluster_cell_sums) 
+
+    Output: pd.DataFrame with one row per justice and effect and columns estimate, std, total_num_chunks, num_cases 
+    """
+    import pandas as pd
+    point = estimates_from_cell_sums(np.stack([cell_sums[justice].sum(axis=0) for justice in justices]))
+    replicates = replicates_from_cell_sums(cell_sums, justices, num_bootstraps, rng)
+    out = []
+    for key, effect, estimates in zip(['ey', 'gender', 'ideology'], ['E[Y]', 'theta_gender', 'theta_ideology'], point): 
+        out.append(pd.DataFrame({'justice_name': justices, 'effect': effect, 'estimate': estimates, 
+                                 'std': std_factor * replicate_std(replicates[key]), 
+                                 'total_num_chunks': num_chunks, 'num_cases': num_cases}))
+    return pd.concat(out, ignore_index=True)
+
+def content_fingerprint(fnames, extra=None): 
+    """
+    sha256 hex digest over the contents of the files in fnames (in the given order) 
+    and, optionally, a json-serializable extra object (e.g. config values)
+    """
+    h = hashlib.sha256()
+    for fname in fnames: 
+        h.update(fname.encode())
+        with open(fname, 'rb') as r: 
+            for block in iter(lambda: r.read(1 << 20), b''): 
+                h.update(block)
+    if extra is not None: 
+        h.update(json.dumps(extra, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def load_or_compute_estimates(config, df=None): 
+    """
+    Returns the per-justice estimates (df_ey_j, df_theta_gender_j, df_theta_ideology_j) as in analysis.ipynb, 
+    with the bootstrap standard deviations in the "std" (E[Y]) and "theta_std" columns. 
+
+    The estimates are cached in config['estimates_path'] and only recomputed (bootstrap included) when 
+    the contents of config['final_df_path'], num_bootstrap_samples or bootstrap_cluster change. 
+
+    If config['bootstrap_cluster'] is set (e.g. "case_id"), the standard deviations come from the 
+    cluster bootstrap (see get_cluster_bootstrap_std) 
+
+    If config['bootstrap_store'] is True, the bootstrap replicates are kept in config['estimates_path']+'bootstrap/' 
+    and resumed or extended on later runs (see bootstrap_store.py) 
+    """
+    import pandas as pd
+    path = config['estimates_path']
+    extra = {'num_bootstrap_samples': config['num_bootstrap_samples']}
+    if config.get('bootstrap_cluster') is not None: extra['bootstrap_cluster'] = config['bootstrap_cluster']
+    if config.get('bootstrap_store', False): extra['bootstrap_store'] = True
+    fingerprint = content_fingerprint([config['final_df_path']], extra=extra)
+    fnames = {key: os.path.join(path, key+'.csv') for key in ['ey', 'theta_gender', 'theta_ideology']}
+    fingerprint_fname = os.path.join(path, 'fingerprint.txt')
+
+    if os.path.exists(fingerprint_fname) and all(os.path.exists(fname) for fname in fnames.values()): 
+        with open(fingerprint_fname, 'r') as r: 
+            if r.read().strip() == fingerprint: 
+                print("Loaded cached estimates from ", path)
+                return tuple(pd.read_csv(fnames[key]) for key in ['ey', 'theta_gender', 'theta_ideology'])
+
+    if df is None: df = load_final_df(config)
+    df_ey_j = calc_ey(df)
+    df_theta_gender_j = calc_theta_gender(df)
+    df_theta_ideology_j = calc_theta_ideology(df)
+
+    print("Number of bootstrap samples=", config["num_bootstrap_samples"])
+    if config.get('bootstrap_store', False): 
+        from bootstrap_store import load_or_extend_replicates
+        replicates = load_or_extend_replicates(df, config["num_bootstrap_samples"], os.path.join(path, 'bootstrap'), 
+                                               cluster=config.get('bootstrap_cluster'))
+        bootstrap_std = {key: replicate_std(replicates[key]) for key in ['ey', 'gender', 'ideology']}
+        bootstrap_std['justices'] = replicates['justices']
+    else: 
+        bootstrap_std = get_bootstrap_std(df, num_bootstraps=config["num_bootstrap_samples"], cluster=config.get('bootstrap_cluster'))
+    for df_j in [df_ey_j, df_theta_gender_j, df_theta_ideology_j]: 
+        np.testing.assert_array_equal(df_j["justice_name"].to_numpy(), np.array(bootstrap_std['justices']))
+    df_ey_j["std"] = bootstrap_std['ey']
+    df_theta_gender_j["theta_std"] = bootstrap_std['gender']
+    df_theta_ideology_j["theta_std"] = bootstrap_std['ideology']
+
+    if not os.path.exists(path): os.makedirs(path)
+    df_ey_j.to_csv(fnames['ey'], index=False)
+    df_theta_gender_j.to_csv(fnames['theta_gender'], index=False)
+    df_theta_ideology_j.to_csv(fnames['theta_ideology'], index=False)
+    with open(fingerprint_fname, 'w') as w: 
+        w.write(fingerprint)
+    print("Saved estimates to ->", path)
+    return df_ey_j, df_theta_gender_j, df_theta_ideology_j
+
+def aggregate_ci(df_local, std_column_name): 
+    r"""
+    Since we're taking the mean of the per-justice effects, this function first 
+    finds the standard deviation of the aggregate effects via 
+    
+    $\frac{1}{n}\sqrt{\sum{_{j=1}^n}\sigma^2_j}$ 
+    
+    where $\sigma^2_j$ is the variance of the bootstrap distribution for justice $j$
+    
+    Then it uses the normal method to get the CI upper limit 
+    """
+    n = len(df_local) # number of justices.
+    var = np.square(df_local[std_column_name].to_numpy())
+    sqrt_sum_var = np.sqrt(np.sum(var)) 
+    std_mean = 1/n*sqrt_sum_var#standard deviation of the mean 
+    return 1.96*std_mean #normal method 1.96*standard deviation 
+
+def ratio(e, i): 
+    return np.abs(e/i)
+
+def service_request(estimator, where=None, years=None, port=None, host='127.0.0.1', timeout=600, **params): 
+    """
+    Thin client for the analysis service (python service.py), which keeps the final dataframe loaded 
+
+    Inputs: 
+        - estimator (str): 'ey', 'theta_gender', 'theta_ideology', 'bootstrap_std' or 'mediation' 
+        - where (dict, optional): only the chunks with column == value (or in a list of values) 
+        - years (list, optional): [start, end), only the chunks with start <= case_year < end 
+        - port (int, optional): default config['service_port'] 
+        - params: passed to the estimator, e.g. num_bootstraps, cluster, seed, mediators, treatments 
+    Output: pd.DataFrame with the estimator's result 
+    """
+    import pandas as pd
+    import urllib.request, urllib.error
+    if port is None: port = load_config().get('service_port', 8765)
+    body = json.dumps(dict(params, estimator=estimator, where=where, years=years)).encode()
+    request = urllib.request.Request(f'http://{host}:{port}/estimate', data=body, headers={'Content-Type': 'application/json'})
+    try: 
+        with urllib.request.urlopen(request, timeout=timeout) as response: 
+            # nulls (NaN on the server) become NaN again in numeric columns 
+            return pd.DataFrame.from_records(json.loads(response.read())['result']).apply(lambda col: col.fillna(np.nan).infer_objects())
+    except urllib.error.HTTPError as e: 
+        raise ValueError(json.loads(e.read()).get('error', str(e)))
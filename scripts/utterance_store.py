@@ -0,0 +1,216 @@
+"""
+This file compiles the utterances of all terms into one flat store that is read with memory maps,
+so re-analyses (backchannel removal, new interruption symbols, disfluency rules, ...) do not have to
+reload the ConvoKit corpora for every term.
+
+    python utterance_store.py [--offline]
+
+builds config['utterance_store_path'] for start_year <= term < end_year with
+    - text.bin: the utf-8 text of all utterances, concatenated (in corpus order, term by term)
+    - text_offsets.npy: int64, utterance i is text.bin[text_offsets[i]:text_offsets[i+1]]
+    - ids.bin, id_offsets.npy: the utterance ids, stored the same way
+    - case.npy (int32), section.npy (int16), turn.npy (int32), speaker.npy (int32): fixed-width columns,
+      the case index, the two parts of the utterance id "<conversation>__<section>_<turn>" and the speaker index
+    - meta.json: the case ids and speakers (name and type) the indices point to, and the terms in the store
+
+The store is opened read-only with load_utterance_store. The arrays are np.memmap's, so worker processes that
+open the same store share the pages in the OS page cache instead of each holding a copy.
+
+    python utterance_store.py --recompute
+
+re-analyzes the existing chunks from the store (recompute_chunk_stats), e.g. after changing the backchannel cues or
+the interruption and disfluency rules, without reloading the corpora. The re-analyzed chunks are written to
+config['recompute_path']; config['chunk_path'] and the chunk database are left as they are.
+"""
+import os
+import json
+import argparse
+from types import SimpleNamespace
+import numpy as np
+
+from utils import (load_config, load_corpus, load_case_file, load_backchannel_cues, ensure_punkt, set_tokenizer,
+                   list_chunk_files)
+from chunk_records import read_chunk_file, CHUNK_FILE_EXTS
+
+COLUMNS = {'case': np.int32, 'section': np.int16, 'turn': np.int32, 'speaker': np.int32}
+
+def build_utterance_store(start, end, path, offline=False):
+    """
+    Output: writes the utterance store of the terms start <= year < end to path (see the top of this file)
+    """
+    if not os.path.exists(path): os.makedirs(path)
+    case_ids, case2idx = [], {}
+    speakers, speaker2idx = [], {}
+    columns = {col: [] for col in COLUMNS}
+    text_offsets, id_offsets = [0], [0]
+
+    with open(os.path.join(path, 'text.bin'), 'wb') as f_text, open(os.path.join(path, 'ids.bin'), 'wb') as f_ids:
+        for year in range(start, end, 1):
+            corpus = load_corpus("supreme-"+str(year), offline=offline)
+            for utt in corpus.iter_utterances():
+                case_id = utt.meta['case_id']
+                if case_id not in case2idx:
+                    case2idx[case_id] = len(case_ids)
+                    case_ids.append(case_id)
+                speaker_key = (utt.speaker.meta['name'], utt.speaker.meta['type'])
+                if speaker_key not in speaker2idx:
+                    speaker2idx[speaker_key] = len(speakers)
+                    speakers.append({'name': speaker_key[0], 'type': speaker_key[1]})
+                parts = utt.id.split('_')
+                columns['case'].append(case2idx[case_id])
+                columns['section'].append(int(parts[2]))
+                columns['turn'].append(int(parts[3]))
+                columns['speaker'].append(speaker2idx[speaker_key])
+
+                text = utt.text.encode('utf-8')
+                f_text.write(text)
+                text_offsets.append(text_offsets[-1] + len(text))
+                utt_id = utt.id.encode('utf-8')
+                f_ids.write(utt_id)
+                id_offsets.append(id_offsets[-1] + len(utt_id))
+            print(year, "num utterances =", len(text_offsets)-1)
+
+    np.save(os.path.join(path, 'text_offsets.npy'), np.array(text_offsets, dtype=np.int64))
+    np.save(os.path.join(path, 'id_offsets.npy'), np.array(id_offsets, dtype=np.int64))
+    for col, dtype in COLUMNS.items():
+        np.save(os.path.join(path, col+'.npy'), np.array(columns[col], dtype=dtype))
+    with open(os.path.join(path, 'meta.json'), 'w') as w:
+        json.dump({'start_year': start, 'end_year': end, 'num_utts': len(text_offsets)-1,
+                   'cases': case_ids, 'speakers': speakers}, w)
+    print("Saved utterance store to ->", path)
+
+def load_utterance_store(path):
+    """
+    Opens the utterance store in path read-only (zero-copy)
+
+    Output: dictionary with the np.memmap's "text", "text_offsets", "ids", "id_offsets", "case", "section",
+    "turn" and "speaker", and "meta" (meta.json). Use utterance_text and utterance_id to read single utterances.
+    """
+    store = {}
+    for key in ['text', 'ids']:
+        fname = os.path.join(path, key+'.bin')
+        # np.memmap cannot map an empty file
+        store[key] = np.memmap(fname, dtype=np.uint8, mode='r') if os.path.getsize(fname) > 0 else np.zeros(0, dtype=np.uint8)
+    for key in ['text_offsets', 'id_offsets'] + list(COLUMNS):
+        store[key] = np.load(os.path.join(path, key+'.npy'), mmap_mode='r')
+    with open(os.path.join(path, 'meta.json'), 'r') as r:
+        store['meta'] = json.load(r)
+    return store
+
+def utterance_text(store, i):
+    return bytes(store['text'][store['text_offsets'][i]:store['text_offsets'][i+1]]).decode('utf-8')
+
+def utterance_id(store, i):
+    return bytes(store['ids'][store['id_offsets'][i]:store['id_offsets'][i+1]]).decode('utf-8')
+
+def iter_utterance_texts(store, start=0, end=None):
+    """
+    Yields (index, utterance text) for the utterances start <= i < end, e.g. for a re-analysis pass
+    """
+    if end is None: end = store['meta']['num_utts']
+    offsets = store['text_offsets']
+    for i in range(start, end):
+        yield i, bytes(store['text'][offsets[i]:offsets[i+1]]).decode('utf-8')
+
+def case_utterance_indices(store, case_id):
+    """
+    Returns the indices of the utterances of case_id (in corpus order)
+
+    The utterances are grouped by case once per store (a stable argsort of the case column and the case ids' 
+    positions in it), so every later call is a dictionary lookup and a slice
+    """
+    if 'case_order' not in store:
+        store['case2idx'] = {case: i for i, case in enumerate(store['meta']['cases'])}
+        store['case_order'] = np.argsort(store['case'], kind='stable')
+        store['case_bounds'] = np.searchsorted(store['case'][store['case_order']], np.arange(len(store['meta']['cases'])+1))
+    case_idx = store['case2idx'][case_id]
+    return store['case_order'][store['case_bounds'][case_idx]:store['case_bounds'][case_idx+1]]
+
+class StoreCorpus:
+    """
+    A read-only view of the store with the get_utterance of a ConvoKit corpus (id, text, meta['case_id'] and 
+    speaker.meta name and type), so the feature table of create_analyze_chunks.py runs on the store unchanged.
+    Only the utterances of index_range are looked up by id.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.id2idx = {}
+
+    def index_range(self, start, end):
+        self.id2idx = {utterance_id(self.store, i): i for i in range(start, end)}
+        return list(self.id2idx)
+
+    def get_utterance(self, utt_id):
+        i = self.id2idx[utt_id]
+        speaker = self.store['meta']['speakers'][int(self.store['speaker'][i])]
+        return SimpleNamespace(id=utt_id, text=utterance_text(self.store, i),
+                               meta={'case_id': self.store['meta']['cases'][int(self.store['case'][i])]},
+                               speaker=SimpleNamespace(meta={'name': speaker['name'], 'type': speaker['type']}))
+
+def recompute_chunk_stats(config, store, min_tok_adv=20):
+    """
+    Re-analysis pass over the existing chunk files of config['chunk_path'] that reads the utterances from the store
+    instead of the ConvoKit corpora: the speaker roles, backchannels (config['exclude_backchannel'], backchannel.txt),
+    tokens, interruptions and disfluencies of the chunks' utterances are recomputed with the current rules and the
+    chunk files are written to config['recompute_path'] (same file names; config['chunk_path'] and config['chunk_db_path']
+    are not touched). Point chunk_path of a config to recompute_path to analyze them.
+
+    This is a different chunking than that of create_analyze_chunks.py: the chunk boundaries and the other chunk
+    metadata are kept, and chunks that no longer have two advocate and two justice utterances or min_tok_adv advocate
+    tokens (analyzechunks' default) are dropped, whereas analyzechunks would merge them into the next chunk. Re-run
+    create_analyze_chunks.py to re-chunk with the new rules. The timing features need the corpora and are kept as they are.
+    """
+    if os.path.abspath(config['recompute_path']) == os.path.abspath(config['chunk_path']):
+        raise ValueError(f"recompute_path must differ from chunk_path ({config['chunk_path']})")
+    from create_analyze_chunks import utterance_feature_table, add_token_features, chunk_segment_stats
+    ensure_punkt(offline=config.get('offline', False))
+    set_tokenizer(config.get("tokenizer", "nltk"), offline=config.get('offline', False))
+    caseid2stuff = load_case_file()
+    cues = load_backchannel_cues()
+    store_corpus = StoreCorpus(store)
+    num_chunks, num_dropped = 0, 0
+    for fname in sorted(list_chunk_files(config)):
+        chunks = read_chunk_file(fname)
+        if len(chunks) == 0: continue
+        cols = dict(zip(chunks.fields, chunks.columns))
+        case_id = cols['case_id'][0]
+        case_idx = case_utterance_indices(store, case_id)
+        store_corpus.index_range(int(case_idx.min()), int(case_idx.max())+1)
+        first = np.array([store_corpus.id2idx[utt_id] for utt_id in cols['utt_id_first']])
+        num_utts = np.array(cols['num_utts'])
+
+        # the feature table of the utterances from the first to the last chunk utterance, as in analyzechunks
+        table_start, table_end = int(first.min()), int((first + num_utts).max())
+        utt_ids = store_corpus.index_range(table_start, table_end)
+        table = utterance_feature_table(store_corpus, caseid2stuff, utt_ids, cues, config["exclude_backchannel"])
+        seg_rows = np.concatenate([np.arange(f - table_start, f - table_start + n) for f, n in zip(first, num_utts)])
+        seg_starts = np.concatenate([[0], np.cumsum(num_utts)[:-1]])
+        add_token_features(table, store_corpus, np.unique(seg_rows))
+        stats = chunk_segment_stats(table, seg_rows, seg_starts)
+
+        for key, values in stats.items():
+            cols[key] = values.tolist()
+        keep = np.flatnonzero((stats['num_utts_adv'] >= 2) & (stats['num_utts_justice'] >= 2) & (stats['num_toks_adv'] >= min_tok_adv))
+        cols['adv_interruption_rate'] = [a / b if b > 0 else 0. for a, b in zip(cols['num_adv_utts_interrupted'], cols['num_utts_adv'])]
+        cols['justice_interruption_rate'] = [a / b if b > 0 else 0. for a, b in zip(cols['num_justice_utts_interrupted'], cols['num_utts_justice'])]
+        chunks.columns = [[cols[name][i] for i in keep] for name in chunks.fields]
+        num_chunks += len(keep)
+        num_dropped += len(num_utts) - len(keep)
+
+        out_fname = os.path.join(config['recompute_path'], os.path.relpath(fname, config['chunk_path']))
+        os.makedirs(os.path.dirname(out_fname), exist_ok=True)
+        chunks.write(out_fname, 'columns' if fname.endswith(CHUNK_FILE_EXTS['columns']) else 'jsonl')
+    print(f"Recomputed the statistics of {num_chunks} chunks from the utterance store ({num_dropped} dropped) ->", config['recompute_path'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--offline', action='store_true', help='only use local ConvoKit corpora (also set by offline in config.yaml)')
+    parser.add_argument('--recompute', action='store_true', help='recompute the statistics of the existing chunks from the store into recompute_path (see recompute_chunk_stats)')
+    args = parser.parse_args()
+
+    config = load_config()
+    if args.recompute:
+        recompute_chunk_stats(config, load_utterance_store(config['utterance_store_path']))
+    else:
+        build_utterance_store(config['start_year'], config['end_year'], config['utterance_store_path'],
+                              offline=args.offline or config.get('offline', False))